@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# The ti_* modules are flat modules at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The caches and stores are created at import, they are kept out of the working tree
+os.environ.setdefault("TI_MINDMAP_CACHE_DIR", tempfile.mkdtemp(prefix="ti-mindmap-tests-"))
@@ -0,0 +1,68 @@
+import pandas as pd
+import ti_cache
+from ti_cache import SQLiteCache, cached_llm_call, mark_partial
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    cache = SQLiteCache("test_ttl", ttl=60)
+    now = 1_000_000.0
+    monkeypatch.setattr(ti_cache.time, "time", lambda: now)
+    cache.set("key", {"answer": 42})
+    assert cache.get("key") == {"answer": 42}
+
+    now += 61
+    assert cache.get("key") is None
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = SQLiteCache("test_lru", max_bytes=300)
+    cache.set("old", "x" * 100)
+    cache.set("recent", "y" * 100)
+    cache.get("recent")
+    cache.set("new", "z" * 100)
+
+    assert cache.get("old") is None
+    assert cache.get("new") == "z" * 100
+
+
+calls = []
+
+
+@cached_llm_call
+def fake_generator(input_text, client, ai_service_provider, deployment_name=None, on_token=None):
+    calls.append(input_text)
+    if input_text == "error":
+        return "An error occurred: HTTP 429"
+    if input_text == "partial":
+        return mark_partial(pd.DataFrame({"Indicator": ["evil.com"], "Description": [""]}))
+    return f"summary of {input_text} by {ai_service_provider}"
+
+
+def test_the_key_ignores_the_client_and_the_streaming_callback():
+    calls.clear()
+    tokens = []
+    first = fake_generator("key test", object(), "OpenAI")
+    second = fake_generator("key test", object(), "OpenAI", on_token=tokens.append)
+
+    assert first == second
+    assert calls == ["key test"]
+    # A hit gives the whole cached response to on_token
+    assert tokens == [first]
+
+
+def test_the_key_depends_on_every_other_argument():
+    calls.clear()
+    fake_generator("arguments", None, "OpenAI")
+    fake_generator("arguments", None, "MistralAI")
+    fake_generator("arguments", None, "OpenAI", deployment_name="gpt-4o")
+
+    assert len(calls) == 3
+
+
+def test_errors_and_partial_outputs_are_not_cached():
+    calls.clear()
+    for _ in range(2):
+        fake_generator("error", None, "OpenAI")
+        fake_generator("partial", None, "OpenAI")
+
+    assert calls == ["error", "partial", "error", "partial"]
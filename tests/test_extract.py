@@ -0,0 +1,39 @@
+from ti_extract import extract_markdown
+
+PARAGRAPH = "<p>The actor sent spearphishing emails, with a malicious attachment, to deliver the loader to the victims.</p>"
+
+
+def test_article_in_a_layout_container_is_kept():
+    html = (f"<html><head><title>T</title></head><body><main><div class='layout no-sidebar'>"
+            f"<h1>Report</h1>{PARAGRAPH * 3}</div></main></body></html>")
+
+    text = extract_markdown(html)
+
+    assert "Report" in text
+    assert text.count("spearphishing emails") == 3
+
+
+def test_indicator_link_lists_are_kept_and_link_blocks_dropped():
+    html = (f"<html><head><title>T</title></head><body><article>{PARAGRAPH * 2}"
+            "<ul><li><a href='/cve'>CVE-2024-3400</a></li><li><a href='/c2'>evil-update[.]com</a></li></ul>"
+            "<div class='share'><a href='#'>Twitter</a> <a href='#'>LinkedIn</a></div>"
+            "<ul><li><a href='/a'>Related post</a></li><li><a href='/b'>Another post</a></li></ul>"
+            "</article></body></html>")
+
+    text = extract_markdown(html)
+
+    assert "CVE-2024-3400" in text
+    assert "evil-update[.]com" in text
+    assert "LinkedIn" not in text
+    assert "Related post" not in text
+
+
+def test_scripts_and_navigation_are_removed():
+    html = (f"<html><body><nav><a href='/'>Home</a></nav><script>var tracking = 1;</script>"
+            f"<div>{PARAGRAPH * 3}</div></body></html>")
+
+    text = extract_markdown(html)
+
+    assert "spearphishing" in text
+    assert "tracking" not in text
+    assert "Home" not in text
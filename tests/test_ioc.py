@@ -0,0 +1,42 @@
+from ti_ioc import refang, find_iocs, extract_iocs, IOC_COLUMNS
+
+
+def test_refang():
+    assert refang("hxxp://evil[.]com/payload") == "http://evil.com/payload"
+    assert refang("admin[@]mail(dot)ru") == "admin@mail.ru"
+
+
+def test_find_iocs_types_and_order():
+    text = (
+        "The loader hxxps://cdn.evil-update[.]com/x.php contacted 185.220.101[.]4 and [2001:db8::1]. "
+        "It exploits CVE-2024-3400, drops payload.exe (d41d8cd98f00b204e9800998ecf8427e) "
+        "and mails ops@evil-update.com."
+    )
+
+    iocs = find_iocs(text)
+
+    assert iocs == [
+        ("https://cdn.evil-update.com/x.php", "URL"),
+        ("185.220.101.4", "IPv4"),
+        ("2001:db8::1", "IPv6"),
+        ("CVE-2024-3400", "CVE"),
+        ("d41d8cd98f00b204e9800998ecf8427e", "MD5"),
+        ("ops@evil-update.com", "Email"),
+    ]
+
+
+def test_file_names_and_sentence_punctuation_are_not_indicators():
+    iocs = dict(find_iocs("Open README.md and loader.ps1, then visit http://evil.com/a. Version 1.2.3 is fixed."))
+
+    assert iocs == {"http://evil.com/a": "URL"}
+
+
+def test_duplicates_are_reported_once():
+    assert find_iocs("evil.com EVIL.com evil[.]com") == [("evil.com", "Domain")]
+
+
+def test_extract_iocs_columns():
+    dataframe = extract_iocs("C2: 10.0.0.1")
+
+    assert list(dataframe.columns) == IOC_COLUMNS
+    assert dataframe.loc[0, "Virus Total URL"] == "https://www.virustotal.com/gui/ip-address/10.0.0.1"
@@ -0,0 +1,38 @@
+import pytest
+from ti_jsonstream import JsonArrayStream, parse_json_array, iter_json_objects, parse_json_object
+
+
+def test_objects_are_returned_as_soon_as_they_are_closed():
+    stream = JsonArrayStream()
+
+    assert stream.feed('```json\n[{"type": "malware", "name": "X"}, {"type": "tool",') == [{"type": "malware", "name": "X"}]
+    assert stream.feed(' "name": "Y"}]\n```') == [{"type": "tool", "name": "Y"}]
+    assert stream.finish() == []
+
+
+def test_braces_inside_strings_are_ignored():
+    assert parse_json_array('[{"pattern": "[file:name = \'a}b\']", "x": "\\"{"}]') == [{"pattern": "[file:name = 'a}b']", "x": '"{'}]
+
+
+def test_tolerated_mistakes():
+    # Objects without enclosing array and commas, and trailing commas
+    assert parse_json_array('{"a": 1,} {"b": [2,],}') == [{"a": 1}, {"b": [2]}]
+
+
+def test_truncated_object_keeps_its_complete_properties():
+    stream = JsonArrayStream()
+    objects = stream.feed('[{"a": 1}, {"b": 2, "c": "cut') + stream.finish()
+
+    assert objects == [{"a": 1}, {"b": 2}]
+
+
+def test_array_of_a_key():
+    layer = '{"name": "layer", "techniques": [{"techniqueID": "T1566"}, {"techniqueID": "T1059"}], "other": [{"x": 1}]}'
+
+    assert list(iter_json_objects([layer[:40], layer[40:]], array_key="techniques")) == [{"techniqueID": "T1566"}, {"techniqueID": "T1059"}]
+
+
+def test_parse_json_object():
+    assert parse_json_object('Here it is:\n```json\n{"summary": "x", "ttps": [],}\n```') == {"summary": "x", "ttps": []}
+    with pytest.raises(ValueError):
+        parse_json_object("no object")
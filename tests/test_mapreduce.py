@@ -0,0 +1,39 @@
+from ti_mapreduce import parse_markdown_table, merge_markdown_tables, split_markdown
+
+
+def test_parse_markdown_table_with_and_without_outer_pipes():
+    expected = (["Technique", "ID"], [["Phishing", "T1566"], ["PowerShell", "T1059.001"]])
+
+    assert parse_markdown_table("| Technique | ID |\n|---|---|\n| Phishing | T1566 |\n| PowerShell | T1059.001 |") == expected
+    assert parse_markdown_table("Table:\nTechnique | ID\n:--- | ---:\nPhishing | T1566\nPowerShell | T1059.001\n\nDone.") == expected
+    assert parse_markdown_table("no table here") == (None, [])
+
+
+def test_merge_markdown_tables():
+    tables = [
+        "| Technique | Technique ID | Comment |\n|---|---|---|\n| Phishing | T1566 | Malicious attachment |",
+        "| Technique ID | Technique | Comment |\n|---|---|---|\n| t1566 |  | Link in the email |\n| T1059 | Scripting | PowerShell |",
+        "An error occurred",
+    ]
+
+    header, rows = parse_markdown_table(merge_markdown_tables(tables, "Technique ID"))
+
+    assert header == ["Technique", "Technique ID", "Comment"]
+    assert rows == [
+        ["Phishing", "T1566", "Malicious attachment; Link in the email"],
+        ["Scripting", "T1059", "PowerShell"],
+    ]
+
+
+def test_merge_without_any_table_returns_the_first_answer():
+    assert merge_markdown_tables(["An error occurred: timeout", "nothing"], "Technique ID") == "An error occurred: timeout"
+
+
+def test_split_markdown_keeps_sections_within_the_budget():
+    text = "\n\n".join(f"# Section {i}\n\n" + "word " * 200 for i in range(6))
+
+    chunks = split_markdown(text, max_tokens=400)
+
+    assert len(chunks) > 1
+    assert all(chunk.lstrip().startswith("# Section") for chunk in chunks)
+    assert "".join(chunks).count("word") == 1200
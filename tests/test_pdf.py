@@ -0,0 +1,23 @@
+import pytest
+from reportlab.lib.styles import getSampleStyleSheet
+import ti_pdf
+from ti_pdf import table_flowables
+
+
+def test_table_flowables_are_chunked_with_the_header(monkeypatch):
+    monkeypatch.setattr(ti_pdf, "TABLE_CHUNK_ROWS", 10)
+    rows = ([f"10.0.0.{i}", "IPv4", "C2 <server> & more"] for i in range(25))
+
+    tables = list(table_flowables(["Indicator", "Type", "Description"], rows, 400, getSampleStyleSheet()["Normal"]))
+
+    assert [len(table._cellvalues) for table in tables] == [11, 11, 6]
+    for table in tables:
+        assert table.repeatRows == 1
+        assert table._cellvalues[0][0].text == "<b>Indicator</b>"
+        assert sum(table._colWidths) == pytest.approx(400)
+    # The cell text is escaped for the reportlab markup
+    assert tables[0]._cellvalues[1][2].text == "C2 &lt;server&gt; &amp; more"
+
+
+def test_no_rows_no_table():
+    assert list(table_flowables(["Indicator"], [], 400, getSampleStyleSheet()["Normal"])) == []
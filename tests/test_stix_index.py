@@ -0,0 +1,48 @@
+import stix2
+from ti_stix_index import sco_id, deduplicate_objects
+
+
+def test_sco_ids_match_the_specification():
+    domain = {"type": "domain-name", "value": "example.com"}
+    file = {"type": "file", "name": "x.exe", "hashes": {"SHA-256": "a" * 64, "MD5": "b" * 32}}
+
+    assert sco_id(domain) == stix2.DomainName(**domain).id
+    assert sco_id(file) == stix2.File(**file).id
+
+
+def test_sco_without_contributing_property():
+    assert sco_id({"type": "process", "pid": 4}) is None
+    assert sco_id({"type": "domain-name"}) is None
+
+
+def test_duplicates_are_merged_and_references_rewritten():
+    objects = [
+        {"type": "domain-name", "id": "domain-name--11111111-1111-4111-8111-111111111111", "value": "Evil.com."},
+        {"type": "domain-name", "id": "domain-name--22222222-2222-4222-8222-222222222222", "value": "evil.com"},
+        {"type": "threat-actor", "id": "threat-actor--33333333-3333-4333-8333-333333333333", "name": "APT 28", "aliases": ["Fancy Bear"]},
+        {"type": "threat-actor", "id": "threat-actor--44444444-4444-4444-8444-444444444444", "name": "apt-28", "aliases": ["Sofacy"]},
+        {"type": "relationship", "id": "relationship--55555555-5555-4555-8555-555555555555", "relationship_type": "uses",
+         "source_ref": "threat-actor--44444444-4444-4444-8444-444444444444", "target_ref": "domain-name--22222222-2222-4222-8222-222222222222"},
+        {"type": "relationship", "id": "relationship--66666666-6666-4666-8666-666666666666", "relationship_type": "uses",
+         "source_ref": "threat-actor--33333333-3333-4333-8333-333333333333", "target_ref": "domain-name--11111111-1111-4111-8111-111111111111"},
+    ]
+
+    deduplicated = [obj for _, obj in deduplicate_objects(objects)]
+
+    domain, actor, relationship = deduplicated
+    assert domain["id"] == sco_id({"type": "domain-name", "value": "evil.com"})
+    assert domain["value"] == "evil.com"
+    assert actor["id"] == "threat-actor--33333333-3333-4333-8333-333333333333"
+    assert actor["aliases"] == ["Fancy Bear", "Sofacy"]
+    assert (relationship["source_ref"], relationship["target_ref"]) == (actor["id"], domain["id"])
+    # The input objects are not modified
+    assert objects[1]["id"] == "domain-name--22222222-2222-4222-8222-222222222222"
+
+
+def test_known_objects_keep_their_identifier():
+    known = {"id": "malware--77777777-7777-4777-8777-777777777777"}
+    malware = {"type": "malware", "id": "malware--88888888-8888-4888-8888-888888888888", "name": "Loader"}
+
+    [(key, obj)] = deduplicate_objects([malware], lookup=lambda key: known if key == "malware|loader" else None)
+
+    assert (key, obj["id"]) == ("malware|loader", known["id"])
@@ -0,0 +1,48 @@
+from ti_stix_validator import validate_object, validate_objects, format_errors
+
+MALWARE = {
+    "type": "malware", "spec_version": "2.1", "id": "malware--0c7b5b88-8ff7-4a4d-aa9d-feb398cd0061",
+    "created": "2024-01-31T12:00:00Z", "modified": "2024-01-31T12:00:00Z", "name": "Loader", "is_family": True,
+}
+DOMAIN = {"type": "domain-name", "id": "domain-name--bedb4899-d24b-5401-bc86-8f6b4cc18ec7", "value": "example.com"}
+RELATIONSHIP = {
+    "type": "relationship", "spec_version": "2.1", "id": "relationship--44298a74-ba52-4f0c-87a3-1824e67d7fad",
+    "created": "2024-01-31T12:00:00Z", "modified": "2024-01-31T12:00:00Z", "relationship_type": "communicates-with",
+    "source_ref": MALWARE["id"], "target_ref": DOMAIN["id"],
+}
+
+
+def test_valid_objects():
+    valid, invalid, errors = validate_objects([MALWARE, DOMAIN, RELATIONSHIP], known_ids=set())
+
+    assert (len(valid), invalid, errors) == (3, [], [])
+
+
+def test_required_properties_and_formats():
+    errors = validate_object(dict(MALWARE, id="malware--not-a-uuid", created="31/01/2024", is_family="maybe"))
+
+    assert {error.property for error in errors} == {"id", "created", "is_family"}
+
+
+def test_name_of_malware_families():
+    assert [error.property for error in validate_object(dict(MALWARE, name=""))] == ["name"]
+    assert validate_object(dict(MALWARE, name="", is_family=False)) == []
+
+
+def test_identifier_of_another_type():
+    errors = validate_object(dict(DOMAIN, id=MALWARE["id"]))
+
+    assert [error.message for error in errors] == ["The identifier does not start with 'domain-name--'"]
+
+
+def test_dangling_references():
+    valid, invalid, errors = validate_objects([MALWARE, RELATIONSHIP], known_ids=set())
+
+    assert invalid == [RELATIONSHIP]
+    assert "does not reference any known object" in format_errors(errors)
+
+
+def test_modified_before_created():
+    errors = validate_object(dict(MALWARE, modified="2023-01-01T00:00:00Z"))
+
+    assert [error.property for error in errors] == ["modified"]
@@ -1,11 +1,11 @@
 import os
 import json
 from uuid import uuid4
-from mistralai.models.chat_completion import ChatMessage
 from langsmith import traceable
+from ti_cache import cached_llm_call
+from ti_llm import chat
+from ti_prompts import build_messages
 
-#OPENAI_MODEL = "gpt-4-1106-preview"
-OPENAI_MODEL = "gpt-4o-2024-08-06"
 
 prompt_table = """
 | Question    | Description
@@ -24,7 +24,8 @@ prompt_table = """
 
 #Function to provide ATT&CK Matrix for Enterprise layer json file
 @traceable
-def ai_fivewhats(input_text, client, service_selection, deployment_name=None):
+@cached_llm_call
+def ai_fivewhats(input_text, client, service_selection, deployment_name=None, on_token=None):
 
     # Define the SYSTEM prompt
     system_prompt_5whats = ("You are an expert in Cyber threat analisys, common structured analisys and threat intelligence. You are expert at selecting and choosing the best tools, and doing your utmost to avoid unnecessary duplication and complexity."
@@ -44,33 +45,12 @@ def ai_fivewhats(input_text, client, service_selection, deployment_name=None):
     if not input_text or not client or not service_selection:
         return "Invalid input parameters."
     
+    # Prepare the messages for the API call: the instructions and the example table come before the
+    # article, so they are a prefix identical on every call (and are no longer dropped for MistralAI)
+    messages = build_messages(f"{system_prompt_5whats}\n{system_prompt_5whats2}", text=input_text)
     try:
-        if service_selection == "OpenAI" or service_selection == "Azure OpenAI":
-            # Determine the model based on the service provider
-            model = OPENAI_MODEL if service_selection == "OpenAI" else deployment_name
-        
-            # Make the API call
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt_5whats},
-                    {"role": "user", "content": input_text},
-                    {"role": "assistant", "content": system_prompt_5whats2},
-                ],
-            )
-        
-            return response.choices[0].message.content
-            
-        elif service_selection == "MistralAI":
-            chat_response = client.chat(
-            model = "mistral-large-latest",
-            messages=[
-                ChatMessage(role="system", content=system_prompt_5whats),
-                ChatMessage(role="user", content=input_text),
-                ],
-            )
-            return chat_response.choices[0].message.content  
-
+        # Make the API call, the model is selected by ti_llm from the provider
+        return chat(client, service_selection, messages, deployment_name, on_token, task="5whats")
     except Exception as e:
         # Return a more informative error message
         return f"An error occurred while generating the table summary: {e}"
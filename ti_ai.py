@@ -1,36 +1,32 @@
-import streamlit as st
 from langchain.chains.question_answering import load_qa_chain
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_community.callbacks import get_openai_callback
 from langchain_community.vectorstores import FAISS
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings, OpenAI as langchainOAI, OpenAIEmbeddings
+from langchain_openai import AzureChatOpenAI, OpenAI as langchainOAI
 from langchain_mistralai.chat_models import ChatMistralAI as langchainMistralAI
-from langchain_mistralai import MistralAIEmbeddings
-import pandas as pd
-from mistralai.models.chat_completion import ChatMessage
 import pandas as pd
 import hashlib
-
-#OPENAI_MODEL = "gpt-4-1106-preview"
-OPENAI_MODEL = "gpt-4o-2024-08-06"
+import functools
 
 from langsmith import traceable
+from ti_cache import cached_llm_call, mark_partial
+from ti_embeddings import get_embeddings
+from ti_config import configure_tracing
+from ti_ioc import extract_iocs, refang, add_virus_total_urls, url_sha256
+from ti_mapreduce import needs_map_reduce, map_reduce, join_partials, merge_markdown_tables
+from ti_llm import chat, emit_text, MISTRAL_MODEL
+from ti_prompts import build_messages, language_of
 import os
-# Accessing the secrets from the [default] section
-langchain_tracing_v2 = st.secrets["api_keys"]["LANGCHAIN_TRACING_V2"]
-langchain_endpoint = st.secrets["api_keys"]["LANGCHAIN_ENDPOINT"]
-langchain_api_key = st.secrets["api_keys"]["LANGCHAIN_API_KEY"]
-langchain_project = st.secrets["api_keys"]["LANGCHAIN_PROJECT"]
-
-# Setting the environment variables
-os.environ["LANGCHAIN_TRACING_V2"] = langchain_tracing_v2
-os.environ["LANGCHAIN_ENDPOINT"] = langchain_endpoint
-os.environ["LANGCHAIN_API_KEY"] = langchain_api_key
-os.environ["LANGCHAIN_PROJECT"] = langchain_project
+import logging
+# Setting the LangSmith environment variables from the environment or the [api_keys] secrets
+configure_tracing()
+
+logger = logging.getLogger(__name__)
 
 # Function to summarize the blog to create a short tweet, it work for both OpenAI and Azure OpenAI
 @traceable
-def ai_summarise_tweet(input_text, client, ai_service_provider, selected_language, deployment_name=None):
+@cached_llm_call
+def ai_summarise_tweet(input_text, client, ai_service_provider, selected_language, deployment_name=None, on_token=None):
     """
     Summarizes a long text using a language model.
 
@@ -40,6 +36,7 @@ def ai_summarise_tweet(input_text, client, ai_service_provider, selected_languag
         ai_service_provider (str): The name of the AI service provider (OpenAI, Azure OpenAI or MistraAI).
         selected_language (List[str]): The list of languages to use for summarization.
         deployment_name (str): The name of the deployment to use for Azure OpenAI.
+        on_token (callable): Called with every chunk of the response as it is streamed.
 
     Returns:
         str: The summarized text.
@@ -53,36 +50,15 @@ def ai_summarise_tweet(input_text, client, ai_service_provider, selected_languag
         return "Invalid input parameters."
     
     # Combine the selected languages into a string, or default to "English" if none selected
-    language = ", ".join(selected_language) if selected_language else "English"
+    language = language_of(selected_language)
 
-    system_message = f"You are responsible for creating a short tweet in {language} for a Threat Analyst. Write a tweet summary that contains maximum 250 symbols and will summarize the main topic and the key findings relevant for a threat analyst. You can add an emoji. Add tag #timindmap"
+    system_message = "You are responsible for creating a short tweet for a Threat Analyst. Write a tweet summary that contains maximum 250 symbols and will summarize the main topic and the key findings relevant for a threat analyst. You can add an emoji. Add tag #timindmap"
    
+    # Prepare the messages for the API call, the language comes last so the system message is a cacheable prefix
+    messages = build_messages(system_message, text=input_text, instructions=f"Write the tweet in {language}.")
     try:
-        if ai_service_provider == "OpenAI" or ai_service_provider == "Azure OpenAI":
-            # Determine the model based on the service provider
-            model = OPENAI_MODEL if ai_service_provider == "OpenAI" else deployment_name
-        
-            # Make the API call
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": input_text},
-                ],
-            )
-        
-            return response.choices[0].message.content
-            
-        elif ai_service_provider == "MistralAI":
-            chat_response = client.chat(
-            model = "mistral-large-latest",
-            messages=[
-                ChatMessage(role="system", content=system_message),
-                ChatMessage(role="user", content=input_text),
-                ],
-            )
-            return chat_response.choices[0].message.content  
-
+        # Make the API call, the model is selected by ti_llm from the provider
+        return chat(client, ai_service_provider, messages, deployment_name, on_token, task="tweet")
     except Exception as e:
         # Return a more informative error message
         return f"An error occurred while generating the tweet summary: {e}"
@@ -90,7 +66,8 @@ def ai_summarise_tweet(input_text, client, ai_service_provider, selected_languag
 
 # Function to summarize the blog, it work for both OpenAI and Azure OpenAI
 @traceable
-def ai_summarise(input_text, client, ai_service_provider, selected_language, deployment_name=None):
+@cached_llm_call
+def ai_summarise(input_text, client, ai_service_provider, selected_language, deployment_name=None, on_token=None):
     """Summarizes a long text using a language model.
 
     Args:
@@ -99,6 +76,7 @@ def ai_summarise(input_text, client, ai_service_provider, selected_language, dep
         ai_service_provider (str): The name of the AI service provider (OpenAI, Azure OpenAI, or MistralAI).
         selected_language (List[str]): The list of languages to use for summarization.
         deployment_name (str): The name of the deployment to use for Azure OpenAI.  This parameter is not used for OpenAI or MistralAI.
+        on_token (callable): Called with every chunk of the response as it is streamed.
 
     Returns:
         str: The summarized text.
@@ -111,43 +89,32 @@ def ai_summarise(input_text, client, ai_service_provider, selected_language, dep
     if not input_text or not client or not ai_service_provider:
         return "Invalid input parameters."
     
+    # Reports above the token budget are summarised section by section, then the partial summaries are summarised
+    if needs_map_reduce(input_text):
+        return map_reduce(
+            input_text,
+            lambda chunk: ai_summarise(chunk, client, ai_service_provider, selected_language, deployment_name),
+            lambda partials: ai_summarise(join_partials(partials), client, ai_service_provider, selected_language, deployment_name, on_token),
+        )
+
     # Combine the selected languages into a string, or default to "English" if none selected
-    language = ", ".join(selected_language) if selected_language else "English"
+    language = language_of(selected_language)
     
     # Prepare the system message
-    system_message = f"You are responsible for summarizing in {language} a threat report for a Threat Analyst. Write a paragraph that will summarize the main topic, the key findings, and all the detailed information relevant for a threat analyst such as detection opportunity iocs and TTPs. Use the title and add an emoji. Do not generate a bullet points list but rather multiple paragraphs."
+    system_message = "You are responsible for summarizing a threat report for a Threat Analyst. Write a paragraph that will summarize the main topic, the key findings, and all the detailed information relevant for a threat analyst such as detection opportunity iocs and TTPs. Use the title and add an emoji. Do not generate a bullet points list but rather multiple paragraphs."
     
+    # Prepare the messages for the API call, the language comes last so the system message is a cacheable prefix
+    messages = build_messages(system_message, text=input_text, instructions=f"Write the summary in {language}.")
     try:
-        if ai_service_provider == "OpenAI" or ai_service_provider == "Azure OpenAI":
-            # Determine the model based on the service provider
-            model = OPENAI_MODEL if ai_service_provider == "OpenAI" else deployment_name
-        
-            # Make the API call
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": input_text},
-                ],
-            )
-        
-            return response.choices[0].message.content
-        elif ai_service_provider == "MistralAI":
-            chat_response = client.chat(
-            model = "mistral-large-latest",
-            messages=[
-                ChatMessage(role="system", content=system_message),
-                ChatMessage(role="user", content=input_text),
-                ],
-            )
-            return chat_response.choices[0].message.content
-
+        # Make the API call, the model is selected by ti_llm from the provider
+        return chat(client, ai_service_provider, messages, deployment_name, on_token, task="summary")
     except Exception as e:
         # Return a more informative error message
         return f"An error occurred while generating the summary: {e}"
 
 # Function to check if content is related to cybersecurity
 @traceable
+@cached_llm_call
 def ai_check_content_relevance(input_text, client, ai_service_provider, deployment_name=None):
     """
     Determines if the input text is related to cybersecurity.
@@ -171,34 +138,20 @@ def ai_check_content_relevance(input_text, client, ai_service_provider, deployme
     
     # Prepare the prompt
     prompt = "Determine if the following text is related to cybersecurity: \n" + input_text
+    # Prepare the messages for the API call
+    messages = [
+        {"role": "system", "content": prompt},
+    ]
     try:
-        if ai_service_provider == "OpenAI" or ai_service_provider == "Azure OpenAI":
-            # Determine the model based on the service provider
-            model = OPENAI_MODEL if ai_service_provider == "OpenAI" else deployment_name
-        
-            # Make the API call
-            response = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "system", "content": prompt}]
-            )
-        
-            return response.choices[0].message.content
-        
-        elif ai_service_provider == "MistralAI":
-            chat_response = client.chat(
-            model = "mistral-large-latest",
-            messages=[
-                ChatMessage(role="system", content=prompt),
-                ],
-            )
-            return chat_response.choices[0].message.content
-        
+        # Make the API call, the model is selected by ti_llm from the provider
+        return chat(client, ai_service_provider, messages, deployment_name, task="relevance")
     except Exception as e:
         # Return a more informative error message
         return f"An error occurred while checking content relevance: {e}"
 
 @traceable
-def ai_run_models(input_text, client, selected_language, ai_service_provider, deployment_name=None):
+@cached_llm_call
+def ai_run_models(input_text, client, selected_language, ai_service_provider, deployment_name=None, on_token=None):
     """
     Runs the AI models to generate a mindmap.
 
@@ -207,6 +160,7 @@ def ai_run_models(input_text, client, selected_language, ai_service_provider, de
         client (OpenAI): The OpenAI API client.
         selected_language (List[str]): The list of languages to use for processing.
         deployment_name (str): The name of the deployment to use for Azure OpenAI.
+        on_token (callable): Called with every chunk of the response as it is streamed.
         service_selection (str): The name of the AI service to use (OpenAI or Azure OpenAI).
 
     Returns:
@@ -220,12 +174,20 @@ def ai_run_models(input_text, client, selected_language, ai_service_provider, de
     if not input_text or not client or not ai_service_provider:
         return "Invalid input parameters."
     
+    # Reports above the token budget are condensed section by section, the mindmap is drawn from the condensed report
+    if needs_map_reduce(input_text):
+        return map_reduce(
+            input_text,
+            lambda chunk: ai_summarise(chunk, client, ai_service_provider, selected_language, deployment_name),
+            lambda partials: ai_run_models(join_partials(partials), client, selected_language, ai_service_provider, deployment_name, on_token),
+        )
+
     # Combine the selected languages into a string, or default to "English" if none selected
-    language = ", ".join(selected_language) if selected_language else "English"
-    # Define the SYSTEM prompt with guidelines for creating the mindmap
+    language = language_of(selected_language)
+    # Define the SYSTEM prompt with guidelines for creating the mindmap, the language is given after the text
     system_prompt = (
-        f"You are tasked with creating an in-depth mindmap in {language} language designed specifically for a threat analyst. "
-        f"This mindmap aims to visually organize key findings and crucial highlights from the text. Please adhere to the following guidelines in English but apply the approach to {language}: \n"
+        "You are tasked with creating an in-depth mindmap in the requested language designed specifically for a threat analyst. "
+        "This mindmap aims to visually organize key findings and crucial highlights from the text. Please adhere to the following guidelines in English but apply the approach to the requested language: \n"
         "1. Avoid using hyphens and nested parentheses in the text, as they cause errors in the Mermaid.js code. Instead, use dashes or rewrite the text to avoid nesting \n"
         "2. Limit the number of primary nodes branching from the main node to four. These primary nodes should encapsulate the top four main themes. Add detailed sub-nodes to elaborate on these themes. \n"
         "3. Incorporate icons where suitable to enhance readability and comprehension. \n"
@@ -251,42 +213,19 @@ def ai_run_models(input_text, client, selected_language, ai_service_provider, de
     assistant_prompt = (
         "mindmap\nroot(YoroTrooper Threat Analysis)\n    (Origin and Target)\n      ::icon(fa fa-crosshairs)\n      (Likely originates from Kazakhstan)\n      (Mainly targets CIS countries)\n      (Attempts to make attacks appear from Azerbaijan)\n    (TTPs)\n      ::icon(fa fa-tactics)\n      (Uses VPN exit points in Azerbaijan)\n      (Spear phishing via credential-harvesting sites)\n      (Infiltrates websites and accounts of government officials)\n      (Subtly alters actions to blur origin)\n    (Language Proficiency)\n      ::icon(fa fa-language)\n      (Fluency in Kazakh and Russian)\n      (Translates Azerbaijani to Russian for phishing attacks)\n      (Uses Uzbek language in payloads)\n    (Malware Use)\n      ::icon(fa fa-bug)\n      (Evolved from commodity malware to custom-built malware)\n      (Uses Python, PowerShell, GoLang, and Rust platforms)\n    (Investigations and Countermeasures)\n      ::icon(fa fa-search)\n      (Ongoing investigations into potential state sponsorship)\n      (Protective countermeasures highlighted)\n      (IOCs listed on GitHub for public access)"
     )
+    # Prepare the messages for the API call: instructions and example first, identical on every call
+    messages = build_messages(system_prompt, [(user_prompt, assistant_prompt)], input_text, f"Write the mindmap in {language} language.")
     try:
-        # Determine the model based on the service provider
-        if ai_service_provider == "OpenAI" or ai_service_provider == "Azure OpenAI":
-            model = OPENAI_MODEL if ai_service_provider == "OpenAI" else deployment_name
-        
-            # Make the API call for OpenAI or Azure OpenAI
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                    {"role": "assistant", "content": assistant_prompt},
-                    {"role": "user", "content": input_text},
-                ],
-            )
-        
-            return response.choices[0].message.content
-        elif ai_service_provider == "MistralAI":
-            chat_response = client.chat(
-                model="mistral-large-latest",
-                messages=[
-                    ChatMessage(role="system", content=system_prompt),
-                    ChatMessage(role="user", content=user_prompt),
-                    ChatMessage(role="assistant", content=assistant_prompt),
-                    ChatMessage(role="user", content=input_text),
-                ],
-            )
-
-            return chat_response.choices[0].message.content
+        # Make the API call, the model is selected by ti_llm from the provider
+        return chat(client, ai_service_provider, messages, deployment_name, on_token, task="mindmap")
     except Exception as e:
         # Return a more informative error message
         return f"An error occurred while generating the mindmap: {e}"
 
 
 @traceable
-def ai_run_models_markmap(input_text, client, selected_language, ai_service_provider, deployment_name=None):
+@cached_llm_call
+def ai_run_models_markmap(input_text, client, selected_language, ai_service_provider, deployment_name=None, on_token=None):
     """
     Runs the AI models to generate a markmap mindmap.
 
@@ -295,6 +234,7 @@ def ai_run_models_markmap(input_text, client, selected_language, ai_service_prov
         client (OpenAI): The OpenAI API client.
         selected_language (List[str]): The list of languages to use for processing.
         deployment_name (str): The name of the deployment to use for Azure OpenAI.
+        on_token (callable): Called with every chunk of the response as it is streamed.
         service_selection (str): The name of the AI service to use (OpenAI or Azure OpenAI).
 
     Returns:
@@ -309,11 +249,11 @@ def ai_run_models_markmap(input_text, client, selected_language, ai_service_prov
         return "Invalid input parameters."
     
     # Combine the selected languages into a string, or default to "English" if none selected
-    language = ", ".join(selected_language) if selected_language else "English"
-    # Define the SYSTEM prompt with guidelines for creating the mindmap
+    language = language_of(selected_language)
+    # Define the SYSTEM prompt with guidelines for creating the mindmap, the language is given after the text
     system_prompt = (
-        f"You are tasked with creating an in-depth MarkMap mindmap in {language} language."
-        "This MarkMap-based mindmap aims to visually organize key findings and crucial highlights related to important Threat Intelligence points from the text. Please adhere to the following guidelines in English but apply the approach to {language}: \n"
+        "You are tasked with creating an in-depth MarkMap mindmap in the requested language."
+        "This MarkMap-based mindmap aims to visually organize key findings and crucial highlights related to important Threat Intelligence points from the text. Please adhere to the following guidelines in English but apply the approach to the requested language: \n"
         "1. Limit the number of primary nodes branching from the main node to up to four. These primary nodes should encapsulate the top main themes. \n"
         "2. Add sub-nodes to elaborate on these themes, these secondary nodes should provide context titles. Limit the number of secondary nodes to up to four\n"
         "3. Sub-nodes will provide very concise and relevant information for the threat analyst reviewing the mindmap, ensuring the content remains brief and straight to the point. \n"
@@ -351,33 +291,11 @@ def ai_run_models_markmap(input_text, client, selected_language, ai_service_prov
         "    - MISTPEN backdoor loaded into memory space and executed"
     )
 
+    # Prepare the messages for the API call: instructions and example first, identical on every call
+    messages = build_messages(system_prompt, [assistant_prompt], input_text, f"Write the mindmap in {language} language.")
     try:
-        # Determine the model based on the service provider
-        if ai_service_provider == "OpenAI" or ai_service_provider == "Azure OpenAI":
-            model = OPENAI_MODEL if ai_service_provider == "OpenAI" else deployment_name
-        
-            # Make the API call for OpenAI or Azure OpenAI
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "assistant", "content": assistant_prompt},
-                    {"role": "user", "content": input_text},
-                ],
-            )
-        
-            return response.choices[0].message.content
-        elif ai_service_provider == "MistralAI":
-            chat_response = client.chat(
-                model="mistral-large-latest",
-                messages=[
-                    ChatMessage(role="system", content=system_prompt),
-                    ChatMessage(role="user", content=input_text),
-                    ChatMessage(role="user", content=input_text),
-                ],
-            )
-
-            return chat_response.choices[0].message.content
+        # Make the API call, the model is selected by ti_llm from the provider
+        return chat(client, ai_service_provider, messages, deployment_name, on_token, task="markmap")
     except Exception as e:
         # Return a more informative error message
         return f"An error occurred while generating the mindmap: {e}"
@@ -385,7 +303,8 @@ def ai_run_models_markmap(input_text, client, selected_language, ai_service_prov
 
 
 @traceable
-def ai_run_models_tweet(input_text, client, selected_language, ai_service_provider, deployment_name=None):
+@cached_llm_call
+def ai_run_models_tweet(input_text, client, selected_language, ai_service_provider, deployment_name=None, on_token=None):
     """
     Creates a mindmap in the specified languages using the specified OpenAI API client.
 
@@ -394,6 +313,7 @@ def ai_run_models_tweet(input_text, client, selected_language, ai_service_provid
         client (OpenAI): The OpenAI API client to use for making requests.
         selected_language (List[str]): The list of languages to use for generating the mindmap.
         deployment_name (str): The name of the deployment to use for Azure OpenAI.
+        on_token (callable): Called with every chunk of the response as it is streamed.
         service_selection (str): The name of the AI service provider (OpenAI or Azure OpenAI).
 
     Returns:
@@ -404,45 +324,21 @@ def ai_run_models_tweet(input_text, client, selected_language, ai_service_provid
 
     """
     # Combine the selected languages into a string, or default to "English" if none selected
-    language = ", ".join(selected_language) if selected_language else "English"
+    language = language_of(selected_language)
 
-    system_prompt = f"You are tasked with creating an mindmap in {language} language designed specifically for a threat analyst. This mindmap aims to visually organize 3 or 4 brances or key findings and crucial highlights from the text, considering each branch cannot have more than 2 subbranches. Please adhere to the following guidelines in english but apply approach to {language}: \n1. Avoid using hyphens in the text, as they cause errors in the Mermaid.js code 2. Limit the number of primary nodes branching from the main node to four. These primary nodes should encapsulate the top four main themes. Add detailed sub-nodes to elaborate on these themes \n3. Incorporate icons where suitable to enhance readability and comprehension\n4. Use single parentheses around each node to give them a rounded shape.\n5. avoid using icons and emoji\n6. Do not insert spaces after the text of each line and do not use parentheses or special characters for the names of the chart fields.\n7 Start mermaid code with 'mindmap', not use as first line \n8 Don't write ``` as last line. \n9 Avoid use line with style root. \n10 Avoid close with any comment starting with # . \n11 not use theme as second line, second line must start with root syntax. \n12 special characters need to be escaped or avoided, like brackets in domain. Example: not use mail[.]kz but use mail.kz \n13 When encapsulating text within a line, avoid using additional parentheses as they can introduce ambiguity in Mermaid syntax. Instead, use dashes to enclose your text \n14 Instead of using following approach (Indicators of compromise (IOC) provided) use this: (Indicators of compromise - IOC - provided)."
+    # The language is given after the text, so the instructions and the example are a cacheable prefix
+    system_prompt = "You are tasked with creating an mindmap in the requested language designed specifically for a threat analyst. This mindmap aims to visually organize 3 or 4 brances or key findings and crucial highlights from the text, considering each branch cannot have more than 2 subbranches. Please adhere to the following guidelines in english but apply approach to the requested language: \n1. Avoid using hyphens in the text, as they cause errors in the Mermaid.js code 2. Limit the number of primary nodes branching from the main node to four. These primary nodes should encapsulate the top four main themes. Add detailed sub-nodes to elaborate on these themes \n3. Incorporate icons where suitable to enhance readability and comprehension\n4. Use single parentheses around each node to give them a rounded shape.\n5. avoid using icons and emoji\n6. Do not insert spaces after the text of each line and do not use parentheses or special characters for the names of the chart fields.\n7 Start mermaid code with 'mindmap', not use as first line \n8 Don't write ``` as last line. \n9 Avoid use line with style root. \n10 Avoid close with any comment starting with # . \n11 not use theme as second line, second line must start with root syntax. \n12 special characters need to be escaped or avoided, like brackets in domain. Example: not use mail[.]kz but use mail.kz \n13 When encapsulating text within a line, avoid using additional parentheses as they can introduce ambiguity in Mermaid syntax. Instead, use dashes to enclose your text \n14 Instead of using following approach (Indicators of compromise (IOC) provided) use this: (Indicators of compromise - IOC - provided)."
     system_prompt_user = "Title:  Threat Report Summary: Kazakhstan-associated YoroTrooper disguises origin of attacks as Azerbaijan\n\nThreat actors known as YoroTrooper, presumably originating from Kazakhstan, have been conducting cyber espionage activities, largely focusing on Commonwealth of Independent States (CIS) countries. These actors mask their origins, making their attacks appear to come from Azerbaijan. Several tactics, techniques, and procedures (TTPs) were used, including using VPN exit points in Azerbaijan and spear phishing via credential-harvesting sites. They have infiltrated websites and accounts of several government officials between May and August 2023.\n\nThe information supporting that YoroTrooper is likely based in Kazakhstan includes the use of Kazakh currency, fluency in Kazakh and Russian, and the limited targeting of Kazakh entities. Interestingly, YoroTrooper has shown a defensive interest in the website of the Kazakhstani state-owned email service (mail[.]kz), taking precautions to ensure it is not exposed to potential security vulnerabilities. The only Kazakh institution targeted was the government’s Anti-Corruption Agency.\n\nYoroTrooper subtly alters its actions to blur its origin, using various tactics to point to Azerbaijan. In addition to routinely rerouting its operations via Azerbaijan, the threat actors frequently translate Azerbaijani to Russian and draft lures in Russian before converting them to Azerbaijani for their phishing attacks. The addition of Uzbek language in their payloads since June 2023 poses another layer of obfuscation, but is likely a demonstration of the actors' multilingual abilities rather than an attempt to mask as an Uzbek adversary.\n\nIn terms of malware use, YoroTrooper has evolved from relying heavily on commodity malware to also using custom-built malware across platforms such as Python, PowerShell, GoLang, and Rust. There is evidence that this threat actor continues to learn and adapt. There has been successful intrusion into several CIS government entities, indicating possible state-backing or state interests serving as motivation.\n\nInvestigations into YoroTrooper are ongoing to determine the extent of potential state sponsorship and additionally whether there is another motivator or objective, such as financial gain through the sale of state-held information. Protective countermeasures have been highlighted. Various IOCs are listed on GitHub for public access."
     system_prompt_asistant = "mindmap\nroot(YoroTrooper Threat Analysis)\n    (Origin and Disguise)\n       ::icon(fa fa-crosshairs)\n      (Presumed origin: Kazakhstan)\n      (Disguises attacks as from Azerbaijan)\n    (TTPs and Language Use)\n      ::icon(fa fa-tactics)\n      (Uses VPNs and spear phishing)\n      (Languages: Kazakh, Russian, Azerbaijani, Uzbek)\n    (Malware Evolution)\n      ::icon(fa fa-bug)\n      (From commodity to custom malware)\n      (Platforms: Python, PowerShell, GoLang, Rust)\n"
 
 
     # Determine the model based on the service provider
     #model = "gpt-4-1106-preview" if service_selection == "OpenAI" else deployment_name
+    # Prepare the messages for the API call
+    messages = build_messages(system_prompt, [(system_prompt_user, system_prompt_asistant)], input_text, f"Write the mindmap in {language} language.")
     try:
-        if ai_service_provider == "OpenAI" or ai_service_provider == "Azure OpenAI":
-            model = OPENAI_MODEL if ai_service_provider == "OpenAI" else deployment_name
-
-            # Prepare the messages for the API call
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": system_prompt_user},
-                {"role": "assistant", "content": system_prompt_asistant},
-                {"role": "user", "content": input_text},
-            ]
-
-            # Make the API call
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-            )
-            return response.choices[0].message.content
-        elif ai_service_provider == "MistralAI":
-            chat_response = client.chat(
-                model="mistral-large-latest",
-                messages=[
-                    ChatMessage(role="system", content=system_prompt),
-                    ChatMessage(role="user", content=system_prompt_user),
-                    ChatMessage(role="assistant", content=system_prompt_asistant),
-                    ChatMessage(role="user", content=input_text),
-                ],
-            )
-            return chat_response.choices[0].message.content
-    
+        # Make the API call, the model is selected by ti_llm from the provider
+        return chat(client, ai_service_provider, messages, deployment_name, on_token, task="mindmap_tweet")
     except Exception as e:
         # Return a more informative error message
         return f"An error occurred while generating the mindmap: {e}"
@@ -483,21 +379,20 @@ def create_dataframe_from_response(response):
     
 # Function to calculate the SHA256 hash of a URL
 def calculate_sha256(url):
-    sha256_hash = hashlib.sha256(url.encode()).hexdigest()
-    return sha256_hash
+    return url_sha256(url)
 
-# Function to update VirusTotal URLs for URL type indicators in the DataFrame
+# Function to update the VirusTotal URLs of every indicator in the DataFrame, in one column-wise pass
 def update_virus_total_urls(ioc_dataframe):
-    for index, row in ioc_dataframe.iterrows():
-        if row["Type"] == "URL":
-            sha256 = calculate_sha256(row["Indicator"])
-            ioc_dataframe.at[index, "Virus Total URL"] = f"https://www.virustotal.com/gui/url/{sha256}"
-    return ioc_dataframe
+    return add_virus_total_urls(ioc_dataframe)
 
 @traceable
+@cached_llm_call
 def ai_extract_iocs(input_text, client, ai_service_provider, deployment_name=None):
     """  
-    Extract Indicators of Compromise (IOCs) from unstructured text using OpenAI's API or MistralAI.  
+    Extract Indicators of Compromise (IOCs) from unstructured text.
+
+    The indicators are found and refanged locally by ti_ioc, with their Virus Total URL. The LLM
+    (OpenAI's API or MistralAI) is only asked to describe them, and is not called when the text has no IOC.
   
     Args:  
         input_text (str): The unstructured text to extract IOCs from.  
@@ -506,59 +401,49 @@ def ai_extract_iocs(input_text, client, ai_service_provider, deployment_name=Non
         deployment_name (str): The name of the Azure OpenAI deployment to use for completions. This is only needed if ai_service_provider is "Azure OpenAI".  
   
     Returns:  
-        pd.DataFrame: A pandas DataFrame containing the extracted IOCs.  
-  
-    Raises:  
-        ValueError: If the input text is empty or the AI API client is not provided.  
+        pd.DataFrame: A pandas DataFrame containing the extracted IOCs, with the columns Indicator, Type, Description and Virus Total URL.
+            When the LLM call fails, the descriptions are empty and the DataFrame is flagged as partial
+            (see ti_cache.mark_partial), so it is neither cached nor stored.
     """  
-
+    try:
+        ioc_dataframe = extract_iocs(input_text)
+    except Exception as e:
+        return f"Failed to extract and parse IOCs: {e}"
+    if ioc_dataframe.empty:
+        return ioc_dataframe
 
     # Prepare the system message
     prompt = (
-        "You are tasked with extracting IOCs from the following blog post for a threat analyst. "
-        "Provide a structured, table-like format, with rows separated by newlines and columns by commas "
-        "with the following column: Indicator, Type, Description, Virus Total URL. Extract indicators just if you are able to find them "
-        "in the blog post provided. With reference to IP addresses, URLs, and domains, remove square brackets. "
-        "Example: tech[.]micrsofts[.]com will be tech.micrsofts.com and 27.102.113.93"
-        "Example: hxxp://27.102.113.93/inet[.]txt] will be http://27.102.113.93/inet.txt]" 
-        "In the Virus Total URL column, enter a URL composed in the following way:" 
-        "1. if type is SHA: https://www.virustotal.com/gui/file/[content of the Indicator row]"
-        "2. if type is IP: https://www.virustotal.com/gui/ip-address/[content of the Indicator row]"
-        "3. if type is URL: https://www.virustotal.com/gui/url/[SHACalculator]"
+        "You are tasked with describing the Indicators of Compromise (IOCs) found in the following blog post for a threat analyst. "
+        "For each indicator of the list, write one short sentence describing its role based on the blog post "
+        "(e.g. C2 server, phishing domain, dropped payload, exploited vulnerability). "
+        "Answer with one line per indicator, in the format: indicator | description. "
+        "Write the indicator exactly as given in the list, and do not add any other text."
     )
+    indicators = "\n".join(ioc_dataframe["Indicator"])
+    messages = build_messages(prompt, text=f"Indicators:\n{indicators}\n\nBlog post:\n{input_text}")
 
     try:
-        if ai_service_provider == "OpenAI" or ai_service_provider == "Azure OpenAI":
-            # Determine the model based on the service provider
-            model = OPENAI_MODEL if ai_service_provider == "OpenAI" else deployment_name
-
-            # Make the API call
-            response = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "system", "content": prompt + "\n\n" + input_text}],
-            )
-
-            #return create_dataframe_from_response(response)
-            ioc_dataframe = create_dataframe_from_response(response)
-        elif ai_service_provider == "MistralAI":
-            chat_response = client.chat(
-            model = "mistral-large-latest",
-            messages=[
-                ChatMessage(role="system", content=prompt + "\n\n" + input_text),
-                ],
-            )
-            #return create_dataframe_from_response(chat_response) 
-            ioc_dataframe = create_dataframe_from_response(chat_response)
-
-        return ioc_dataframe
- 
-    except Exception as e:  
-        return f"Failed to extract and parse IOCs: {e}"  
+        response_content = chat(client, ai_service_provider, messages, deployment_name, task="iocs")
+    except Exception as e:
+        # The IOCs are still useful without their descriptions, they are described again on the next call
+        logger.warning("Failed to describe the IOCs: %s", e)
+        ioc_dataframe["Description"] = ""
+        return mark_partial(ioc_dataframe)
+
+    descriptions = {}
+    for line in response_content.strip().splitlines():
+        indicator, separator, description = line.partition("|")
+        if separator:
+            descriptions[refang(indicator.strip(" `*-")).lower()] = description.strip()
+    ioc_dataframe["Description"] = ioc_dataframe["Indicator"].str.lower().map(descriptions).fillna("")
+    return ioc_dataframe
 
 
 #Extract TTPs table
 @traceable
-def ai_ttp(text, client,service_selection, deployment_name=None):
+@cached_llm_call
+def ai_ttp(text, client,service_selection, deployment_name=None, on_token=None):
     """
     This function is used to extract TTPs from a given text using the OpenAI API.
 
@@ -567,56 +452,42 @@ def ai_ttp(text, client,service_selection, deployment_name=None):
         client (OpenAI API client): The OpenAI API client used to make requests.
         service_selection (str): The service selection, either "OpenAI" or "Azure OpenAI".
         deployment_name (str): The name of the Azure OpenAI deployment.
+        on_token (callable): Called with every chunk of the response as it is streamed.
         input_text (str): The input text for the API call.
 
     Returns:
         str: The response from the API call.
     """
+    # Reports above the token budget are analysed section by section, the TTP tables are merged by technique ID
+    if needs_map_reduce(text):
+        return map_reduce(
+            text,
+            lambda chunk: ai_ttp(chunk, client, service_selection, deployment_name),
+            lambda partials: emit_text(merge_markdown_tables(partials, "technique ID"), on_token),
+        )
+
     # Define the USER prompt
     #user_prompt_ttp = (
     #        "With reference to ATT&CK Matrix for Enterprise extract TTPs (tactics and techniques) from text at the end of following prompt. \n"
     #        "For each techniques try to provide techniqueID, tactic, comment if you can get relevant content from text, producing a table with following columns: technique, technique ID, tactic, comment. \n"
     #        f"Text to work with: {text}"
     #    )
-    user_prompt_ttp = (
+    system_prompt_ttp = (
         "Using the ATT&CK Matrix for Enterprise, extract Tactics, Techniques, and Procedures (TTPs) from the provided text. \n"
         "For each identified technique, include its associated ID, tactic, and any relevant comments derived from the text. Provide output just for most imporant TTPs. \n"
-        f"Organize this information into a table with the following columns: technique, technique ID, tactic, and comment. The text to analyze is: {text}"
+        "Organize this information into a table with the following columns: technique, technique ID, tactic, and comment."
     )
+    # Prepare the messages for the API call
+    messages = build_messages(system_prompt_ttp, text=f"The text to analyze is: {text}")
     try:
-        if service_selection == "OpenAI" or service_selection == "Azure OpenAI":       
-            #Determine the model based on the service provider
-            model = OPENAI_MODEL if service_selection == "OpenAI" else deployment_name
-
-            # Prepare the messages for the API call
-            messages = [
-                {"role": "user", "content": user_prompt_ttp},
-            ]
-
-            # Make the API call
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-            )
-
-            # Return the response content
-            return response.choices[0].message.content
-    
-        elif service_selection == "MistralAI":
-            # Make the API call
-            response = client.chat(
-                model="mistral-large-latest",
-                messages=[
-                    ChatMessage(role="user", content=user_prompt_ttp),
-                    ],
-                )
-                # Return the response content
-            return response.choices[0].message.content
+        # Make the API call, the model is selected by ti_llm from the provider
+        return chat(client, service_selection, messages, deployment_name, on_token, task="ttps")
     except Exception as e:
         return f"Failed to extract TTPs: {e}"
 
 @traceable
-def ai_ttp_list(text, ttptable, client, service_selection, deployment_name=None):
+@cached_llm_call
+def ai_ttp_list(text, ttptable, client, service_selection, deployment_name=None, on_token=None):
     """
     This function takes as input a text, a table of TTPs, a client, a service selection, and a deployment name.
     The function makes an API call to the specified client using the specified service selection and deployment name,
@@ -628,54 +499,28 @@ def ai_ttp_list(text, ttptable, client, service_selection, deployment_name=None)
         client: The client to use for the API call.
         service_selection (str): The service selection to use for the API call. It can be 'OpenAI', 'Azure OpenAI', or 'MistralAI'.
         deployment_name (str): The deployment name to use for the API call. This is only used when service_selection is 'Azure OpenAI'.
+        on_token (callable): Called with every chunk of the response as it is streamed.
 
     Returns:
         str: The response content from the API call.
     """
     # Define the SYSTEM prompt
     system_prompt_ttp_list = (
-        "You are an AI assistant expert in cybersecurity, threat intelligence, and Mitre attack, assisting Infosec professionals in understanding cyber attacks."
-    )
-    # Define the USER prompt
-    user_prompt_ttp_list = (
-        f"Based on {text} and {ttptable} provide a list of TTPs order by execution time, Each line must include only Tactic and Subtactic, IDs between brackets after subtactic. \n"
+        "You are an AI assistant expert in cybersecurity, threat intelligence, and Mitre attack, assisting Infosec professionals in understanding cyber attacks. \n"
+        "Based on the text and the table of TTPs provided, provide a list of TTPs order by execution time, Each line must include only Tactic and Subtactic, IDs between brackets after subtactic. \n"
         "The Enterprise tactics names as defined by the MITRE ATT&CK framework are: Reconnaissance, Resource Development, Initial Access, Execution, Persistence, Privilege Escalation, Defense Evasion, Credential Access, Discovery, Lateral Movement, Collection, Command and Control, Exfiltration, Impact"
     )
+    # Prepare the messages for the API call, the text and the table come after the static instructions
+    messages = build_messages(system_prompt_ttp_list, text=f"Text: {text}\n\nTable of TTPs: {ttptable}")
     try:
-        if service_selection == "OpenAI" or service_selection == "Azure OpenAI":
-            #Determine the model based on the service provider
-            model = OPENAI_MODEL if service_selection == "OpenAI" else deployment_name
-
-            # Prepare the messages for the API call
-            messages = [
-                {"role": "system", "content": system_prompt_ttp_list},
-                {"role": "user", "content": user_prompt_ttp_list},
-            ]
-
-            # Make the API call
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-            )
-
-            # Return the response content
-            return response.choices[0].message.content
-        elif service_selection == "MistralAI":
-            # Make the API call
-            response = client.chat(
-                model="mistral-large-latest",
-                messages=[
-                    ChatMessage(role="system", content=system_prompt_ttp_list),
-                    ChatMessage(role="user", content=user_prompt_ttp_list),
-                ],
-            )
-            # Return the response content
-            return response.choices[0].message.content
+        # Make the API call, the model is selected by ti_llm from the provider
+        return chat(client, service_selection, messages, deployment_name, on_token, task="ttp_list")
     except Exception as e:
         return f"Failed to extract TTPs: {e}"
 
 @traceable
-def ai_ttp_graph_timeline(text, client, service_selection, deployment_name=None):
+@cached_llm_call
+def ai_ttp_graph_timeline(text, client, service_selection, deployment_name=None, on_token=None):
   """
     Generate a Mermaid.js timeline graph that illustrates the stages of a cyber attack based on the provided timeline text.
 
@@ -684,14 +529,15 @@ def ai_ttp_graph_timeline(text, client, service_selection, deployment_name=None)
         client: The OpenAI API client.
         service_selection (str): The AI service selection (OpenAI or Azure OpenAI).
         deployment_name (str): The Azure OpenAI deployment name.
+        on_token (callable): Called with every chunk of the response as it is streamed.
         input_text (str): The input text for the AI service.
 
     Returns:
         The generated Mermaid.js timeline graph as a string.
     """
-  # Define the USER prompt
-  user_prompt_ttp_graph_timeline = (
-          f"Write a Mermaid.js timeline graph that illustrates the stages of a cyber attack whose TTPs timeline is as follows: {text} .\n"
+  # Define the SYSTEM prompt, the example and the guidelines are the same on every call
+  system_prompt_ttp_graph_timeline = (
+          "Write a Mermaid.js timeline graph that illustrates the stages of a cyber attack whose TTPs timeline is given by the user.\n"
           f"As an example consider the Lazarus Group's operation named Operation Blacksmith, whose Tactics, Techniques, and Procedures (TTPs) timeline is as follows: {ttps_timeline}, and related meirmad.js code is: {mermaid_timeline}. \n"
           "Use the Enterprise tactics names as defined by the MITRE ATT&CK framework are: Reconnaissance, Resource Development, Initial Access, Execution, Persistence, Privilege Escalation, Defense Evasion, Credential Access, Discovery, Lateral Movement, Collection, Command and Control, Exfiltration, Impact"
           "Use the following guidalines to generate code: \n"
@@ -709,32 +555,11 @@ def ai_ttp_graph_timeline(text, client, service_selection, deployment_name=None)
           "12. Don't write ``` as the first and last line."
     )
 
+  # Prepare the messages for the API call
+  messages = build_messages(system_prompt_ttp_graph_timeline, text=f"The TTPs timeline of the attack is as follows: {text}")
   try:
-      if service_selection == "OpenAI" or service_selection == "Azure OpenAI":
-            #Determine the model based on the service provider
-            model = OPENAI_MODEL if service_selection == "OpenAI" else deployment_name
-
-            # Prepare the messages for the API call
-            messages = [
-                {"role": "user", "content": user_prompt_ttp_graph_timeline},
-            ]
-
-            # Make the API call
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-            )
-            return response.choices[0].message.content
-      elif service_selection == "MistralAI":     
-          # Make the API call
-          response = client.chat(
-              model="mistral-large-latest",
-              messages=[
-                  ChatMessage(role="user", content=user_prompt_ttp_graph_timeline),
-                  ],
-            )
-          # Return the response content
-          return response.choices[0].message.content
+      # Make the API call, the model is selected by ti_llm from the provider
+      return chat(client, service_selection, messages, deployment_name, on_token, task="timeline")
   except Exception as e:
       return f"Failed to extract TTPs: {e}"
 
@@ -765,19 +590,8 @@ def ai_process_text(text, service_selection, azure_api_key, azure_endpoint, embe
 
     embeddings = []
     if chunks:
-        if service_selection == "OpenAI":
-            embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
-        elif service_selection == "Azure OpenAI":
-            embeddings = AzureOpenAIEmbeddings(deployment=embedding_deployment_name,
-                                        model="text-embedding-ada-002",
-                                        azure_endpoint=azure_endpoint,
-                                        api_key=azure_api_key,
-                                        chunk_size=1,
-                                        api_version="2024-02-15-preview")
-        elif service_selection == "MistralAI":
-            embeddings = MistralAIEmbeddings(mistral_api_key=mistral_api_key, model = "mistral-embed")
-        else:
-            raise ValueError("Invalid AI service selection")
+        # Embeddings are persisted locally, so chunks already seen are not sent to the provider again
+        embeddings = get_embeddings(service_selection, azure_api_key, azure_endpoint, embedding_deployment_name, openai_api_key, mistral_api_key)
 
         if not embeddings:
             raise ValueError("Embeddings list is empty. Please check the input text and the AI service configuration.")
@@ -789,6 +603,24 @@ def ai_process_text(text, service_selection, azure_api_key, azure_endpoint, embe
         knowledge_base = FAISS.from_texts(chunks, embeddings)
     return knowledge_base
 
+@functools.lru_cache(maxsize=8)
+def _qa_chain(service_selection, azure_api_key, azure_endpoint, deployment_name, openai_api_key, mistral_api_key):
+    # The LLM and its HTTP client are created once per provider and key, not for every chat message
+    if service_selection == "OpenAI":
+        llm = langchainOAI(openai_api_key=openai_api_key)
+    elif service_selection == "Azure OpenAI":
+        llm = AzureChatOpenAI(model="gpt-4-32k",
+                              deployment_name=deployment_name,
+                              api_key=azure_api_key,
+                              api_version="2023-07-01-preview",
+                              azure_endpoint=azure_endpoint
+                     )
+    elif service_selection == "MistralAI":
+        llm = langchainMistralAI(api_key=mistral_api_key, mistral_model=deployment_name or MISTRAL_MODEL)
+    else:
+        raise ValueError("Invalid AI service selection")
+    return load_qa_chain(llm, chain_type="stuff")
+
 @traceable
 def ai_get_response(knowledge_base, query, service_selection, azure_api_key, azure_endpoint, deployment_name, openai_api_key, mistral_api_key):
     """
@@ -809,22 +641,7 @@ def ai_get_response(knowledge_base, query, service_selection, azure_api_key, azu
         str: The response from the knowledge base.
     """
     docs = knowledge_base.similarity_search(query)
-
-    if service_selection == "OpenAI":
-        llm = langchainOAI(openai_api_key=openai_api_key)
-    elif service_selection == "Azure OpenAI":
-        llm = AzureChatOpenAI(model="gpt-4-32k",
-                              deployment_name=deployment_name,
-                              api_key=azure_api_key,
-                              api_version="2023-07-01-preview",
-                              azure_endpoint=azure_endpoint
-                     )
-    elif service_selection == "MistralAI":
-        llm = langchainMistralAI(api_key=mistral_api_key, mistral_model="mistral-large-latest")
-    else:
-        raise ValueError("Invalid AI service selection")
-
-    chain = load_qa_chain(llm, chain_type="stuff")
+    chain = _qa_chain(service_selection, azure_api_key, azure_endpoint, deployment_name, openai_api_key, mistral_api_key)
     with get_openai_callback() as cost:
         response = chain.invoke(input={"question": query, "input_documents": docs})
     return response["output_text"]
@@ -0,0 +1,229 @@
+"""
+Local store of the artifacts generated for each report: the sections (summary, mindmap, IOCs,
+TTPs...), the STIX objects, the images and the PDF.
+
+A report is identified by the hash of its URL, or of its text when it has no URL. Streamlit reruns,
+such as the one triggered by the download button, or a new session on the same report restore the
+outputs from the store instead of calling the LLM again. The artifacts of a report are dropped when
+its page is scraped again with a different text.
+
+The outputs depend on the generation parameters (provider, model, language, mindmap format...):
+they are stored under a variant of their name, see variant_key, so changing a parameter generates
+them again instead of restoring the outputs of other parameters.
+
+Usage:
+    python ti_artifacts.py stats
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import argparse
+from ti_cache import CACHE_DIR, ERROR_PREFIXES, is_partial
+
+# Set TI_MINDMAP_ARTIFACTS=0 to keep the outputs in the Streamlit session only
+ARTIFACTS_ENABLED = os.environ.get("TI_MINDMAP_ARTIFACTS", "1") != "0"
+ARTIFACTS_TTL = int(os.environ.get("TI_MINDMAP_ARTIFACTS_TTL", 30 * 24 * 3600))  # seconds
+
+
+def report_key(url, text=""):
+    """
+    Returns the identifier of a report: the hash of its URL, or of its text when it has no URL.
+    """
+    return hashlib.sha256((url or text or "").strip().encode("utf-8")).hexdigest()
+
+
+def variant_key(**params):
+    """
+    Returns the identifier of a set of generation parameters, e.g. the provider, model and language.
+    """
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def artifact_name(name, variant=None):
+    """
+    Returns the name under which an artifact generated with the parameters of variant is stored.
+    """
+    return f"{name}@{variant}" if variant else name
+
+
+def _storable(value):
+    # Empty outputs, partial outputs and the error messages of the generators are generated again on the next run
+    if value is None or (isinstance(value, (str, bytes, list, dict)) and not len(value)) or is_partial(value):
+        return False
+    return not (isinstance(value, str) and value.startswith(ERROR_PREFIXES))
+
+
+class ArtifactStore:
+    """
+    Artifacts of the reports, stored in a local SQLite database.
+
+    Values are pickled, one row per report and artifact name, so a large artifact such as the PDF
+    is written once and never rewritten with the others. Reports not updated for ttl seconds are
+    removed. A new connection is opened for every operation, so the store can be shared between
+    threads and between processes.
+    """
+
+    def __init__(self, name="artifacts", ttl=ARTIFACTS_TTL):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.path = os.path.join(CACHE_DIR, f"{name}.sqlite3")
+        self.ttl = ttl
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                "report TEXT NOT NULL, name TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "updated REAL NOT NULL, PRIMARY KEY (report, name))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def open_report(self, url, text):
+        """
+        Returns the identifier of a report, after dropping its artifacts if its text has changed.
+
+        Args:
+            url (str): The URL of the report, empty for a pasted text.
+            text (str): The text of the report, as scraped.
+
+        Returns:
+            str: The identifier of the report, see report_key.
+        """
+        report = report_key(url, text)
+        if self.get(report, "text") != text:
+            self.delete(report)
+            self.set(report, "text", text)
+        return report
+
+    def get(self, report, name, default=None):
+        """
+        Returns an artifact of a report, or default if it is missing.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM artifacts WHERE report = ? AND name = ?", (report, name)).fetchone()
+        return pickle.loads(row[0]) if row else default
+
+    def get_all(self, report):
+        """
+        Returns every artifact of a report, keyed by name.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT name, value FROM artifacts WHERE report = ?", (report,)).fetchall()
+        return {name: pickle.loads(value) for name, value in rows}
+
+    def set(self, report, name, value):
+        """
+        Stores an artifact of a report. Empty values and error messages are not stored.
+        """
+        self.set_many(report, {name: value})
+
+    def set_many(self, report, values):
+        """
+        Stores several artifacts of a report at once, see set.
+        """
+        now = time.time()
+        rows = []
+        for name, value in values.items():
+            if _storable(value):
+                blob = pickle.dumps(value)
+                rows.append((report, name, blob, len(blob), now))
+        if not rows:
+            return
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO artifacts (report, name, value, size, updated) VALUES (?, ?, ?, ?, ?)", rows)
+            if self.ttl:
+                # A report is kept as long as one of its artifacts is recent
+                conn.execute("DELETE FROM artifacts WHERE report IN "
+                             "(SELECT report FROM artifacts GROUP BY report HAVING MAX(updated) < ?)", (now - self.ttl,))
+
+    def delete(self, report, names=None):
+        """
+        Removes the artifacts of a report, all of them when names is None.
+        """
+        with self._connect() as conn:
+            if names is None:
+                conn.execute("DELETE FROM artifacts WHERE report = ?", (report,))
+            else:
+                conn.executemany("DELETE FROM artifacts WHERE report = ? AND name = ?", [(report, name) for name in names])
+
+    def stats(self):
+        """
+        Returns the number of reports and artifacts in the store, and their size in bytes.
+        """
+        with self._connect() as conn:
+            reports, artifacts, size = conn.execute(
+                "SELECT COUNT(DISTINCT report), COUNT(*), COALESCE(SUM(size), 0) FROM artifacts"
+            ).fetchone()
+        return {"reports": reports, "artifacts": artifacts, "bytes": size}
+
+
+artifact_store = ArtifactStore() if ARTIFACTS_ENABLED else None
+
+
+def open_report(url, text):
+    """
+    Returns the identifier of a report, see ArtifactStore.open_report, or None when the store is disabled.
+    """
+    return artifact_store.open_report(url, text) if artifact_store and text else None
+
+
+def load_artifacts(report, variant=None):
+    """
+    Returns the artifacts of a report generated with the parameters of variant, and those stored
+    without variant, keyed by name. An empty dict when the store is disabled.
+    """
+    if not artifact_store or not report:
+        return {}
+    artifacts = {}
+    for name, value in artifact_store.get_all(report).items():
+        base, _, stored_variant = name.partition("@")
+        if not stored_variant or stored_variant == variant:
+            artifacts[base] = value
+    return artifacts
+
+
+def load_artifact(report, name, default=None, variant=None):
+    """
+    Returns an artifact of a report, default when it is missing or the store is disabled.
+    """
+    return artifact_store.get(report, artifact_name(name, variant), default) if artifact_store and report else default
+
+
+def save_artifacts(report, values, variant=None):
+    """
+    Stores artifacts of a report, when the store is enabled.
+
+    Args:
+        report (str): The identifier of the report, see open_report.
+        values (dict): The artifacts, keyed by name.
+        variant (str): The generation parameters of the artifacts, see variant_key.
+    """
+    if artifact_store and report:
+        artifact_store.set_many(report, {artifact_name(name, variant): value for name, value in values.items()})
+
+
+def delete_artifacts(report, names, variant=None):
+    """
+    Removes artifacts of a report, so they are generated again.
+    """
+    if artifact_store and report:
+        artifact_store.delete(report, [artifact_name(name, variant) for name in names])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TI Mindmap report artifacts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show the number of reports and artifacts of the store")
+    parser.parse_args(argv)
+
+    store = artifact_store or ArtifactStore()
+    print(json.dumps(store.stats(), indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
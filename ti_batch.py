@@ -0,0 +1,248 @@
+"""
+Headless batch runner for TI Mindmap.
+
+Runs the analysis pipeline (scrape, relevance check, summary, mindmap, IOCs, TTPs, STIX...) over a
+list of URLs without Streamlit and writes one result bundle per article. Articles already processed
+are skipped, so an interrupted run can simply be started again.
+
+Usage:
+    python ti_batch.py urls.txt --output-dir reports --provider "Azure OpenAI" --workers 4
+
+The input is a text file with one URL per line (lines starting with # are ignored) or a JSONL file
+with a "url" field per line. Credentials are read from the environment: OPENAI_API_KEY,
+AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_DEPLOYMENT or MISTRAL_API_KEY.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from ti_llm import get_client
+from ti_scrape import scrape_text
+from ti_mermaid import add_mermaid_theme
+from ti_ai import ai_check_content_relevance, ai_summarise, ai_summarise_tweet, ai_run_models, ai_extract_iocs, ai_ttp
+import ti_5whats
+import ti_navigator
+import ti_ttp
+import ti_stix
+import ti_oneshot
+import ti_scheduler
+import ti_ratelimit
+import ti_prompts
+
+ALL_TASKS = ["summary", "tweet", "mindmap", "iocs", "ttps", "attackpath", "timeline", "5whats", "navigator", "stix"]
+DEFAULT_TASKS = ["summary", "mindmap", "iocs", "ttps", "stix"]
+
+
+def create_client(provider):
+    """
+    Creates the API client of the selected provider from the credentials in the environment.
+
+    Returns:
+        tuple: The client and the Azure OpenAI deployment name (None for the other providers).
+    """
+    if provider == "OpenAI":
+        return get_client(provider, os.environ["OPENAI_API_KEY"]), None
+    elif provider == "Azure OpenAI":
+        client = get_client(provider, os.environ["AZURE_OPENAI_API_KEY"], os.environ["AZURE_OPENAI_ENDPOINT"])
+        return client, os.environ["AZURE_OPENAI_DEPLOYMENT"]
+    elif provider == "MistralAI":
+        return get_client(provider, os.environ["MISTRAL_API_KEY"]), None
+    raise ValueError("Invalid AI service selection")
+
+
+def read_urls(path):
+    """
+    Reads the URLs to process from a text file (one URL per line) or a JSONL file (one {"url": ...} object per line).
+    """
+    urls = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            urls.append(json.loads(line)["url"] if line.startswith("{") else line)
+    # Drop duplicates but keep the order of the feed
+    return list(dict.fromkeys(urls))
+
+
+def article_dir(output_dir, url):
+    return os.path.join(output_dir, hashlib.sha256(url.encode("utf-8")).hexdigest()[:16])
+
+
+def write_file(path, content):
+    """
+    Writes a file atomically, so a crash never leaves a truncated result behind.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def build_tasks(text, client, provider, deployment_name, selected_language, tasks, oneshot=False):
+    """
+    Builds the task graph for ti_scheduler.run_tasks with the selected generators.
+
+    With oneshot, the sections supported by ti_oneshot are generated by a single LLM call and
+    their tasks read it, the other tasks (navigator, STIX) still call the LLM on their own.
+    """
+    input_text = "Generate a Mermaid.js MindMap only using the text below:\n" + text
+    graph = {}
+    if "summary" in tasks:
+        graph["summary"] = (lambda: ai_summarise(text, client, provider, selected_language, deployment_name), ())
+    if "tweet" in tasks:
+        graph["tweet"] = (lambda: ai_summarise_tweet(text, client, provider, selected_language, deployment_name), ())
+    if "mindmap" in tasks:
+        graph["mindmap"] = (lambda: add_mermaid_theme(ai_run_models(input_text, client, selected_language, provider, deployment_name), "Default"), ())
+    if "iocs" in tasks:
+        graph["iocs"] = (lambda: ai_extract_iocs(text, client, provider, deployment_name), ())
+    # The TTPs table is extracted once, the attack path, timeline and Navigator layer are built from it without the LLM
+    if {"ttps", "attackpath", "timeline", "navigator"} & set(tasks):
+        graph["ttps"] = (lambda: ai_ttp(text, client, provider, deployment_name), ())
+    if "attackpath" in tasks:
+        graph["attackpath"] = (ti_ttp.attack_path_from_table, ("ttps",))
+    if "timeline" in tasks:
+        graph["timeline"] = (ti_ttp.timeline_from_table, ("ttps",))
+    if "5whats" in tasks:
+        graph["5whats"] = (lambda: ti_5whats.ai_fivewhats(text, client, provider, deployment_name), ())
+    if "navigator" in tasks:
+        graph["navigator"] = (ti_navigator.layer_from_table, ("ttps",))
+    if "stix" in tasks and provider != "MistralAI":
+        # Validated objects with a bounded number of corrections, all three stages share the STIX time budget
+        deadline = time.monotonic() + ti_stix.STIX_TIME_BUDGET
+        graph["stix_sdo"] = (lambda: ti_stix.generate_sdo_objects(text, client, provider, deployment_name, deadline=deadline), ())
+        graph["stix_sco"] = (lambda: ti_stix.generate_sco_objects(text, client, provider, deployment_name, deadline=deadline), ())
+        graph["stix_sro"] = (lambda sdo, sco: ti_stix.generate_sro_objects(text, sdo, sco, client, provider, deployment_name, deadline=deadline), ("stix_sdo", "stix_sco"))
+    if oneshot:
+        # The batch task names are the ti_oneshot section names
+        sections = [name for name in graph if name in ti_oneshot.ONESHOT_SECTIONS]
+        graph["oneshot"] = (lambda: ti_oneshot.oneshot_outputs(text, client, provider, selected_language, sections, deployment_name), ())
+        for name in sections:
+            if name == "mindmap":
+                graph[name] = (lambda outputs: add_mermaid_theme(outputs["mindmap"], "Default"), ("oneshot",))
+            else:
+                graph[name] = (lambda outputs, name=name: outputs[name], ("oneshot",))
+    return graph
+
+
+def process_url(url, output_dir, client, provider, deployment_name, selected_language, tasks, task_workers, oneshot=False):
+    """
+    Runs the pipeline on one article and writes its result bundle.
+
+    The bundle is a directory named after the URL hash containing result.json, written last,
+    plus article.md, iocs.csv, mindmap.mmd, navigator_layer.json and stix_bundle.json when they were generated.
+
+    Returns:
+        str: The status of the article: "done", "not_relevant" or "failed".
+    """
+    directory = article_dir(output_dir, url)
+    os.makedirs(directory, exist_ok=True)
+    result = {"url": url, "provider": provider, "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+    text = scrape_text(url)
+    if text.startswith("Failed to scrape the website"):
+        result.update(status="failed", error=text)
+    else:
+        write_file(os.path.join(directory, "article.md"), text)
+        relevance_check = ai_check_content_relevance(text, client, provider, deployment_name)
+        result["relevance"] = relevance_check
+        if "not related to cybersecurity" in relevance_check:
+            result["status"] = "not_relevant"
+        else:
+            outputs = ti_scheduler.run_tasks(build_tasks(text, client, provider, deployment_name, selected_language, tasks, oneshot), max_workers=task_workers)
+            outputs.pop("oneshot", None)
+
+            iocs = outputs.pop("iocs", None)
+            if isinstance(iocs, pd.DataFrame):
+                iocs.to_csv(os.path.join(directory, "iocs.csv"), index=False)
+                outputs["iocs"] = iocs.to_dict(orient="records")
+            elif iocs is not None:
+                outputs["iocs"] = iocs
+            if "mindmap" in outputs:
+                write_file(os.path.join(directory, "mindmap.mmd"), outputs["mindmap"])
+            if "navigator" in outputs:
+                layer = ti_navigator.parse_layer(outputs["navigator"])
+                if layer:
+                    write_file(os.path.join(directory, "navigator_layer.json"), json.dumps(layer, indent=4))
+            if "stix_sdo" in outputs:
+                # A stage that raised is reported by run_tasks as an error string, it contributes no object
+                stages = [outputs.pop(stage) for stage in ("stix_sdo", "stix_sco", "stix_sro")]
+                stix_bundle = ti_stix.create_stix_bundle(*[stage if isinstance(stage, list) else [] for stage in stages])
+                write_file(os.path.join(directory, "stix_bundle.json"), stix_bundle)
+
+            result.update(outputs)
+            result["status"] = "done"
+
+    result["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    write_file(os.path.join(directory, "result.json"), json.dumps(result, indent=4, default=str))
+    return result["status"]
+
+
+def is_processed(output_dir, url):
+    """
+    Returns True if the article already has a complete result bundle.
+    Failed articles are retried on the next run.
+    """
+    path = os.path.join(article_dir(output_dir, url), "result.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f).get("status") in ("done", "not_relevant")
+    except (OSError, json.JSONDecodeError):
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process a feed of Threat Intelligence articles without the Streamlit UI.")
+    parser.add_argument("input", help="Text file with one URL per line, or JSONL file with a \"url\" field per line")
+    parser.add_argument("--output-dir", default="reports", help="Directory receiving one result bundle per article")
+    parser.add_argument("--provider", default="OpenAI", choices=["OpenAI", "Azure OpenAI", "MistralAI"])
+    parser.add_argument("--language", action="append", help="Output language, can be repeated (default: English)")
+    parser.add_argument("--tasks", default=",".join(DEFAULT_TASKS), help=f"Comma separated tasks among {', '.join(ALL_TASKS)}, or 'all'")
+    parser.add_argument("--workers", type=int, default=4, help="Number of articles processed at the same time")
+    parser.add_argument("--task-workers", type=int, default=4, help="Number of LLM calls running at the same time for one article")
+    parser.add_argument("--oneshot", action="store_true", help="Generate the summary, tweet, mindmap, IOCs, TTPs and 5 whats with a single LLM call")
+    args = parser.parse_args(argv)
+
+    tasks = ALL_TASKS if args.tasks == "all" else [task.strip() for task in args.tasks.split(",") if task.strip()]
+    unknown = set(tasks) - set(ALL_TASKS)
+    if unknown:
+        parser.error(f"Unknown tasks: {', '.join(sorted(unknown))}")
+
+    # Batch requests share the rate limits of the deployment and give way to the interactive ones
+    ti_ratelimit.default_priority = ti_ratelimit.BATCH
+    client, deployment_name = create_client(args.provider)
+    selected_language = args.language or ["English"]
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    urls = read_urls(args.input)
+    pending = [url for url in urls if not is_processed(args.output_dir, url)]
+    print(f"{len(urls)} URLs, {len(urls) - len(pending)} already processed, {len(pending)} to go")
+
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(process_url, url, args.output_dir, client, args.provider, deployment_name, selected_language, tasks, args.task_workers, args.oneshot): url
+            for url in pending
+        }
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                status = future.result()
+            except Exception as e:
+                status = "failed"
+                print(f"[failed] {url}: {e}", file=sys.stderr)
+            statuses[status] = statuses.get(status, 0) + 1
+            print(f"[{status}] {url}")
+
+    print(", ".join(f"{count} {status}" for status, count in sorted(statuses.items())) or "Nothing to do")
+    if ti_prompts.usage_stats():
+        print("Provider prompt cache:\n" + ti_prompts.format_usage_stats())
+    return 1 if statuses.get("failed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
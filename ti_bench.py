@@ -0,0 +1,303 @@
+"""
+Benchmarks for TI Mindmap.
+
+Usage:
+    python ti_bench.py extract saved_pages/ https://example.com/blog/post.html
+    python ti_bench.py iocs reports/*/article.md
+    python ti_bench.py stix reports/*/stix_bundle.json --synthetic 1000
+    python ti_bench.py oneshot reports/*/article.md --provider "Azure OpenAI"
+    python ti_bench.py pdf --iocs 20000 --ttps 1000
+
+extract: compares the Markdown extraction of ti_extract with the former extractor (html.parser,
+<main> or <body>, markdownify over the whole subtree) on saved HTML files, directories of HTML
+files or URLs, and reports the parse time and the number of tokens sent to the LLM.
+
+iocs: measures the throughput (MB/s) of the local IOC extractor on text, Markdown or HTML files.
+
+stix: compares the local STIX validator with the former per-object stix2.parse(json.dumps(obj))
+on STIX bundles, or on a synthetic bundle of SDOs and SCOs.
+
+oneshot: generates the summary, tweet, mindmap, IOCs, TTPs and 5 whats of
+articles (Markdown files or URLs) with one LLM call per section and with the single-pass mode of
+ti_oneshot, and reports the LLM requests, prompt and completion tokens and wall-clock time of both.
+The LLM response cache is bypassed, the credentials are read from the environment as by ti_batch.
+
+pdf: writes the PDF report of a synthetic large report (long summary, IOCs and TTPs tables, a
+full-resolution screenshot) with the streaming writer of ti_pdf, to a file, and with the former
+build (every flowable in memory, full-size images, one table per section, into a BytesIO), and
+reports the pages, the time and the peak Python memory of both.
+"""
+import os
+import sys
+import time
+import json
+import uuid
+import argparse
+from bs4 import BeautifulSoup
+from markdownify import markdownify
+from ti_extract import extract_markdown, PARSER
+from ti_tokens import count_tokens
+from ti_ioc import find_iocs
+from ti_stix_validator import validate_objects
+import ti_prompts
+
+
+def legacy_extract_markdown(html):
+    # The extractor used by scrape_text before ti_extract
+    soup = BeautifulSoup(html, "html.parser")
+    main_content = soup.find('main') or soup.body
+    return markdownify(str(main_content))
+
+
+def _load_pages(inputs, extensions=(".html", ".htm")):
+    pages = []
+    for item in inputs:
+        if item.startswith(("http://", "https://")):
+            from ti_http import fetch
+            pages.append((item, fetch(item).content))
+        elif os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                if name.lower().endswith(extensions):
+                    with open(os.path.join(item, name), "rb") as f:
+                        pages.append((name, f.read()))
+        else:
+            with open(item, "rb") as f:
+                pages.append((os.path.basename(item), f.read()))
+    return pages
+
+
+def _time(function, html, repeat):
+    # Best of several runs, to leave out the noise of the first parse
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = function(html)
+        timings.append(time.perf_counter() - start)
+    return text, min(timings)
+
+
+def bench_extract(args):
+    pages = _load_pages(args.inputs)
+    if not pages:
+        print("No HTML page to benchmark", file=sys.stderr)
+        return 1
+
+    print(f"Parser backend: {PARSER}")
+    print(f"{'page':40} {'legacy ms':>10} {'new ms':>10} {'legacy tok':>11} {'new tok':>10} {'saved':>7}")
+    totals = [0, 0, 0, 0]
+    for name, html in pages:
+        legacy_text, legacy_time = _time(legacy_extract_markdown, html, args.repeat)
+        new_text, new_time = _time(extract_markdown, html, args.repeat)
+        legacy_tokens, new_tokens = count_tokens(legacy_text), count_tokens(new_text)
+        saved = 1 - new_tokens / legacy_tokens if legacy_tokens else 0
+        print(f"{name[:40]:40} {legacy_time * 1000:10.1f} {new_time * 1000:10.1f} {legacy_tokens:11} {new_tokens:10} {saved:7.0%}")
+        for i, value in enumerate((legacy_time, new_time, legacy_tokens, new_tokens)):
+            totals[i] += value
+
+    saved = 1 - totals[3] / totals[2] if totals[2] else 0
+    print(f"{'total':40} {totals[0] * 1000:10.1f} {totals[1] * 1000:10.1f} {totals[2]:11} {totals[3]:10} {saved:7.0%}")
+    return 0
+
+
+def bench_iocs(args):
+    pages = _load_pages(args.inputs, extensions=(".html", ".htm", ".md", ".txt"))
+    if not pages:
+        print("No file to benchmark", file=sys.stderr)
+        return 1
+    text = "\n".join(content.decode("utf-8", errors="replace") for _, content in pages)
+    megabytes = len(text.encode("utf-8")) / (1024 * 1024)
+
+    iocs, elapsed = _time(find_iocs, text, args.repeat)
+    print(f"{len(pages)} files, {megabytes:.2f} MB, {len(iocs)} IOCs in {elapsed * 1000:.1f} ms ({megabytes / elapsed:.1f} MB/s)")
+    return 0
+
+
+def legacy_validate_stix_objects(stix_objects):
+    # The validation used by ti_stix before ti_stix_validator, without its per-object print
+    from stix2 import parse, exceptions
+    invalid_objects = []
+    for obj in stix_objects:
+        try:
+            parse(json.dumps(obj), allow_custom=True)
+        except (exceptions.STIXError, json.JSONDecodeError):
+            invalid_objects.append(obj)
+    return not invalid_objects, invalid_objects
+
+
+def _synthetic_bundle(count):
+    timestamp = "2024-01-31T12:00:00.000Z"
+    objects = [{"type": "malware", "spec_version": "2.1", "id": f"malware--{uuid.uuid4()}", "created": timestamp,
+                "modified": timestamp, "name": "Loader", "is_family": True, "malware_types": ["trojan"]}]
+    for i in range(count):
+        sco = {"type": "ipv4-addr", "spec_version": "2.1", "id": f"ipv4-addr--{uuid.uuid4()}", "value": f"10.0.{i // 250 % 250}.{i % 250}"}
+        objects.append(sco)
+        objects.append({"type": "relationship", "spec_version": "2.1", "id": f"relationship--{uuid.uuid4()}", "created": timestamp,
+                        "modified": timestamp, "relationship_type": "communicates-with", "source_ref": objects[0]["id"], "target_ref": sco["id"]})
+    return objects
+
+
+def bench_stix(args):
+    bundles = [("synthetic", _synthetic_bundle(args.synthetic))] if args.synthetic else []
+    for path in args.inputs:
+        with open(path, encoding="utf-8") as f:
+            bundles.append((os.path.basename(path), json.load(f)["objects"]))
+    if not bundles:
+        print("No STIX bundle to benchmark, pass bundle files or --synthetic", file=sys.stderr)
+        return 1
+
+    print(f"{'bundle':30} {'objects':>8} {'stix2 ms':>10} {'local ms':>10} {'speedup':>8} {'invalid':>12}")
+    for name, objects in bundles:
+        (_, legacy_invalid), legacy_time = _time(legacy_validate_stix_objects, objects, args.repeat)
+        (_, invalid, _), local_time = _time(validate_objects, objects, args.repeat)
+        print(f"{name[:30]:30} {len(objects):8} {legacy_time * 1000:10.1f} {local_time * 1000:10.1f} "
+              f"{legacy_time / local_time:7.0f}x {len(legacy_invalid):5} / {len(invalid):<5}")
+    return 0
+
+
+def _usage_totals():
+    stats = ti_prompts.usage_stats().values()
+    return [sum(usage[name] for usage in stats) for name in ("requests", "prompt_tokens", "completion_tokens")]
+
+
+def bench_oneshot(args):
+    from ti_batch import create_client, build_tasks
+    from ti_scrape import scrape_text
+    import ti_cache
+    import ti_scheduler
+    import ti_oneshot
+
+    articles = []
+    for item in args.inputs:
+        if item.startswith(("http://", "https://")):
+            articles.append((item, scrape_text(item)))
+        else:
+            with open(item, encoding="utf-8") as f:
+                articles.append((os.path.basename(os.path.dirname(item)) or item, f.read()))
+    if not articles:
+        print("No article to benchmark", file=sys.stderr)
+        return 1
+
+    # Every call must reach the provider to be measured
+    ti_cache.LLM_CACHE_ENABLED = False
+    client, deployment_name = create_client(args.provider)
+    sections = list(ti_oneshot.ONESHOT_SECTIONS)
+    print(f"{'article':30} {'mode':9} {'requests':>8} {'prompt tok':>11} {'output tok':>11} {'seconds':>8} {'errors':>7}")
+    for name, text in articles:
+        for mode in ("per-task", "oneshot"):
+            before = _usage_totals()
+            start = time.perf_counter()
+            graph = build_tasks(text, client, args.provider, deployment_name, ["English"], sections, oneshot=mode == "oneshot")
+            outputs = ti_scheduler.run_tasks(graph, max_workers=args.task_workers)
+            elapsed = time.perf_counter() - start
+            requests, prompt_tokens, completion_tokens = [after - value for after, value in zip(_usage_totals(), before)]
+            errors = sum(1 for section in sections if isinstance(outputs.get(section), str) and outputs[section].startswith(("An error occurred", "Failed to")))
+            print(f"{name[:30]:30} {mode:9} {requests:8} {prompt_tokens:11} {completion_tokens:11} {elapsed:8.1f} {errors:7}")
+    return 0
+
+
+def _synthetic_report(iocs, ttps, paragraphs):
+    import io
+    import pandas as pd
+    from PIL import Image
+    screenshot = io.BytesIO()
+    Image.effect_noise((3000, 4000), 64).convert("RGB").save(screenshot, format="PNG")
+    summary = "\n\n".join(f"Paragraph {i}: the actor sent phishing emails with a malicious attachment, "
+                           "then used PowerShell to download the loader and moved laterally with stolen credentials. " * 3
+                           for i in range(paragraphs))
+    ioc_dataframe = pd.DataFrame({
+        "Indicator": [f"10.{i // 65025 % 255}.{i // 255 % 255}.{i % 255}" for i in range(iocs)],
+        "Type": "IPv4",
+        "Description": "Command and control server contacted by the loader",
+    })
+    ttptable = "| Technique | Technique ID | Tactic | Comment |\n|---|---|---|---|\n" + "\n".join(
+        f"| Phishing | T1566.{i % 1000:03d} | Initial Access | Spearphishing attachment number {i} |" for i in range(ttps))
+    return summary, ioc_dataframe, ttptable, {"screenshot": screenshot.getvalue()}
+
+
+def _pdf_pages(path_or_bytes):
+    import re
+    data = path_or_bytes if isinstance(path_or_bytes, bytes) else open(path_or_bytes, "rb").read()
+    return len(re.findall(rb"/Type /Page\b", data))
+
+
+def bench_pdf(args):
+    import io
+    import tempfile
+    import tracemalloc
+    import ti_pdf
+    from reportlab.platypus import SimpleDocTemplate
+
+    summary, iocs, ttptable, images = _synthetic_report(args.iocs, args.ttps, args.paragraphs)
+    images = ti_pdf.fetch_pdf_images("https://example.com/report", ti_pdf.mermaid_code_example, images)
+
+    def streamed():
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            path = f.name
+        ti_pdf.write_pdf(path, "https://example.com/report", summary, ti_pdf.mermaid_code_example, "1. Initial Access - Phishing (T1566)", images, iocs, ttptable)
+        pages = _pdf_pages(path)
+        os.remove(path)
+        return pages
+
+    def in_memory():
+        # The former build: the whole flowables list, the images at full size and one table per section
+        chunk_rows, image_dpi = ti_pdf.TABLE_CHUNK_ROWS, ti_pdf.IMAGE_DPI
+        ti_pdf.TABLE_CHUNK_ROWS, ti_pdf.IMAGE_DPI = len(iocs) + args.ttps + 1, 10 ** 6
+        try:
+            output = io.BytesIO()
+            doc = SimpleDocTemplate(output, pagesize=ti_pdf.A4)
+            doc.build(list(ti_pdf.report_flowables("https://example.com/report", summary, "1. Initial Access - Phishing (T1566)",
+                                                   images, doc.width, doc.height, iocs, ttptable)))
+            return _pdf_pages(output.getvalue())
+        finally:
+            ti_pdf.TABLE_CHUNK_ROWS, ti_pdf.IMAGE_DPI = chunk_rows, image_dpi
+
+    print(f"{'writer':10} {'pages':>6} {'seconds':>8} {'peak MB':>8}")
+    for name, function in (("streamed", streamed), ("in-memory", in_memory)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        pages = function()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:10} {pages:6} {elapsed:8.1f} {peak / 1024 / 1024:8.1f}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TI Mindmap benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    extract_parser = subparsers.add_parser("extract", help="Compare the HTML to Markdown extractors")
+    extract_parser.add_argument("inputs", nargs="+", help="Saved HTML files, directories of HTML files or URLs")
+    extract_parser.add_argument("--repeat", type=int, default=3, help="Number of runs per page, the best one is reported")
+    extract_parser.set_defaults(run=bench_extract)
+
+    iocs_parser = subparsers.add_parser("iocs", help="Measure the throughput of the local IOC extractor")
+    iocs_parser.add_argument("inputs", nargs="+", help="Text, Markdown or HTML files, directories or URLs")
+    iocs_parser.add_argument("--repeat", type=int, default=3, help="Number of runs, the best one is reported")
+    iocs_parser.set_defaults(run=bench_iocs)
+
+    stix_parser = subparsers.add_parser("stix", help="Compare the STIX validators")
+    stix_parser.add_argument("inputs", nargs="*", help="STIX 2.1 bundle files")
+    stix_parser.add_argument("--synthetic", type=int, default=0, help="Also validate a generated bundle with this many SCOs and SROs")
+    stix_parser.add_argument("--repeat", type=int, default=3, help="Number of runs per bundle, the best one is reported")
+    stix_parser.set_defaults(run=bench_stix)
+
+    oneshot_parser = subparsers.add_parser("oneshot", help="Compare the per-task and single-pass generation of a report")
+    oneshot_parser.add_argument("inputs", nargs="+", help="Articles in Markdown (e.g. reports/*/article.md) or URLs")
+    oneshot_parser.add_argument("--provider", default="OpenAI", choices=["OpenAI", "Azure OpenAI", "MistralAI"])
+    oneshot_parser.add_argument("--task-workers", type=int, default=4, help="Number of LLM calls running at the same time in the per-task mode")
+    oneshot_parser.set_defaults(run=bench_oneshot)
+
+    pdf_parser = subparsers.add_parser("pdf", help="Compare the streaming PDF writer with the former in-memory build")
+    pdf_parser.add_argument("--iocs", type=int, default=5000, help="Number of IOCs of the synthetic report")
+    pdf_parser.add_argument("--ttps", type=int, default=500, help="Number of TTPs of the synthetic report")
+    pdf_parser.add_argument("--paragraphs", type=int, default=200, help="Number of paragraphs of the synthetic summary")
+    pdf_parser.set_defaults(run=bench_pdf)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
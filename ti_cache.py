@@ -0,0 +1,184 @@
+import os
+import time
+import json
+import pickle
+import sqlite3
+import hashlib
+import inspect
+import functools
+
+# Directory holding the local caches, it can be moved with the TI_MINDMAP_CACHE_DIR environment variable
+CACHE_DIR = os.environ.get("TI_MINDMAP_CACHE_DIR", "./cache")
+
+# LLM response cache configuration
+LLM_CACHE_ENABLED = os.environ.get("TI_MINDMAP_LLM_CACHE", "1") != "0"
+LLM_CACHE_TTL = int(os.environ.get("TI_MINDMAP_LLM_CACHE_TTL", 7 * 24 * 3600))  # seconds
+LLM_CACHE_MAX_MB = int(os.environ.get("TI_MINDMAP_LLM_CACHE_MAX_MB", 256))
+
+# Values returned by the ti_* generators when the call failed, they must never be cached
+ERROR_PREFIXES = ("An error occurred", "Failed to", "Invalid input parameters")
+# Flag set in the attrs of an output degraded by a transient error (e.g. IOCs without their
+# descriptions after HTTP 429), it is returned but neither cached nor stored with the report
+PARTIAL_ATTR = "partial"
+
+
+def mark_partial(value):
+    """
+    Flags a DataFrame output as partial, see PARTIAL_ATTR, and returns it.
+    """
+    value.attrs[PARTIAL_ATTR] = True
+    return value
+
+
+def is_partial(value):
+    """
+    Tells whether an output was flagged by mark_partial.
+    """
+    return bool(getattr(value, "attrs", None) and value.attrs.get(PARTIAL_ATTR))
+
+
+class SQLiteCache:
+    """
+    Persistent key/value cache stored in a local SQLite database.
+
+    Values are pickled, entries older than ttl seconds are ignored and removed, and the least
+    recently used entries are evicted when the database grows above max_bytes. Hits and misses
+    are counted per stat name so the effectiveness of the cache can be monitored.
+    A new connection is opened for every operation, so the cache can be shared between threads
+    and between processes.
+    """
+
+    def __init__(self, name, ttl=None, max_bytes=None):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.path = os.path.join(CACHE_DIR, f"{name}.sqlite3")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, hits INTEGER NOT NULL, misses INTEGER NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _record(self, conn, stat, hit):
+        if stat:
+            conn.execute(
+                "INSERT INTO stats (name, hits, misses) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+                (stat, int(hit), int(not hit)),
+            )
+
+    def get(self, key, stat=None):
+        """
+        Returns the cached value for key, or None if it is missing or expired.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row and self.ttl and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row:
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self._record(conn, stat, row is not None)
+        return pickle.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        """
+        Stores value under key, then evicts expired and least recently used entries if needed.
+        """
+        now = time.time()
+        blob = pickle.dumps(value)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._evict(conn, now)
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self, conn, now):
+        if self.ttl:
+            conn.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl,))
+        if self.max_bytes:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                # Drop the least recently used entries until the cache fits again
+                for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+
+    def stats(self):
+        """
+        Returns the hit/miss counters per stat name together with the size of the cache.
+        """
+        with self._connect() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            counters = {name: {"hits": hits, "misses": misses} for name, hits, misses in conn.execute("SELECT name, hits, misses FROM stats")}
+        return {"entries": entries, "bytes": size, "counters": counters}
+
+
+llm_cache = SQLiteCache("llm_responses", ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024)
+
+
+def _prompt_fingerprint(func):
+    """
+    Hashes the prompt set used by a generator: the string constants of its code (prompts, model names)
+    and the module level strings it references, such as the STIX system prompts, together with the models of ti_llm.
+    Editing a prompt therefore invalidates the cached responses of that generator only.
+    """
+    code = func.__code__
+    constants = [repr(const) for const in code.co_consts if isinstance(const, (str, tuple))]
+    referenced = [func.__globals__[name] for name in code.co_names if isinstance(func.__globals__.get(name), str)]
+    # The generators select their model through ti_llm, changing it must invalidate their responses
+    from ti_llm import OPENAI_MODEL, MISTRAL_MODEL
+    return hashlib.sha256(json.dumps([constants, referenced, OPENAI_MODEL, MISTRAL_MODEL]).encode("utf-8")).hexdigest()
+
+
+def cached_llm_call(func):
+    """
+    Decorator caching the result of an LLM generator in the persistent response cache.
+
+    The cache key is content-addressed: it is built from the generator name, its prompt set and every
+    argument except the API client and the on_token streaming callback, so the provider, the model or
+    deployment, the languages and the input text are all part of it. Error messages returned by the
+    generators and the partial outputs (see mark_partial) are not cached. On a hit, on_token receives the whole cached response at once.
+    """
+    signature = inspect.signature(func)
+    # The fingerprint is computed on first use, once the module level prompts below the generator are defined
+    fingerprint = functools.lru_cache(maxsize=None)(lambda: _prompt_fingerprint(func))
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not LLM_CACHE_ENABLED:
+            return func(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        params = {name: value for name, value in bound.arguments.items() if name not in ("client", "on_token")}
+        key = hashlib.sha256(
+            json.dumps([func.__module__, func.__qualname__, fingerprint(), params], sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+        cached = llm_cache.get(key, stat=func.__name__)
+        if cached is not None:
+            if bound.arguments.get("on_token") and isinstance(cached, str):
+                bound.arguments["on_token"](cached)
+            return cached
+
+        result = func(*args, **kwargs)
+        if result is not None and not (isinstance(result, str) and result.startswith(ERROR_PREFIXES)) and not is_partial(result):
+            llm_cache.set(key, result)
+        return result
+
+    return wrapper
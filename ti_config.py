@@ -0,0 +1,37 @@
+import os
+import sys
+
+
+def get_secret(name, default=None):
+    """
+    Reads a secret from the environment, or from the [api_keys] section of the Streamlit secrets.
+
+    Streamlit is only consulted when the caller already runs inside the Streamlit app, so the
+    ti_* modules can be imported by headless tools without loading Streamlit.
+
+    Args:
+        name (str): The name of the secret, e.g. "LANGCHAIN_API_KEY" or "github_accesstoken".
+        default (str): The value returned when the secret is not configured.
+
+    Returns:
+        str: The value of the secret, or default.
+    """
+    if name in os.environ:
+        return os.environ[name]
+    if "streamlit" in sys.modules:
+        import streamlit as st
+        try:
+            return st.secrets["api_keys"][name]
+        except Exception:
+            pass
+    return default
+
+
+def configure_tracing():
+    """
+    Exports the LangSmith tracing settings to the environment variables read by langsmith.
+    """
+    for name in ("LANGCHAIN_TRACING_V2", "LANGCHAIN_ENDPOINT", "LANGCHAIN_API_KEY", "LANGCHAIN_PROJECT"):
+        value = get_secret(name)
+        if value is not None:
+            os.environ[name] = value
@@ -0,0 +1,123 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain_core.embeddings import Embeddings
+from langchain.storage import LocalFileStore
+from langchain_openai import AzureOpenAIEmbeddings, OpenAIEmbeddings
+from langchain_mistralai import MistralAIEmbeddings
+from ti_cache import CACHE_DIR
+from ti_llm import LLM_MAX_RETRIES, is_rate_limited
+from ti_tokens import count_tokens
+import ti_ratelimit
+
+# Embeddings already computed are persisted here, keyed by embedding model and chunk text
+EMBEDDINGS_STORE_DIR = os.path.join(CACHE_DIR, "embeddings")
+
+# Number of chunks packed in a single embeddings request, per provider.
+# Azure OpenAI deployments of text-embedding-ada-002 (version 2) accept up to 2048 inputs per request,
+# older ones only 16, so 16 is the safe default; it can be raised with TI_MINDMAP_EMBEDDING_BATCH_SIZE.
+EMBEDDING_BATCH_SIZE = {
+    "OpenAI": 512,
+    "Azure OpenAI": 16,
+    "MistralAI": 64,
+}
+logger = logging.getLogger(__name__)
+
+# Number of batches sent to the provider at the same time
+EMBEDDING_MAX_WORKERS = int(os.environ.get("TI_MINDMAP_EMBEDDING_MAX_WORKERS", 4))
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper sending the chunks in batches, with a bounded number of batches in flight.
+
+    Works with any LangChain embeddings class (OpenAI, Azure OpenAI, MistralAI). Each batch waits
+    for the budget of the deployment in ti_ratelimit, HTTP 429 answers are retried by the SDK of the
+    provider. The throughput of each embed_documents call is logged, and the last one is kept in
+    last_chunks_per_second.
+    """
+
+    def __init__(self, embeddings, batch_size, deployment=None, max_workers=EMBEDDING_MAX_WORKERS):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.deployment = deployment
+        self.max_workers = max_workers
+        self.last_chunks_per_second = None
+
+    def _embed_batch(self, batch):
+        if self.deployment:
+            ti_ratelimit.acquire(self.deployment, sum(count_tokens(text) for text in batch))
+        try:
+            return self.embeddings.embed_documents(batch)
+        except Exception as e:
+            if self.deployment and is_rate_limited(e):
+                ti_ratelimit.penalise(self.deployment)
+            raise
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+            vectors = [vector for batch_vectors in executor.map(self._embed_batch, batches) for vector in batch_vectors]
+        elapsed = time.monotonic() - start
+
+        self.last_chunks_per_second = len(texts) / elapsed if elapsed else float("inf")
+        logger.info("Embedded %d chunks in %d requests, %.2fs (%.1f chunks/sec)", len(texts), len(batches), elapsed, self.last_chunks_per_second)
+        return vectors
+
+    def embed_query(self, text):
+        return self._embed_batch([text])[0]
+
+
+def get_embeddings(service_selection, azure_api_key, azure_endpoint, embedding_deployment_name, openai_api_key, mistral_api_key):
+    """
+    Returns the embeddings model of the selected AI service, backed by a persistent local store.
+
+    The same chunk of text is never embedded twice by the same model, even across sessions:
+    vectors are looked up in the store first and only the missing ones are sent to the provider,
+    packed in batches that are embedded in parallel.
+
+    Args:
+        service_selection (str): The AI service to be used. Can be either "OpenAI", "Azure OpenAI", or "MistralAI".
+        azure_api_key (str): The API key for Azure OpenAI. Required if using "Azure OpenAI".
+        azure_endpoint (str): The endpoint URL for Azure OpenAI. Required if using "Azure OpenAI".
+        embedding_deployment_name (str): The name of the text-embedding-ada-002 deployment. Required if using "Azure OpenAI".
+        openai_api_key (str): The API key for the OpenAI API. Required if using "OpenAI".
+        mistral_api_key (str): The API key for the MistralAI API. Required if using "MistralAI".
+
+    Returns:
+        CacheBackedEmbeddings: The embeddings model wrapped with the persistent store.
+
+    Raises:
+        ValueError: If the service selection is invalid.
+    """
+    batch_size = int(os.environ.get("TI_MINDMAP_EMBEDDING_BATCH_SIZE", EMBEDDING_BATCH_SIZE.get(service_selection, 16)))
+
+    if service_selection == "OpenAI":
+        embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key, chunk_size=batch_size, max_retries=LLM_MAX_RETRIES)
+        namespace = f"openai-{embeddings.model}"
+        deployment = f"OpenAI:{embeddings.model}"
+    elif service_selection == "Azure OpenAI":
+        embeddings = AzureOpenAIEmbeddings(deployment=embedding_deployment_name,
+                                    model="text-embedding-ada-002",
+                                    azure_endpoint=azure_endpoint,
+                                    api_key=azure_api_key,
+                                    chunk_size=batch_size,
+                                    max_retries=LLM_MAX_RETRIES,
+                                    api_version="2024-02-15-preview")
+        namespace = f"azure-{embeddings.model}"
+        deployment = f"Azure OpenAI:{embedding_deployment_name}"
+    elif service_selection == "MistralAI":
+        embeddings = MistralAIEmbeddings(mistral_api_key=mistral_api_key, model = "mistral-embed", max_retries=LLM_MAX_RETRIES)
+        namespace = f"mistral-{embeddings.model}"
+        deployment = f"MistralAI:{embeddings.model}"
+    else:
+        raise ValueError("Invalid AI service selection")
+
+    store = LocalFileStore(EMBEDDINGS_STORE_DIR)
+    return CacheBackedEmbeddings.from_bytes_store(BatchedEmbeddings(embeddings, batch_size, deployment), store, namespace=namespace)
@@ -0,0 +1,146 @@
+import re
+from bs4 import BeautifulSoup, Comment
+from markdownify import MarkdownConverter
+from ti_ioc import find_iocs
+
+# lxml is several times faster than the pure-Python html.parser, it is used when installed
+try:
+    import lxml  # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+# Tags that never hold article text
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "iframe", "svg", "canvas", "form", "button",
+                    "input", "select", "textarea", "nav", "aside", "dialog"]
+# class / id values of navigation, share bars, comment sections, newsletters, cookie banners...
+BOILERPLATE_PATTERN = re.compile(
+    r"(^|[\s_-])(nav|navbar|menu|breadcrumbs?|sidebar|widget|footer|comments?|disqus|share|sharing|social|"
+    r"related|recommended|newsletter|subscribe|subscription|signup|cookies?|consent|banner|promo|advert|ads|"
+    r"sponsor|popup|modal|author-bio|tags|pagination)($|[\s_-])",
+    re.IGNORECASE,
+)
+# Elements holding code, tables or preformatted text are never stripped, they usually carry the IOCs
+PROTECTED_TAGS = ["pre", "code", "table"]
+# Blocks whose text is mostly links (related posts, tag clouds...) are dropped when shorter than this,
+# unless the links are indicators (CVE, IOC lists)
+LINK_BLOCK_MAX_CHARS = 400
+LINK_DENSITY_THRESHOLD = 0.6
+
+
+def _text_length(element):
+    return len(element.get_text(" ", strip=True))
+
+
+def _link_density(element):
+    text_length = _text_length(element)
+    if not text_length:
+        return 0
+    link_length = sum(_text_length(link) for link in element.find_all("a"))
+    return link_length / text_length
+
+
+def _has_ioc_links(element):
+    return bool(find_iocs(" ".join(link.get_text(" ", strip=True) for link in element.find_all("a"))))
+
+
+def _is_boilerplate(element):
+    if element.name in ("html", "body", "main", "article"):
+        return False
+    attributes = " ".join([element.get("id") or ""] + (element.get("class") or []))
+    if element.get("role") in ("navigation", "banner", "contentinfo", "complementary"):
+        return True
+    return bool(attributes.strip()) and bool(BOILERPLATE_PATTERN.search(attributes))
+
+
+def _find_content(soup):
+    """
+    Returns the element holding the article, readability style: an explicit <article> / <main>
+    when there is one, otherwise the block whose paragraphs contain the most text.
+    """
+    articles = soup.find_all("article")
+    if len(articles) == 1:
+        return articles[0]
+    main = soup.find("main") or soup.find(attrs={"role": "main"})
+    if main is not None:
+        return main
+    return _densest_block(soup) or soup.body or soup
+
+
+def _densest_block(root):
+    """
+    Returns the element of root whose paragraphs contain the most text, or None if it has no paragraph.
+    """
+    # Each paragraph gives points to its parent and half of them to its grandparent
+    scores = {}
+    nodes = {}
+    for paragraph in root.find_all(["p", "pre", "td", "li"]):
+        text = paragraph.get_text(" ", strip=True)
+        if len(text) < 25:
+            continue
+        score = 1 + text.count(",") + min(len(text) // 100, 3)
+        for parent, weight in ((paragraph.parent, 1), (paragraph.parent.parent if paragraph.parent else None, 0.5)):
+            if parent is None or parent.name in (None, "[document]"):
+                continue
+            if parent is not root and not any(ancestor is root for ancestor in parent.parents):
+                continue
+            nodes[id(parent)] = parent
+            scores[id(parent)] = scores.get(id(parent), 0) + weight * score
+    if not scores:
+        return None
+    best = max(scores, key=lambda key: scores[key] * (1 - _link_density(nodes[key])))
+    return nodes[best]
+
+
+def _strip_boilerplate(content):
+    for comment in content.find_all(string=lambda string: isinstance(string, Comment)):
+        comment.extract()
+    for element in content.find_all(BOILERPLATE_TAGS):
+        element.decompose()
+    # Protected elements, the block holding the main text and their ancestors are kept whatever
+    # their class names say, e.g. <div class="layout no-sidebar"> around the article
+    protected = set()
+    main_text = _densest_block(content)
+    for element in content.find_all(PROTECTED_TAGS) + ([main_text] if main_text is not None else []):
+        protected.add(id(element))
+        protected.update(id(parent) for parent in element.parents)
+    for element in content.find_all(True):
+        if element.decomposed or id(element) in protected:
+            continue
+        if _is_boilerplate(element):
+            element.decompose()
+        elif element.name in ("div", "section", "ul", "header", "footer") and _text_length(element) < LINK_BLOCK_MAX_CHARS \
+                and _link_density(element) > LINK_DENSITY_THRESHOLD and not _has_ioc_links(element):
+            element.decompose()
+    for element in content.find_all("img"):
+        # Inline images become data: URIs or tracking pixels in Markdown, only their alt text is useful
+        element.replace_with(element.get("alt") or "")
+    return content
+
+
+def extract_markdown(html):
+    """
+    Extracts the article of a web page as clean Markdown.
+
+    The page is parsed with lxml when it is installed, the main content is located (<article>,
+    <main> or the densest block of paragraphs) and navigation, scripts, share bars, comment
+    sections and link lists are removed before the conversion, so they are not sent to the LLM.
+
+    Args:
+        html (bytes or str): The HTML of the page.
+
+    Returns:
+        str: The Markdown of the main content of the page.
+    """
+    soup = BeautifulSoup(html, PARSER)
+    title = soup.title.get_text(strip=True) if soup.title else ""
+    content = _strip_boilerplate(_find_content(soup))
+
+    text = MarkdownConverter().convert_soup(content)
+    text = re.sub(r"[ \t]+\n", "\n", text)
+    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+
+    # Keep the page title when the content block does not start with its own heading
+    if title and not text.startswith("#") and title.lower() not in text[:300].lower():
+        text = f"# {title}\n\n{text}"
+    return text
@@ -0,0 +1,150 @@
+import time
+import socket
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ti_cache import SQLiteCache
+
+# Add user-agent to avoid issues when scraping most websites
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+# Timeouts in seconds: connection, time between two bytes, and whole download
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 20
+TOTAL_TIMEOUT = 45
+# Pages bigger than this are not downloaded
+MAX_CONTENT_BYTES = 20 * 1024 * 1024
+# Number of requests sent to the same host at the same time
+PER_HOST_LIMIT = 4
+POOL_SIZE = 32
+
+FetchResult = namedtuple("FetchResult", ["url", "status_code", "content", "headers", "from_cache"])
+
+# Pages with an ETag or a Last-Modified header are kept, so they can be revalidated with a conditional request
+http_cache = SQLiteCache("http", ttl=30 * 24 * 3600, max_bytes=512 * 1024 * 1024)
+
+
+def _create_session():
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    retries = Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=["GET", "HEAD"])
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Shared keep-alive session, connections are reused across requests and threads
+session = _create_session()
+
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+
+def _host_limit(url):
+    host = urlsplit(url).netloc.lower()
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(PER_HOST_LIMIT)
+        return _host_limits[host]
+
+
+def _abort(response):
+    # Closing the response does not wake up a thread blocked in recv(), shutting the socket down does
+    connection = getattr(response.raw, "connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+def fetch(url, headers=None, use_cache=True, timeout=TOTAL_TIMEOUT):
+    """
+    Downloads a URL through the shared connection pool.
+
+    Cached pages are revalidated with If-None-Match / If-Modified-Since, so an unchanged page
+    only costs a 304 response. The download is aborted when it takes longer than timeout seconds
+    in total or grows above MAX_CONTENT_BYTES, so a hung website can never block the caller.
+
+    Args:
+        url (str): The URL to download.
+        headers (dict): Additional request headers.
+        use_cache (bool): Whether to use the on-disk HTTP cache.
+        timeout (float): The time budget in seconds for the whole download.
+
+    Returns:
+        FetchResult: The final URL, status code, body, response headers and whether the body came from the cache.
+
+    Raises:
+        requests.exceptions.RequestException: If the request fails, times out or returns an HTTP error status.
+    """
+    request_headers = dict(headers or {})
+    cached = http_cache.get(url, stat="fetch") if use_cache else None
+    if cached:
+        if cached.get("etag"):
+            request_headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            request_headers["If-Modified-Since"] = cached["last_modified"]
+
+    deadline = time.monotonic() + timeout
+    with _host_limit(url):
+        with session.get(url, headers=request_headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=True) as response:
+            if response.status_code == 304 and cached:
+                # Refresh the entry so it is not evicted while the page is still in use
+                http_cache.set(url, cached)
+                return FetchResult(cached["url"], 200, cached["content"], cached["headers"], True)
+            response.raise_for_status()
+
+            # A server trickling bytes never hits the read timeout, so the connection is closed when the budget is spent
+            watchdog = threading.Timer(max(0, deadline - time.monotonic()), _abort, args=(response,))
+            watchdog.start()
+            try:
+                chunks = []
+                size = 0
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    size += len(chunk)
+                    if size > MAX_CONTENT_BYTES:
+                        raise requests.exceptions.ContentDecodingError(f"Response from {url} is larger than {MAX_CONTENT_BYTES} bytes")
+                    chunks.append(chunk)
+            except Exception as e:
+                if time.monotonic() >= deadline:
+                    raise requests.exceptions.Timeout(f"Download of {url} took longer than {timeout} seconds") from e
+                raise
+            finally:
+                watchdog.cancel()
+            if time.monotonic() >= deadline:
+                raise requests.exceptions.Timeout(f"Download of {url} took longer than {timeout} seconds")
+            content = b"".join(chunks)
+            response_headers = {"Content-Type": response.headers.get("Content-Type", "")}
+            final_url = response.url
+
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+
+    if use_cache and (etag or last_modified):
+        http_cache.set(url, {"url": final_url, "etag": etag, "last_modified": last_modified, "content": content, "headers": response_headers})
+    return FetchResult(final_url, response.status_code, content, response_headers, False)
+
+
+def fetch_many(urls, max_workers=8, **kwargs):
+    """
+    Downloads several URLs concurrently, respecting the per-host limit.
+
+    Returns:
+        dict: Mapping of URL to its FetchResult, or to the exception raised while downloading it.
+    """
+    def _fetch(url):
+        try:
+            return fetch(url, **kwargs)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(urls, executor.map(_fetch, urls)))
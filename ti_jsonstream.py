@@ -0,0 +1,180 @@
+import re
+import json
+
+# Commas left before a closing bracket, a frequent mistake in LLM generated JSON
+TRAILING_COMMA_PATTERN = re.compile(r",\s*([\]}])")
+
+
+def _loads(text):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(TRAILING_COMMA_PATTERN.sub(r"\1", text))
+
+
+class JsonArrayStream:
+    """
+    Incremental, tolerant parser of the JSON array produced by an LLM.
+
+    Text is fed as it is streamed by the model, and every object of the array is returned as soon as
+    its closing brace arrives, so it can be validated and displayed while the rest is generated.
+    Anything before the array (code fences, comments) is skipped, objects concatenated without
+    commas or without an enclosing array are accepted, and finish() recovers the complete
+    properties of an object cut by truncation.
+
+    Args:
+        array_key (str): When set, the objects are read from the array of this key of the top-level
+            object (e.g. "techniques" of a Navigator layer) instead of from a top-level array.
+    """
+
+    def __init__(self, array_key=None):
+        self.array_key = array_key
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self._key_chars = []
+        self.last_string = None
+        self.pending_key = None
+        self.target_depth = None
+        self.buffer = []
+        self.capturing = False
+        self.last_comma = None
+        self.errors = []
+        self.count = 0
+
+    def feed(self, text):
+        """
+        Parses the next chunk of text.
+
+        Returns:
+            list: The objects completed by this chunk.
+        """
+        objects = []
+        for char in text:
+            if self.capturing:
+                self.buffer.append(char)
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.array_key and not self.capturing:
+                        self.last_string = "".join(self._key_chars)
+                elif self.array_key and not self.capturing:
+                    self._key_chars.append(char)
+                continue
+
+            if char == '"':
+                self.in_string = True
+                self._key_chars = []
+            elif char == ":":
+                self.pending_key = self.last_string
+            elif char in "[{":
+                self._open(char)
+            elif char in "]}":
+                obj = self._close()
+                if obj is not None:
+                    objects.append(obj)
+            elif char == "," and self.capturing and len(self.stack) == self.target_depth + 1:
+                self.last_comma = len(self.buffer) - 1
+            elif char == "," and not self.capturing:
+                self.pending_key = None
+        return objects
+
+    def _open(self, char):
+        depth = len(self.stack)
+        if self.target_depth is None and not self.capturing:
+            if self.array_key is None and depth == 0:
+                # A top-level array holds the objects, top-level objects are the objects themselves
+                self.target_depth = 1 if char == "[" else 0
+            elif self.array_key is not None and char == "[" and self.pending_key == self.array_key and depth == 1:
+                self.target_depth = depth + 1
+        if char == "{" and not self.capturing and self.target_depth is not None and depth == self.target_depth:
+            self.capturing = True
+            self.buffer = ["{"]
+            self.last_comma = None
+        self.stack.append(char)
+        self.pending_key = None
+
+    def _close(self):
+        if not self.stack:
+            return None
+        self.stack.pop()
+        if self.capturing and len(self.stack) == self.target_depth:
+            self.capturing = False
+            return self._emit("".join(self.buffer))
+        if self.target_depth is not None and len(self.stack) < self.target_depth and self.array_key is not None:
+            # The array of the key is closed, another array with the same key must not be picked up
+            self.target_depth = -1
+        return None
+
+    def _emit(self, text):
+        try:
+            obj = _loads(text)
+        except json.JSONDecodeError as e:
+            self.errors.append(f"Object #{self.count + len(self.errors)} is not valid JSON: {e}")
+            return None
+        if not isinstance(obj, dict):
+            return None
+        self.count += 1
+        return obj
+
+    def finish(self):
+        """
+        Ends the stream. An object cut by truncation is returned with its complete properties only.
+
+        Returns:
+            list: The recovered object, or an empty list.
+        """
+        if not self.capturing:
+            return []
+        self.capturing = False
+        if self.last_comma is None:
+            self.errors.append("The last object was truncated")
+            return []
+        obj = self._emit("".join(self.buffer[:self.last_comma]) + "}")
+        return [obj] if obj is not None else []
+
+
+def parse_json_array(text, array_key=None):
+    """
+    Parses every object of the JSON array of a complete LLM response, with the tolerance of JsonArrayStream.
+
+    Returns:
+        list: The objects of the array.
+    """
+    stream = JsonArrayStream(array_key)
+    return stream.feed(text or "") + stream.finish()
+
+
+def iter_json_objects(chunks, array_key=None):
+    """
+    Yields the objects of a JSON array as the chunks of text of a streamed LLM response arrive.
+    """
+    stream = JsonArrayStream(array_key)
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.finish()
+
+
+def parse_json_object(text):
+    """
+    Parses the JSON object of a complete LLM response. Code block delimiters and text around the
+    object are ignored, and trailing commas are accepted.
+
+    Raises:
+        ValueError: If the text holds no valid JSON object.
+    """
+    start, end = (text or "").find("{"), (text or "").rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("The LLM did not return a JSON object")
+    try:
+        obj = _loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise ValueError(f"The LLM did not return a valid JSON object: {e}")
+    if not isinstance(obj, dict):
+        raise ValueError("The LLM did not return a JSON object")
+    return obj
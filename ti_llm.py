@@ -0,0 +1,257 @@
+"""
+Provider layer of TI Mindmap: every LLM call of the ti_* generators goes through this module.
+
+It owns one long-lived client per provider and API key, with a pooled HTTP connection, a timeout
+and retries, keeps every request within the rate limits of ti_ratelimit, selects the model of the
+provider and exposes chat (sync, async, streamed and in batches) and embeddings behind the same
+interface for OpenAI, Azure OpenAI and MistralAI.
+"""
+import os
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import ti_ratelimit
+from ti_prompts import record_usage
+from ti_tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Models used when the provider does not take a deployment name
+OPENAI_MODEL = os.environ.get("TI_MINDMAP_OPENAI_MODEL", "gpt-4o-2024-08-06")
+MISTRAL_MODEL = os.environ.get("TI_MINDMAP_MISTRAL_MODEL", "mistral-large-latest")
+OPENAI_EMBEDDING_MODEL = "text-embedding-ada-002"
+MISTRAL_EMBEDDING_MODEL = "mistral-embed"
+AZURE_API_VERSION = "2023-05-15"
+PROVIDERS = ("OpenAI", "Azure OpenAI", "MistralAI")
+
+# Every request is abandoned after LLM_TIMEOUT seconds, and retried by the SDK on connection
+# errors, HTTP 429 and 5xx responses with exponential backoff
+LLM_TIMEOUT = float(os.environ.get("TI_MINDMAP_LLM_TIMEOUT", 120))
+LLM_MAX_RETRIES = int(os.environ.get("TI_MINDMAP_LLM_MAX_RETRIES", 3))
+# Size of the connection pool of each client, shared by the threads of ti_scheduler
+LLM_MAX_CONNECTIONS = int(os.environ.get("TI_MINDMAP_LLM_MAX_CONNECTIONS", 16))
+# Number of requests of chat_many running at the same time
+LLM_BATCH_WORKERS = int(os.environ.get("TI_MINDMAP_LLM_BATCH_WORKERS", 4))
+# Tokens of the answer counted in the rate limit budget of a request, when max_tokens is not given
+LLM_OUTPUT_TOKENS = int(os.environ.get("TI_MINDMAP_LLM_OUTPUT_TOKENS", 1500))
+
+
+@functools.lru_cache(maxsize=16)
+def get_client(ai_service_provider, api_key, azure_endpoint=None, api_version=AZURE_API_VERSION):
+    """
+    Returns the client of a provider for an API key, created once per process.
+
+    Streamlit runs the script again on every interaction: reusing the client keeps its connection
+    pool, so the TLS connections to the provider are not opened again for every call.
+
+    Args:
+        ai_service_provider (str): "OpenAI", "Azure OpenAI" or "MistralAI".
+        api_key (str): The API key of the provider.
+        azure_endpoint (str): The endpoint of the Azure OpenAI resource.
+        api_version (str): The Azure OpenAI API version.
+
+    Returns:
+        The OpenAI, AzureOpenAI or MistralClient client.
+
+    Raises:
+        ValueError: If the provider is unknown.
+    """
+    if ai_service_provider in ("OpenAI", "Azure OpenAI"):
+        import httpx
+        from openai import OpenAI, AzureOpenAI
+        limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+        http_client = httpx.Client(limits=limits, timeout=LLM_TIMEOUT)
+        if ai_service_provider == "OpenAI":
+            return OpenAI(api_key=api_key, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES, http_client=http_client)
+        return AzureOpenAI(api_key=api_key, azure_endpoint=azure_endpoint, api_version=api_version,
+                           timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES, http_client=http_client)
+    if ai_service_provider == "MistralAI":
+        from mistralai.client import MistralClient
+        return MistralClient(api_key=api_key, timeout=int(LLM_TIMEOUT), max_retries=LLM_MAX_RETRIES)
+    raise ValueError("Invalid AI service selection")
+
+
+def resolve_model(ai_service_provider, deployment_name=None):
+    """
+    Returns the model of a provider: the deployment for Azure OpenAI, OPENAI_MODEL for OpenAI,
+    and the model entered by the user or MISTRAL_MODEL for MistralAI.
+    """
+    if ai_service_provider == "OpenAI":
+        return OPENAI_MODEL
+    if ai_service_provider == "Azure OpenAI":
+        return deployment_name
+    if ai_service_provider == "MistralAI":
+        return deployment_name or MISTRAL_MODEL
+    raise ValueError("Invalid AI service selection")
+
+
+def completion_text(response, on_token=None, on_usage=None):
+    """
+    Returns the text of a chat completion of OpenAI, Azure OpenAI or MistralAI.
+
+    When on_token is given the response is a stream of chunks, on_token is called with the text of
+    every chunk as soon as it arrives and the whole text is returned once the stream ends.
+
+    Args:
+        response: The completion, or the iterator of chunks of a streamed completion.
+        on_token (callable): Called with every chunk of text of a streamed completion.
+        on_usage (callable): Called with the token usage of the completion, when the provider returns it.
+
+    Returns:
+        str: The text of the completion.
+    """
+    if on_token is None:
+        if on_usage is not None and getattr(response, "usage", None):
+            on_usage(response.usage)
+        return response.choices[0].message.content
+    parts = []
+    for chunk in response:
+        # Azure OpenAI sends chunks without choices for the content filter results
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            on_token(chunk.choices[0].delta.content)
+        # The usage comes with the last chunk, when it is requested
+        if on_usage is not None and getattr(chunk, "usage", None):
+            on_usage(chunk.usage)
+    return "".join(parts)
+
+
+def openai_chat(client, on_token=None, on_usage=None, **kwargs):
+    """
+    Calls the chat completion API of OpenAI or Azure OpenAI, streaming the response when on_token is given.
+
+    Returns:
+        str: The text of the completion.
+    """
+    response = client.chat.completions.create(stream=on_token is not None, **kwargs)
+    return completion_text(response, on_token, on_usage)
+
+
+def mistral_chat(client, on_token=None, on_usage=None, **kwargs):
+    """
+    Calls the chat API of MistralAI, streaming the response when on_token is given.
+
+    Returns:
+        str: The text of the completion.
+    """
+    response = client.chat_stream(**kwargs) if on_token is not None else client.chat(**kwargs)
+    return completion_text(response, on_token, on_usage)
+
+
+def chat(client, ai_service_provider, messages, deployment_name=None, on_token=None, task=None, **kwargs):
+    """
+    Sends a conversation to the chat API of the provider and returns the answer.
+
+    Args:
+        client: The client of the provider, see get_client.
+        ai_service_provider (str): "OpenAI", "Azure OpenAI" or "MistralAI".
+        messages (list): The messages, as {"role": ..., "content": ...} dicts.
+        deployment_name (str): The Azure OpenAI deployment, or the MistralAI model.
+        on_token (callable): When given, the response is streamed and on_token is called with every chunk of text.
+        task (str): The name of the generator, the token usage is recorded under it (see ti_prompts).
+        **kwargs: Other parameters of the chat API, e.g. temperature.
+
+    Returns:
+        str: The text of the answer.
+
+    The request first waits for the requests and tokens per minute budget of the deployment, see ti_ratelimit.
+
+    Raises:
+        ValueError: If the provider is unknown. The errors of the provider SDK are raised as well,
+            once its retries are exhausted.
+    """
+    model = resolve_model(ai_service_provider, deployment_name)
+    if ai_service_provider == "MistralAI":
+        # MistralAI rejects a conversation ending with an assistant message, such instructions are left out
+        while len(messages) > 1 and messages[-1]["role"] == "assistant":
+            messages = messages[:-1]
+
+    deployment = f"{ai_service_provider}:{model}"
+    tokens = sum(count_tokens(message["content"]) for message in messages) + kwargs.get("max_tokens", LLM_OUTPUT_TOKENS)
+    waited = ti_ratelimit.acquire(deployment, tokens)
+    if waited > 1:
+        logger.debug("Waited %.1fs for the rate limit of %s", waited, deployment)
+    on_usage = lambda usage: record_usage(task, usage)
+    try:
+        if ai_service_provider == "MistralAI":
+            from mistralai.models.chat_completion import ChatMessage
+            mistral_messages = [ChatMessage(role=message["role"], content=message["content"]) for message in messages]
+            return mistral_chat(client, on_token, on_usage, model=model, messages=mistral_messages, **kwargs)
+        if on_token is not None and ai_service_provider == "OpenAI":
+            # Streamed completions only report their usage on request, Azure OpenAI 2023-05-15 does not support it
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        return openai_chat(client, on_token, on_usage, model=model, messages=messages, **kwargs)
+    except Exception as e:
+        if is_rate_limited(e):
+            ti_ratelimit.penalise(deployment)
+        raise
+
+
+def is_rate_limited(error):
+    """
+    Tells whether an error of the OpenAI or MistralAI SDK is an HTTP 429 answer.
+    """
+    return getattr(error, "status_code", None) == 429 or getattr(error, "http_status", None) == 429
+
+
+async def achat(client, ai_service_provider, messages, deployment_name=None, on_token=None, task=None, **kwargs):
+    """
+    Asynchronous version of chat, for asyncio callers. The request runs on a worker thread, so
+    the same pooled client serves the sync and async calls.
+    """
+    return await asyncio.to_thread(chat, client, ai_service_provider, messages, deployment_name, on_token, task, **kwargs)
+
+
+def chat_many(client, ai_service_provider, conversations, deployment_name=None, max_workers=None, task=None, **kwargs):
+    """
+    Sends several conversations to the chat API concurrently.
+
+    Returns:
+        list: The answers, in the order of the conversations. A failed request gives an error
+            message string, in the same way the ti_* generators report errors.
+    """
+    def run(messages):
+        try:
+            return chat(client, ai_service_provider, messages, deployment_name, task=task, **kwargs)
+        except Exception as e:
+            return f"An error occurred: {e}"
+
+    with ThreadPoolExecutor(max_workers=max_workers or LLM_BATCH_WORKERS) as executor:
+        return list(executor.map(run, conversations))
+
+
+def embed(client, ai_service_provider, texts, deployment_name=None):
+    """
+    Returns the embedding vectors of texts, in one request.
+
+    Args:
+        client: The client of the provider, see get_client.
+        ai_service_provider (str): "OpenAI", "Azure OpenAI" or "MistralAI".
+        texts (list): The texts to embed.
+        deployment_name (str): The Azure OpenAI deployment of the embeddings model.
+
+    Returns:
+        list: One vector per text.
+    """
+    if ai_service_provider == "MistralAI":
+        model = MISTRAL_EMBEDDING_MODEL
+    elif ai_service_provider in ("OpenAI", "Azure OpenAI"):
+        model = OPENAI_EMBEDDING_MODEL if ai_service_provider == "OpenAI" else deployment_name
+    else:
+        raise ValueError("Invalid AI service selection")
+    ti_ratelimit.acquire(f"{ai_service_provider}:{model}", sum(count_tokens(text) for text in texts))
+    if ai_service_provider == "MistralAI":
+        response = client.embeddings(model=model, input=texts)
+    else:
+        response = client.embeddings.create(model=model, input=texts)
+    return [item.embedding for item in response.data]
+
+
+def emit_text(text, on_token=None):
+    """
+    Passes a text computed without streaming (e.g. merged partial results) to on_token, and returns it.
+    """
+    if on_token is not None and isinstance(text, str):
+        on_token(text)
+    return text
@@ -0,0 +1,200 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from ti_cache import ERROR_PREFIXES
+from ti_tokens import count_tokens
+
+# Articles longer than this are processed in map-reduce mode instead of a single prompt
+MAX_INPUT_TOKENS = int(os.environ.get("TI_MINDMAP_MAX_INPUT_TOKENS", 16000))
+# Size of the sections sent to the LLM in the map step
+CHUNK_TOKENS = int(os.environ.get("TI_MINDMAP_CHUNK_TOKENS", 6000))
+# Number of sections processed at the same time
+MAP_MAX_WORKERS = int(os.environ.get("TI_MINDMAP_MAP_MAX_WORKERS", 4))
+
+# ATX headings (# Title) and setext headings (Title followed by === or ---), as produced by markdownify
+HEADING_PATTERN = re.compile(r"^(?=#{1,6}\s)|^(?=[^\n]+\n(?:=+|-+)[ \t]*$)", re.MULTILINE)
+
+
+def needs_map_reduce(text, max_tokens=None):
+    """
+    Returns True if the text is above the token budget of a single prompt.
+    """
+    return count_tokens(text) > (max_tokens or MAX_INPUT_TOKENS)
+
+
+def _split_oversized(block, max_tokens):
+    # Falls back from paragraphs to lines to fixed size slices for sections without headings
+    for separator in ("\n\n", "\n"):
+        parts = [part for part in block.split(separator) if part.strip()]
+        if len(parts) > 1:
+            return _pack(parts, max_tokens, separator)
+    size = max_tokens * 3
+    return [block[i:i + size] for i in range(0, len(block), size)]
+
+
+def _pack(parts, max_tokens, separator):
+    # Packs consecutive parts in chunks of at most max_tokens, splitting the parts that are too big on their own
+    chunks = []
+    current = []
+    current_tokens = 0
+    for part in parts:
+        tokens = count_tokens(part)
+        if tokens > max_tokens:
+            if current:
+                chunks.append(separator.join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_oversized(part, max_tokens))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(part)
+        current_tokens += tokens
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def split_markdown(text, max_tokens=None):
+    """
+    Splits a Markdown document in chunks of at most max_tokens tokens.
+
+    The text is cut on section headings first, so a chunk holds whole sections of the report,
+    then on paragraphs and lines for the sections that are too long on their own.
+
+    Args:
+        text (str): The Markdown document.
+        max_tokens (int): The maximum size of a chunk, CHUNK_TOKENS by default.
+
+    Returns:
+        list: The chunks, in the order of the document.
+    """
+    max_tokens = max_tokens or CHUNK_TOKENS
+    sections = [section.strip() for section in HEADING_PATTERN.split(text) if section and section.strip()]
+    return _pack(sections, max_tokens, "\n\n")
+
+
+def _is_error(result):
+    return result is None or (isinstance(result, str) and result.startswith(ERROR_PREFIXES))
+
+
+def map_reduce(text, map_function, reduce_function, max_workers=None):
+    """
+    Applies map_function to every chunk of the text in parallel and merges the partial results with reduce_function.
+
+    Args:
+        text (str): The document to process.
+        map_function (callable): Called with each chunk, returns a partial result.
+        reduce_function (callable): Called with the list of partial results, in document order.
+        max_workers (int): The number of chunks processed at the same time.
+
+    Returns:
+        The value returned by reduce_function, or the error of the map step if every chunk failed.
+    """
+    chunks = split_markdown(text)
+    with ThreadPoolExecutor(max_workers=max_workers or MAP_MAX_WORKERS) as executor:
+        partials = list(executor.map(map_function, chunks))
+
+    valid = [partial for partial in partials if not _is_error(partial)]
+    if not valid:
+        return partials[0]
+    return reduce_function(valid)
+
+
+def join_partials(partials):
+    """
+    Joins the partial results of the map step in a single text, section by section.
+    """
+    return "\n\n".join(f"Part {i} of the report:\n{partial.strip()}" for i, partial in enumerate(partials, start=1))
+
+
+def _parse_row(line):
+    line = line.strip()
+    # The outer pipes are optional in GitHub Flavored Markdown
+    line = line[1:] if line.startswith("|") else line
+    line = line[:-1] if line.endswith("|") else line
+    return [cell.strip() for cell in line.split("|")]
+
+
+def _is_separator(cells):
+    return all(re.fullmatch(r":?-+:?", cell) for cell in cells if cell) and any(cells)
+
+
+def parse_markdown_table(text):
+    """
+    Parses the first Markdown table of a text, with or without the outer pipes of each row.
+
+    Returns:
+        tuple: The header cells and the list of rows, or (None, []) if the text has no table.
+    """
+    lines = text.splitlines()
+    # The header is the line above the |---|---| separator line
+    start = next((i for i in range(1, len(lines)) if "|" in lines[i] and "|" in lines[i - 1]
+                  and _is_separator(_parse_row(lines[i]))), None)
+    if start is None:
+        # Table without separator line, only the lines starting with a pipe
+        table = [line for line in lines if line.strip().startswith("|")]
+    else:
+        # The rows follow the separator line, up to the first line of text
+        table = []
+        for line in lines[start - 1:]:
+            if "|" in line:
+                table.append(line)
+            elif line.strip():
+                break
+    if len(table) < 2:
+        return None, []
+    header = _parse_row(table[0])
+    rows = []
+    for line in table[1:]:
+        cells = _parse_row(line)
+        # Skip the |---|---| separator line
+        if _is_separator(cells):
+            continue
+        rows.append((cells + [""] * len(header))[:len(header)])
+    return header, rows
+
+
+def merge_markdown_tables(tables, key_column):
+    """
+    Merges the Markdown tables returned for each chunk into one table, with one row per key.
+
+    Rows sharing the same key (e.g. the same ATT&CK technique ID found in several sections)
+    are merged: the first non-empty value of each column is kept, and distinct comments are
+    appended to each other.
+
+    Args:
+        tables (list): The Markdown tables, in document order.
+        key_column (str): The name of the column identifying a row, case insensitive.
+
+    Returns:
+        str: The merged Markdown table, or the first table if none could be parsed.
+    """
+    header = None
+    merged = {}
+    for table in tables:
+        table_header, rows = parse_markdown_table(table)
+        if not table_header:
+            continue
+        if header is None:
+            header = table_header
+        # Columns are matched by name, the LLM does not always return them in the same order
+        positions = {name.lower(): i for i, name in enumerate(table_header)}
+        for row in rows:
+            values = [row[positions[name.lower()]] if name.lower() in positions else "" for name in header]
+            key_index = next((i for i, name in enumerate(header) if name.lower() == key_column.lower()), 0)
+            key = values[key_index].upper() or " ".join(values).lower()
+            if key not in merged:
+                merged[key] = values
+                continue
+            for i, value in enumerate(values):
+                if not merged[key][i]:
+                    merged[key][i] = value
+                elif value and value not in merged[key][i] and header[i].lower() == "comment":
+                    merged[key][i] = f"{merged[key][i]}; {value}"
+
+    if header is None:
+        return tables[0]
+    lines = ["| " + " | ".join(header) + " |", "|" + "|".join("---" for _ in header) + "|"]
+    lines += ["| " + " | ".join(values) + " |" for values in merged.values()]
+    return "\n".join(lines)
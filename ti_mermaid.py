@@ -1,7 +1,63 @@
 import re, base64
+from ti_render import render_diagram
 
 
+def native_chart(diagram_code, download=None, filename="mindmap"):
+    """
+    Returns the HTML of a diagram drawn server-side as inline SVG, so the page loads no JavaScript
+    library.
+
+    Args:
+        diagram_code (str): The Mermaid mindmap or timeline, or the Markmap Markdown.
+        download (str): "svg" or "png" to add a button saving the diagram, None for no button. The PNG
+            image is drawn from the inline SVG by the browser, only when the button is clicked.
+        filename (str): The name of the saved file, without extension.
+
+    Returns:
+        str: The HTML code, or None if the diagram could not be drawn.
+    """
+    svg = render_diagram(diagram_code, "svg")
+    if not svg:
+        return None
+    html_code = f'<div id="nativeChart" style="overflow:auto">{svg.decode("utf-8")}</div>'
+    if download == "svg":
+        html_code += (f'<a download="{filename}.svg" href="data:image/svg+xml;base64,{base64.b64encode(svg).decode("ascii")}">'
+                      f'<button>Save Mindmap</button></a>')
+    elif download == "png":
+        html_code += f"""
+    <script>
+    function downloadPNG() {{
+        var svg = document.querySelector("#nativeChart svg");
+        var scale = 2;
+        var canvas = document.createElement('canvas');
+        canvas.width = svg.width.baseVal.value * scale;
+        canvas.height = svg.height.baseVal.value * scale;
+        var img = new Image();
+        var url = URL.createObjectURL(new Blob([new XMLSerializer().serializeToString(svg)], {{type: 'image/svg+xml;charset=utf-8'}}));
+        img.onload = function () {{
+            canvas.getContext('2d').drawImage(img, 0, 0, canvas.width, canvas.height);
+            URL.revokeObjectURL(url);
+            var a = document.createElement('a');
+            a.download = '{filename}.png';
+            a.href = canvas.toDataURL('image/png');
+            document.body.appendChild(a);
+            a.click();
+            document.body.removeChild(a);
+        }};
+        img.src = url;
+    }}
+    </script>
+    <button onclick="downloadPNG()">Save Mindmap as PNG</button>
+    """
+    return html_code
+
+
+# The functions below draw the diagram server-side, the Mermaid and Markmap scripts are only
+# loaded from their CDN for the diagrams the local renderer cannot parse
 def mermaid_chart(mindmap_code):
+    native = native_chart(mindmap_code)
+    if native:
+        return native
     html_code = f"""
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.1/css/all.min.css">
     <div class="mermaid">{mindmap_code}</div>
@@ -12,6 +68,9 @@ def mermaid_chart(mindmap_code):
 
 # with save to SVG capability
 def mermaid_chart_svg(mindmap_code):
+    native = native_chart(mindmap_code, download="svg")
+    if native:
+        return native
     html_code = f"""
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.1/css/all.min.css">
     <div class="mermaid" id="mermaidChart">{mindmap_code}</div>
@@ -36,6 +95,9 @@ def mermaid_chart_svg(mindmap_code):
 
 # with save to PNG capability
 def mermaid_chart_png(mindmap_code):
+    native = native_chart(mindmap_code, download="png")
+    if native:
+        return native
     html_code = f"""
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.1/css/all.min.css">
     <div class="mermaid" id="mermaidChart">{mindmap_code}</div>
@@ -86,6 +148,9 @@ def mermaid_chart_png(mindmap_code):
 
 
 def markmap_to_html_with_png(markmap_code):
+    native = native_chart(markmap_code, download="svg")
+    if native:
+        return native
     # Encode the markmap code to base64
     encoded_markmap = base64.b64encode(markmap_code.encode()).decode()
 
@@ -133,6 +198,9 @@ def mermaid_timeline_graph(mindmap_code_timeline):
     Returns:
         str: The HTML code for the Mermaid timeline graph.
     """
+    native = native_chart(mindmap_code_timeline)
+    if native:
+        return native
 
     html_code = f"""
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.1/css/all.min.css">
@@ -149,4 +217,35 @@ def remove_nested_parentheses(mindmap_code):
     for match in matches:
         # Replace the nested parentheses with a single hyphen
         mindmap_code = mindmap_code.replace(f'({match})', match.replace('(', '').replace(')', '-'))
-    return mindmap_code
\ No newline at end of file
+    return mindmap_code
+
+def add_mermaid_theme(mermaid_code, selected_theme):
+    """
+    Adds a Mermaid theme to the given Mermaid code.
+
+    Parameters:
+    mermaid_code (str): The Mermaid code to add the theme to.
+    selected_theme (str): The name of the Mermaid theme to use.
+
+    Returns:
+    str: The Mermaid code with the specified theme applied.
+
+    Raises:
+    ValueError: If the selected theme is not supported.
+    """
+
+    if selected_theme == 'Default':
+        theme = 'default'
+    elif selected_theme == 'Neutral':
+        theme = 'neutral'
+    elif selected_theme == 'Dark':
+        theme = 'dark'
+    elif selected_theme == 'Forest':
+        theme = 'forest'
+    elif selected_theme == 'Custom':
+        # Add custom theme handling here if needed
+        theme = 'base'
+    else:
+        theme = 'default'  # Default theme if selected theme is not recognized
+    
+    return f"%%{{ init: {{'theme': '{theme}'}}}}%%\n{mermaid_code}"
@@ -1,11 +1,14 @@
 import os
+import re
 import json
 from uuid import uuid4
-from mistralai.models.chat_completion import ChatMessage
 from langsmith import traceable
+from ti_cache import cached_llm_call
+from ti_jsonstream import parse_json_array
+from ti_llm import chat
+from ti_prompts import build_messages
+from ti_ttp import techniques_from_table, table_error
 
-#OPENAI_MODEL = "gpt-4-1106-preview"
-OPENAI_MODEL = "gpt-4o-2024-08-06"
 
 prompt_table2 = """
 | Technique                                | Technique ID | Tactic           | Comment                                                                                                      |
@@ -130,7 +133,8 @@ prompt_response2 = """
 
 #Function to provide ATT&CK Matrix for Enterprise layer json file
 @traceable
-def attack_layer(input_text, ttptable, client, service_selection, deployment_name=None):
+@cached_llm_call
+def attack_layer(input_text, ttptable, client, service_selection, deployment_name=None, on_token=None):
   """
 Creates an ATT&CK Matrix for Enterprise layer in JSON format based on the provided input text and TTP table.
 
@@ -140,6 +144,7 @@ Args:
     client (object): An instance of the client to be used for making the API calls. Can be either an OpenAI client, Azure OpenAI client, or MistralAI client.  
     service_selection (str): The AI service to be used for processing the text. Can be either "OpenAI", "Azure OpenAI", or "MistralAI".  
     deployment_name (str, optional): The name of the Azure Machine Learning deployment that contains the text embedding model. Required if using "Azure OpenAI".  
+    on_token (callable, optional): Called with every chunk of the layer as the response is streamed.  
 
 Returns:  
     str: The JSON content of the ATT&CK Matrix for Enterprise layer. Returns an error message if the processing fails.  
@@ -147,10 +152,10 @@ Returns:
 Raises:  
     Exception: If there is an error in the API call or in the creation of the ATT&CK Matrix.
     """
-  # Define the SYSTEM prompt
+  # Define the SYSTEM prompt, the TTP table of the report is given after the example
   system_prompt_attack_layer = (
       "You are tasked with creating an ATT&CK Matrix for Enterprise layer json file with attack version 14, navigator 4.9.1, layer version 4.5 to load a layer in MITRE ATT&CK Navigator. \n" 
-      f"Use {ttptable} as input. Print just json content, avoiding including any additional text in the response. In domain field use enterprise-attack."
+      "Use the table of TTPs given by the user as input. Print just json content, avoiding including any additional text in the response. In domain field use enterprise-attack."
   )
   # Define the USER prompt
   user_prompt_attack_layer = (
@@ -160,38 +165,105 @@ Raises:
   assistant_prompt_attack_layer = (
       f"{prompt_response2}"   
   )
+  # Prepare the messages for the API call: instructions and example first, identical on every call
+  messages = build_messages(
+      system_prompt_attack_layer,
+      [(user_prompt_attack_layer, assistant_prompt_attack_layer)],
+      f"{input_text}\n\nTable: {ttptable}",
+  )
   try:
-      if service_selection == "OpenAI" or service_selection == "Azure OpenAI":
-          # Determine the model based on the service provider
-          model = OPENAI_MODEL if service_selection == "OpenAI" else deployment_name
-
-          # Prepare the messages for the API call
-          messages=[
-              {"role": "system", "content": system_prompt_attack_layer},
-              {"role": "user", "content": user_prompt_attack_layer},
-              {"role": "assistant", "content": assistant_prompt_attack_layer},
-		          {"role": "user", "content": input_text},
-              ]
-          # Make the API call
-          response = client.chat.completions.create(
-              model=model,
-              messages=messages,
-              )
-
-          # Return the response content
-          return response.choices[0].message.content
-      elif service_selection == "MistralAI":
-            # Make the API call
-            response = client.chat(
-                model="mistral-large-latest",
-                messages=[
-                    ChatMessage(role="system", content=system_prompt_attack_layer),
-                    ChatMessage(role="user", content=user_prompt_attack_layer),
-                    ChatMessage(role="assistant", content=assistant_prompt_attack_layer),
-                    ChatMessage(role="user", content=input_text),
-                ],
-            )
-            # Return the response content
-            return response.choices[0].message.content
+      # Make the API call, the model is selected by ti_llm from the provider
+      return chat(client, service_selection, messages, deployment_name, on_token, task="navigator")
   except Exception as e:
-      return f"Failed to extract TTPs: {e}"
\ No newline at end of file
+      return f"Failed to extract TTPs: {e}"
+
+
+# Settings of the layers built from a TTP table or rebuilt from the techniques of an invalid LLM output
+DEFAULT_LAYER = {
+    "name": "TI Mindmap layer",
+    "versions": {"attack": "14", "navigator": "4.9.1", "layer": "4.5"},
+    "domain": "enterprise-attack",
+    "description": "",
+    "gradient": {"colors": ["#ff6666", "#ffe766", "#8ec843"], "minValue": 0, "maxValue": 100},
+    "legendItems": [],
+    "metadata": [],
+    "links": [],
+}
+
+
+def parse_layer(text):
+    """
+    Parses the ATT&CK Navigator layer returned by attack_layer.
+
+    Valid JSON is returned as is, code block delimiters aside. Otherwise the techniques are recovered
+    one by one by the tolerant parser of ti_jsonstream (trailing commas, invalid techniques, truncated
+    output) and put in a layer with the default settings, keeping the name and description of the output.
+
+    Args:
+        text (str): The output of attack_layer.
+
+    Returns:
+        dict: The layer, or None if no technique could be recovered.
+    """
+    if not isinstance(text, str) or text.startswith(("Failed to", "An error occurred")):
+        return None
+    content = text.strip()
+    if content.startswith("```"):
+        content = content.split("\n", 1)[-1].rsplit("```", 1)[0]
+    try:
+        layer = json.loads(content)
+        if isinstance(layer, dict):
+            return layer
+    except json.JSONDecodeError:
+        pass
+
+    techniques = parse_json_array(content, "techniques")
+    if not techniques:
+        return None
+    layer = json.loads(json.dumps(DEFAULT_LAYER))
+    for key in ("name", "description"):
+        # The first occurrence of the key is the one of the layer, the techniques come later
+        match = re.search(rf'"{key}"\s*:\s*"((?:[^"\\]|\\.)*)"', content)
+        if match:
+            layer[key] = json.loads(f'"{match.group(1)}"')
+    layer["techniques"] = techniques
+    print(f"Navigator layer rebuilt from {len(techniques)} techniques")
+    return layer
+
+
+def build_layer(techniques, name=DEFAULT_LAYER["name"], description=""):
+    """
+    Builds an ATT&CK Navigator layer from techniques, without the LLM.
+
+    Args:
+        techniques (list): The techniques, a list of ti_ttp.Technique.
+        name (str): The name of the layer.
+        description (str): The description of the layer.
+
+    Returns:
+        dict: The layer.
+    """
+    layer = json.loads(json.dumps(DEFAULT_LAYER))
+    layer.update(name=name, description=description)
+    layer["techniques"] = []
+    for technique in techniques:
+        entry = {"techniqueID": technique.technique_id}
+        # Without a tactic, the technique is highlighted under every tactic it belongs to
+        if technique.tactic_shortname:
+            entry["tactic"] = technique.tactic_shortname
+        entry.update(color="", comment=technique.comment, enabled=True, metadata=[], links=[], showSubtechniques=False)
+        layer["techniques"].append(entry)
+    return layer
+
+
+def layer_from_table(ttptable, name=DEFAULT_LAYER["name"], description=""):
+    """
+    Builds the ATT&CK Navigator layer of a TTP table returned by ai_ttp, in place of attack_layer.
+
+    Returns:
+        str: The JSON content of the layer, or an error message if the table has no technique.
+    """
+    techniques = techniques_from_table(ttptable)
+    if not techniques:
+        return table_error(ttptable)
+    return json.dumps(build_layer(techniques, name, description), indent=4)
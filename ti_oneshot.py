@@ -0,0 +1,226 @@
+"""
+Single-pass extraction mode of TI Mindmap.
+
+In the default mode every generator (summary, mindmap, IOCs, TTPs...) sends the whole article to the
+LLM, so a report pays for the article once per section. In this mode the LLM is asked once for one
+JSON object holding every selected section, with structured outputs where the provider supports them
+(a strict JSON schema for OpenAI, JSON mode for MistralAI). The sections are then converted to the
+same outputs as the generators, so the existing renderers display them unchanged. The attack path,
+the timeline and the Navigator layer are derived from the TTPs by ti_ttp, as in the default mode.
+"""
+import json
+from langsmith import traceable
+from ti_cache import cached_llm_call
+from ti_llm import chat
+from ti_prompts import build_messages, language_of
+from ti_jsonstream import parse_json_object
+from ti_ioc import extract_iocs, refang
+from ti_mapreduce import needs_map_reduce, map_reduce, join_partials
+
+ONESHOT_SECTIONS = ("summary", "tweet", "mindmap", "iocs", "ttps", "5whats")
+
+def _object_schema(properties):
+    # Strict structured outputs require every property and no other
+    return {
+        "type": "object",
+        "properties": {name: {"type": "string"} for name in properties},
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+# JSON schema of each section
+SECTION_SCHEMAS = {
+    "summary": {"type": "string"},
+    "tweet": {"type": "string"},
+    "mindmap": {"type": "string"},
+    "iocs": {"type": "array", "items": _object_schema(("indicator", "description"))},
+    "ttps": {"type": "array", "items": _object_schema(("technique", "technique_id", "tactic", "comment"))},
+    "5whats": {"type": "array", "items": _object_schema(("question", "summary"))},
+}
+
+# The instructions of every section, the same whatever the selection so they are a cacheable prefix
+system_prompt_oneshot = (
+    "You are an AI assistant expert in cybersecurity, threat intelligence, and Mitre attack, assisting a threat analyst. "
+    "You analyse a threat report and return one JSON object, with only the keys requested by the user. "
+    "Return only the JSON object, without any additional text, commentary, or code block delimiters. The keys are: \n"
+    "- summary: multiple paragraphs summarizing the main topic, the key findings, and all the detailed information relevant for a threat analyst "
+    "such as detection opportunity iocs and TTPs. Use the title and add an emoji. Do not write a bullet points list. \n"
+    "- tweet: a tweet of maximum 250 symbols summarizing the main topic and the key findings relevant for a threat analyst. You can add an emoji. Add tag #timindmap \n"
+    "- mindmap: the code of an in-depth mindmap organizing the key findings and crucial highlights of the report, with up to four primary nodes and detailed sub-nodes. "
+    "For Mermaid.js, start with the word mindmap, the second line starts with root, use single parentheses around each node, "
+    "do not use nested parentheses, hyphens, icons, emojis or a style line, and do not write domains or IPs with square brackets (write mail.kz, not mail[.]kz). "
+    "For MarkMap, write a Markdown list with a # title, up to four primary nodes with up to four concise sub-nodes each, without parentheses or special characters. \n"
+    "- iocs: for each indicator of compromise listed by the user, an object with the indicator, written exactly as given, "
+    "and one short sentence describing its role in the report (e.g. C2 server, phishing domain, dropped payload, exploited vulnerability). \n"
+    "- ttps: the most important Tactics, Techniques, and Procedures of the report, using the ATT&CK Matrix for Enterprise: "
+    "for each technique an object with the technique, its technique_id, its tactic and a comment derived from the report. \n"
+    "- 5whats: an object with a question and its summary for each of the questions What?, When?, Where?, Who?, How?, Why?, So what?, What is next? and References. "
+    "Where the report does not answer a question, the summary is NON APPLICABLE. \n"
+    "The Enterprise tactics names as defined by the MITRE ATT&CK framework are: Reconnaissance, Resource Development, Initial Access, Execution, Persistence, "
+    "Privilege Escalation, Defense Evasion, Credential Access, Discovery, Lateral Movement, Collection, Command and Control, Exfiltration, Impact."
+)
+
+
+def response_schema(sections):
+    """
+    Returns the JSON schema of the object holding the selected sections.
+    """
+    return {
+        "type": "object",
+        "properties": {section: SECTION_SCHEMAS[section] for section in sections},
+        "required": list(sections),
+        "additionalProperties": False,
+    }
+
+
+def _response_format(ai_service_provider, sections):
+    if ai_service_provider == "OpenAI":
+        return {"type": "json_schema", "json_schema": {"name": "threat_report", "strict": True, "schema": response_schema(sections)}}
+    if ai_service_provider == "MistralAI":
+        return {"type": "json_object"}
+    # Azure OpenAI API version 2023-05-15 has no JSON mode, the answer is parsed tolerantly
+    return None
+
+
+@traceable
+@cached_llm_call
+def ai_oneshot(input_text, client, ai_service_provider, selected_language, sections, indicators=(), deployment_name=None, mindmap_format="Mermaid"):
+    """
+    Asks the LLM once for every selected section of a report, as one JSON object.
+
+    Args:
+        input_text (str): The report.
+        client: The client of the provider, see ti_llm.get_client.
+        ai_service_provider (str): "OpenAI", "Azure OpenAI" or "MistralAI".
+        selected_language (List[str]): The languages of the texts.
+        sections (list): The sections to generate, among ONESHOT_SECTIONS.
+        indicators (list): The indicators of compromise found in the report, described in the iocs section.
+        deployment_name (str): The Azure OpenAI deployment, or the MistralAI model.
+        mindmap_format (str): "Mermaid" or "MarkMap".
+
+    Returns:
+        str: The JSON object returned by the LLM, or an error message.
+    """
+    if not input_text or not client or not ai_service_provider or not sections:
+        return "Invalid input parameters."
+
+    instructions = (
+        f"Return a JSON object with the keys: {', '.join(sections)}. "
+        f"Write the texts in {language_of(selected_language)}. Write the mindmap with {mindmap_format}."
+    )
+    text = f"Report:\n{input_text}"
+    if "iocs" in sections:
+        text += "\n\nIndicators of compromise:\n" + "\n".join(indicators)
+    messages = build_messages(system_prompt_oneshot, text=text, instructions=instructions)
+
+    response_format = _response_format(ai_service_provider, sections)
+    kwargs = {"response_format": response_format} if response_format else {}
+    try:
+        return chat(client, ai_service_provider, messages, deployment_name, task="oneshot", **kwargs)
+    except Exception as e:
+        return f"An error occurred while generating the report: {e}"
+
+
+def _markdown_table(columns, rows):
+    lines = ["| " + " | ".join(columns) + " |", "|" + "|".join("---" for _ in columns) + "|"]
+    for row in rows:
+        lines.append("| " + " | ".join(str(cell).replace("|", "/").replace("\n", " ") for cell in row) + " |")
+    return "\n".join(lines)
+
+
+def section_outputs(data, sections, ioc_dataframe=None):
+    """
+    Converts the sections of the JSON object to the outputs of the per-task generators.
+
+    The TTPs and the 5 whats become the Markdown tables of ai_ttp and ai_fivewhats, and the IOC
+    descriptions are added to the IOCs found locally, as ai_extract_iocs does.
+
+    Returns:
+        dict: The output of every section, keyed by section name. A missing section gets an error message.
+    """
+    outputs = {}
+    for section in sections:
+        value = data.get(section)
+        if value is None:
+            outputs[section] = f"Failed to generate {section}: the section is missing from the LLM output"
+        elif section == "ttps":
+            outputs[section] = _markdown_table(
+                ("Technique", "Technique ID", "Tactic", "Comment"),
+                [(row.get("technique", ""), row.get("technique_id", ""), row.get("tactic", ""), row.get("comment", "")) for row in value if isinstance(row, dict)],
+            )
+        elif section == "5whats":
+            outputs[section] = _markdown_table(
+                ("Question", "Summary"),
+                [(row.get("question", ""), row.get("summary", "")) for row in value if isinstance(row, dict)],
+            )
+        elif section == "iocs":
+            if ioc_dataframe is None:
+                outputs[section] = "Failed to extract and parse IOCs: no indicator was given"
+                continue
+            descriptions = {
+                refang(str(row.get("indicator", "")).strip(" `*-")).lower(): str(row.get("description", "")).strip()
+                for row in value if isinstance(row, dict)
+            }
+            ioc_dataframe["Description"] = ioc_dataframe["Indicator"].str.lower().map(descriptions).fillna("")
+            outputs[section] = ioc_dataframe
+        else:
+            outputs[section] = value if isinstance(value, str) else json.dumps(value)
+    return outputs
+
+
+def oneshot_outputs(text, client, ai_service_provider, selected_language, sections, deployment_name=None, mindmap_format="Mermaid"):
+    """
+    Generates the selected sections of a report with a single LLM call.
+
+    The IOCs are found locally and only described by the LLM; when no IOC is found, the section is
+    the empty DataFrame and the LLM is not asked for it. Reports above the token budget are first
+    condensed section by section, as the per-task generators do.
+
+    Args:
+        text (str): The report.
+        client: The client of the provider, see ti_llm.get_client.
+        ai_service_provider (str): "OpenAI", "Azure OpenAI" or "MistralAI".
+        selected_language (List[str]): The languages of the texts.
+        sections (list): The sections to generate, among ONESHOT_SECTIONS.
+        deployment_name (str): The Azure OpenAI deployment, or the MistralAI model.
+        mindmap_format (str): "Mermaid" or "MarkMap".
+
+    Returns:
+        dict: The output of every section, in the format of the per-task generators. If the call
+            fails, every section gets the error message.
+    """
+    sections = [section for section in ONESHOT_SECTIONS if section in sections]
+    outputs = {}
+    indicators = []
+    ioc_dataframe = None
+    if "iocs" in sections:
+        try:
+            ioc_dataframe = extract_iocs(text)
+            indicators = list(ioc_dataframe["Indicator"])
+        except Exception as e:
+            outputs["iocs"] = f"Failed to extract and parse IOCs: {e}"
+        if not indicators:
+            # Nothing to describe, the section is the (empty) local result
+            outputs.setdefault("iocs", ioc_dataframe)
+            sections.remove("iocs")
+    if not sections:
+        return outputs
+
+    if needs_map_reduce(text):
+        from ti_ai import ai_summarise
+        text = map_reduce(
+            text,
+            lambda chunk: ai_summarise(chunk, client, ai_service_provider, selected_language, deployment_name),
+            join_partials,
+        )
+
+    response = ai_oneshot(text, client, ai_service_provider, selected_language, sections, indicators, deployment_name, mindmap_format)
+    try:
+        data = parse_json_object(response)
+    except ValueError as e:
+        error = response if isinstance(response, str) and response.startswith("An error occurred") else f"An error occurred: {e}"
+        outputs.update({section: error for section in sections})
+        return outputs
+    outputs.update(section_outputs(data, sections, ioc_dataframe))
+    return outputs
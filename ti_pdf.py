@@ -1,11 +1,21 @@
-import requests
+import os
+import json
+import hashlib
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, wait
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Image
+from xml.sax.saxutils import escape
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Image, Table, TableStyle
+from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from io import BytesIO
-import base64
 import streamlit as st
+from ti_render import render_diagram
+from ti_cache import SQLiteCache
+from ti_http import fetch
+from ti_cache import ERROR_PREFIXES
+from ti_mapreduce import parse_markdown_table
 
 from PIL import Image as PILImage
 
@@ -13,6 +23,20 @@ from reportlab.lib.pagesizes import A4
 from reportlab.platypus import Image
 from reportlab.lib.utils import ImageReader
 
+# Time budget in seconds for fetching the images of the PDF, the missing ones are left out
+ASSET_BUDGET = float(os.environ.get("TI_MINDMAP_PDF_ASSET_BUDGET", 20))
+# The screenshot is fetched once at this width, for the Screenshot tab and for the PDF
+SCREENSHOT_WIDTH = 840
+# Milliseconds thumbnail.ws waits for the page to load before taking the screenshot
+SCREENSHOT_DELAY = int(os.environ.get("TI_MINDMAP_SCREENSHOT_DELAY", 1500))
+
+# Resolution of the images embedded in the PDF, they are downscaled to it
+IMAGE_DPI = int(os.environ.get("TI_MINDMAP_PDF_IMAGE_DPI", 150))
+# Rows of each table of the IOCs and TTPs tables
+TABLE_CHUNK_ROWS = 100
+
+# Downloaded images, keyed by URL and size
+image_cache = SQLiteCache("images", ttl=7 * 24 * 3600, max_bytes=256 * 1024 * 1024)
 
 mermaid_code_example = """
 mermaid
@@ -46,13 +70,9 @@ root(Midnight Blizzard Attack Chain)
 """
 
 def image_from_mermaid(graph):
-    # Convert the Mermaid code to an image
-    graphbytes = graph.encode("utf8")
-    base64_bytes = base64.b64encode(graphbytes)
-    base64_string = base64_bytes.decode("ascii")
-  
-    # Open the image with PIL
-    return BytesIO(requests.get("https://mermaid.ink/img/" + base64_string).content)
+    # Render the Mermaid code to a PNG image, locally unless TI_MINDMAP_RENDERER selects a rendering service
+    image = render_diagram(graph, "png")
+    return BytesIO(image) if image else None
 
 
 def remove_first_non_empty_line_if_mermaid(mermaid_code):
@@ -63,77 +83,242 @@ def remove_first_non_empty_line_if_mermaid(mermaid_code):
             break  # Exit the loop after removing the first matching line
     return '\n'.join(lines)
 
+def fetch_image(url, size=None, cache_url=None, timeout=ASSET_BUDGET):
+    """
+    Downloads an image through the shared image cache.
+
+    Args:
+        url (str): The URL of the image.
+        size: The size requested in the URL, part of the cache key.
+        cache_url (str): The URL to use in the cache key instead of url, e.g. without an API key.
+        timeout (float): The time budget in seconds for the download.
+
+    Returns:
+        bytes: The image, or None if the download failed or did not return an image.
+    """
+    key = hashlib.sha256(json.dumps([cache_url or url, size]).encode("utf-8")).hexdigest()
+    cached = image_cache.get(key, stat="images")
+    if cached is not None:
+        return cached
+    try:
+        result = fetch(url, use_cache=False, timeout=timeout)
+    except Exception as e:
+        print(f"Failed to download the image {cache_url or url}: {e}")
+        return None
+    if not result.headers.get("Content-Type", "").startswith("image/"):
+        print(f"Failed to download the image {cache_url or url}: the response is not an image")
+        return None
+    image_cache.set(key, result.content)
+    return result.content
+
+
+def get_screenshot(url, width=SCREENSHOT_WIDTH, timeout=ASSET_BUDGET, api_key=None):
+    """
+    Returns the screenshot of a web page taken by thumbnail.ws, from the image cache when possible.
+
+    Args:
+        url (str): The URL of the page.
+        width (int): The width of the screenshot in pixels.
+        timeout (float): The time budget in seconds for the download.
+        api_key (str): The thumbnail.ws API key, read from the Streamlit secrets when not given.
+
+    Returns:
+        bytes: The screenshot, or None if it could not be taken.
+    """
+    api_key = api_key or st.secrets["api_keys"]["thumbnail"]
+    screenshot_url = f"https://api.thumbnail.ws/api/{api_key}/thumbnail/get?url={quote(url, safe='')}&width={width}&delay={SCREENSHOT_DELAY}"
+    return fetch_image(screenshot_url, size=width, cache_url=f"thumbnail.ws:{url}", timeout=timeout)
+
+
 def download_image(url):
-    response = requests.get(url)
-    return BytesIO(response.content)
+    image = fetch_image(url)
+    return BytesIO(image) if image else None
+
+
+def fetch_assets(assets, budget=ASSET_BUDGET):
+    """
+    Runs the functions fetching the images of the PDF concurrently, within a time budget.
+
+    The assets still missing when the budget is spent are returned as None; their download goes on
+    in the background and fills the image cache for the next PDF.
+
+    Args:
+        assets (dict): Mapping of asset name to a function without arguments returning its bytes.
+        budget (float): The time budget in seconds.
 
-def fit_image_to_page(image_data):
-    # Convert the BytesIO object to a reportlab.platypus.Image object
+    Returns:
+        dict: Mapping of asset name to its bytes, or None if it failed or missed the budget.
+    """
+    if not assets:
+        return {}
+    executor = ThreadPoolExecutor(max_workers=len(assets))
+    futures = {name: executor.submit(function) for name, function in assets.items()}
+    done, _ = wait(futures.values(), timeout=budget)
+    executor.shutdown(wait=False, cancel_futures=True)
+    results = {}
+    for name, future in futures.items():
+        if future not in done:
+            print(f"The {name} image missed the time budget of {budget} seconds")
+            results[name] = None
+        elif future.exception() is not None:
+            print(f"Failed to get the {name} image: {future.exception()}")
+            results[name] = None
+        else:
+            results[name] = future.result()
+    return results
+
+def downscale_image(image_data, max_width, max_height, dpi=None):
+    """
+    Resizes an image to the resolution it is printed at, so the PDF does not embed the full-size image.
+
+    Args:
+        image_data (bytes): The image.
+        max_width (float): The largest width of the image on the page, in points.
+        max_height (float): The largest height of the image on the page, in points.
+        dpi (int): The resolution of the embedded image, IMAGE_DPI by default.
+
+    Returns:
+        BytesIO: The image, re-encoded as PNG (diagrams, transparency) or JPEG (photos, screenshots) if it was resized.
+    """
+    dpi = dpi or IMAGE_DPI
+    image = PILImage.open(BytesIO(image_data))
+    lossless = image.format == "PNG" or image.mode in ("RGBA", "LA", "P")
+    scale = min(max_width * dpi / 72 / image.width, max_height * dpi / 72 / image.height)
+    if scale >= 1:
+        return BytesIO(image_data)
+    image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), PILImage.LANCZOS)
+    output = BytesIO()
+    if lossless:
+        image.save(output, format="PNG", optimize=True)
+    else:
+        image.convert("RGB").save(output, format="JPEG", quality=85)
+    output.seek(0)
+    return output
+
+
+def fit_image_to_page(image_data, max_width=A4[0], max_height=A4[1]):
+    # Downscale the image once to the printed resolution, then size it to fit the frame
+    if isinstance(image_data, BytesIO):
+        image_data = image_data.getvalue()
+    image_data = downscale_image(image_data, max_width, max_height)
     img = ImageReader(image_data)
     img_width, img_height = img.getSize()
     aspect_ratio = img_width / img_height
 
-    # Calculate the aspect ratio of the A4 page
-    page_width, page_height = A4
-    page_aspect_ratio = page_width / page_height
-
-    # Adjust the image dimensions to fit the page
-    if aspect_ratio > page_aspect_ratio:
-        # Image is wider than the page, adjust width
-        new_width = page_width
+    # Adjust the image dimensions to fit the frame
+    if aspect_ratio > max_width / max_height:
+        # Image is wider than the frame, adjust width
+        new_width = max_width
         new_height = new_width / aspect_ratio
     else:
-        # Image is taller than the page, adjust height
-        new_height = page_height
+        # Image is taller than the frame, adjust height
+        new_height = max_height
         new_width = new_height * aspect_ratio
 
     # Create a new Image object with the adjusted dimensions
+    image_data.seek(0)
     img = Image(image_data, width=new_width, height=new_height)
     return img
 
-def create_pdf_bytes(url, content, mermaid_code, attackpath=None):
-    # Create a BytesIO object to hold the PDF data
-    pdf_bytes_io = BytesIO()
+def fetch_pdf_images(url, mermaid_code, images=None, retry=True):
+    """
+    Takes the screenshot of the page and renders the mindmap at the same time, within ASSET_BUDGET seconds.
+
+    Args:
+        url (str): The URL of the report.
+        mermaid_code (str): The mindmap.
+        images (dict): Images already available, e.g. from the artifact store, they are not fetched again.
+        retry (bool): Whether the images set to None are fetched again. With False, they were
+            already attempted within the time budget and are left out.
+
+    Returns:
+        dict: The "screenshot" and "mindmap" PNG images, None for the ones that could not be fetched in time.
+    """
+    images = {name: image for name, image in (images or {}).items() if image or not retry}
+    graph = remove_first_non_empty_line_if_mermaid(mermaid_code)
+    # No mindmap when the report is built without the summary and mindmap
+    assets = {"mindmap": lambda: render_diagram(graph, "png")} if graph.strip() else {}
+    if "screenshot" not in images:
+        # The secrets are read here, Streamlit does not give them to the worker threads
+        api_key_thumbnail = st.secrets["api_keys"]["thumbnail"]
+        assets["screenshot"] = lambda: get_screenshot(url, api_key=api_key_thumbnail)
+    images.update(fetch_assets({name: function for name, function in assets.items() if name not in images}))
+    images.setdefault("screenshot", None)
+    images.setdefault("mindmap", None)
+    return images
+
+
+class LazyFlowables(list):
+    """
+    The flowables of a document, drawn from a generator as reportlab consumes them.
+
+    reportlab builds a document by taking the flowables from the front of a list, so only the next
+    flowables are created, and each one is released once it is drawn on its page.
+    """
 
-    doc = SimpleDocTemplate(pdf_bytes_io, pagesize=A4)
+    def __init__(self, flowables):
+        super().__init__()
+        self._source = iter(flowables)
+
+    def _fill(self):
+        # Two flowables are kept ready, reportlab looks one ahead for the keep with next headings
+        while list.__len__(self) < 2:
+            flowable = next(self._source, None)
+            if flowable is None:
+                break
+            list.append(self, flowable)
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        self._fill()
+        return list.__getitem__(self, index)
+
+
+def _text(value):
+    return escape(str(value)).replace("\n", "<br/>")
+
+
+def table_flowables(header, rows, width, style):
+    """
+    Yields a long table as consecutive tables of TABLE_CHUNK_ROWS rows, each with the header.
+
+    reportlab lays a table out as a whole and again at every page split, so one table of thousands
+    of rows costs much more than the same rows in chunks. The cells are created chunk by chunk.
+
+    Args:
+        header (list): The column names.
+        rows: The rows, lists of cell values, e.g. a generator.
+        width (float): The width of the table, in points.
+        style: The paragraph style of the cells.
+    """
+    column_widths = [width / len(header)] * len(header)
+    table_style = TableStyle([
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+    ])
+    header_cells = [Paragraph(f"<b>{_text(name)}</b>", style) for name in header]
+    chunk = []
+    for row in rows:
+        chunk.append([Paragraph(_text(cell), style) for cell in row])
+        if len(chunk) == TABLE_CHUNK_ROWS:
+            yield Table([header_cells] + chunk, colWidths=column_widths, repeatRows=1, style=table_style)
+            chunk = []
+    if chunk:
+        yield Table([header_cells] + chunk, colWidths=column_widths, repeatRows=1, style=table_style)
+
+
+def report_flowables(url, content, attackpath, images, frame_width, frame_height, iocs=None, ttptable=None):
+    """
+    Yields the flowables of the PDF report, in order, creating each one only when it is needed.
+    """
     styles = getSampleStyleSheet()
     header1_style = styles["Heading1"]
-    header2_style = styles["Heading2"]
     normal_style = styles["Normal"]
-
-    # Add content to the PDF
-    flowables = []
-    flowables.append(Spacer(1, 0.1 * inch))  # Add some space after header
-    flowables.append(Paragraph("TI MINDMAP", header1_style))
-    flowables.append(Paragraph("TI MINDMAP, an AI-powered tool designed to help producing Threat Intelligence summaries, Mindmap and IOCs extraction and more.", normal_style))
-    flowables.append(Paragraph("APP url: <link href='https://ti-mindmap-gpt.streamlit.app/'>https://ti-mindmap-gpt.streamlit.app/</link>", normal_style))
-    flowables.append(Paragraph("GitHub: <link href='https://github.com/format81/TI-Mindmap-GPT'>https://github.com/format81/TI-Mindmap-GPT</link>", normal_style))
-    #flowables.append(PageBreak())  # Move to the next page
-    flowables.append(Spacer(1, 0.1 * inch))  # Add some space after header
-    # Page 2: Agenda
-    flowables.append(Paragraph("REPORT", header1_style))
-    flowables.append(Paragraph(f"Original source: <link href='{url}'>{url}</link>", normal_style))  # Adding original source link
-    
-    # Make a request to get the screenshot image
-    api_key_thumbnail = st.secrets["api_keys"]["thumbnail"]
-    screenshot = requests.get(f"https://api.thumbnail.ws/api/{api_key_thumbnail}/thumbnail/get?url={url}&width=640&delay=1500")
-
-    # Debugging: Print the content of the screenshot
-    print("Screenshot content:", screenshot.content)
-
-    # If the request is successful, add the image to the PDF
-    if screenshot.status_code == 200:
-        screenshot_data_pdf = screenshot.content  # Store the screenshot image data
-        st.write("Screenshot added to PDF successfully")
-
-        # Add the screenshot image to the PDF
-        flowables.append(Paragraph("SCREENSHOT", header1_style))
-        img = fit_image_to_page(BytesIO(screenshot_data_pdf))
-        flowables.append(img)  # Add the image to the list of flowables
-    else:
-        st.write(f"Failed to get the image. Status code: {screenshot.status_code}")
-        screenshot_data_pdf = None
-    
+    cell_style = ParagraphStyle(name="TableCell", parent=normal_style, fontSize=8, leading=10)
     italic_style = ParagraphStyle(
         name='ItalicText',
         parent=styles['Normal'],
@@ -141,30 +326,83 @@ def create_pdf_bytes(url, content, mermaid_code, attackpath=None):
         fontSize=12,
         leading=14
     )
-    
-    # Assuming image_from_mermaid returns a BytesIO object
-    image_data = image_from_mermaid(remove_first_non_empty_line_if_mermaid(mermaid_code))
-    img = fit_image_to_page(image_data)
-    flowables.append(img)
-    flowables.append(Spacer(1, 0.1 * inch))  # Add some space after header
-    flowables.append(Paragraph(content, italic_style)) 
-    # Split the attackpath into a list of lines  
-    #attackpath_lines = attackpath.split('\n')  
-    if attackpath:  # Check if attackpath is not None
-        attackpath_lines = attackpath.split('\n')  
-    else:
-        attackpath_lines = []
-    # Add attackpath to the PDF  
-    flowables.append(Paragraph("TTPs ordered by execution time", header1_style))  
-    for line in attackpath_lines:  
-        flowables.append(Paragraph(line, normal_style)) 
 
-    doc.build(flowables)
+    yield Spacer(1, 0.1 * inch)  # Add some space after header
+    yield Paragraph("TI MINDMAP", header1_style)
+    yield Paragraph("TI MINDMAP, an AI-powered tool designed to help producing Threat Intelligence summaries, Mindmap and IOCs extraction and more.", normal_style)
+    yield Paragraph("APP url: <link href='https://ti-mindmap-gpt.streamlit.app/'>https://ti-mindmap-gpt.streamlit.app/</link>", normal_style)
+    yield Paragraph("GitHub: <link href='https://github.com/format81/TI-Mindmap-GPT'>https://github.com/format81/TI-Mindmap-GPT</link>", normal_style)
+    yield Spacer(1, 0.1 * inch)  # Add some space after header
+    yield Paragraph("REPORT", header1_style)
+    yield Paragraph(f"Original source: <link href='{escape(url)}'>{escape(url)}</link>", normal_style)  # Adding original source link
+
+    # The images leave room for the heading above them on the page
+    image_height = frame_height - 0.5 * inch
+    if images.get("screenshot"):
+        yield Paragraph("SCREENSHOT", header1_style)
+        yield fit_image_to_page(images["screenshot"], frame_width, image_height)
+    if images.get("mindmap"):
+        yield fit_image_to_page(images["mindmap"], frame_width, image_height)
+    yield Spacer(1, 0.1 * inch)  # Add some space after header
+    # One paragraph per block of the summary, so a long summary splits between pages at no cost
+    for block in (content or "").split("\n\n"):
+        if block.strip():
+            yield Paragraph(_text(block.strip()), italic_style)
+
+    # Add attackpath to the PDF
+    yield Paragraph("TTPs ordered by execution time", header1_style)
+    for line in (attackpath or "").split("\n"):
+        if line.strip():
+            yield Paragraph(_text(line), normal_style)
+
+    if ttptable and not ttptable.startswith(ERROR_PREFIXES):
+        header, rows = parse_markdown_table(ttptable)
+        if header:
+            yield Paragraph("TTPs", header1_style)
+            yield from table_flowables(header, rows, frame_width, cell_style)
+
+    if iocs is not None and len(iocs):
+        yield Paragraph("IOCs", header1_style)
+        yield from table_flowables(list(iocs.columns), iocs.itertuples(index=False, name=None), frame_width, cell_style)
+
 
-     # Get the PDF bytes
-    pdf_bytes = pdf_bytes_io.getvalue()
+def write_pdf(output, url, content, mermaid_code, attackpath=None, images=None, iocs=None, ttptable=None):
+    """
+    Writes the PDF report to a file as its pages are laid out.
 
-    # Close the BytesIO object
-    pdf_bytes_io.close()
+    The flowables are created on demand and released once drawn, the images are downscaled to the
+    page once and the IOC and TTP tables are split in chunks, so the memory used does not grow with
+    the number of flowables. reportlab keeps the compressed page streams until the file is written.
 
-    return pdf_bytes
\ No newline at end of file
+    Args:
+        output: The path of the PDF file, or a binary file object such as an HTTP response.
+        url (str): The URL of the report.
+        content (str): The summary.
+        mermaid_code (str): The mindmap.
+        attackpath (str): The TTPs ordered by execution time, one per line.
+        images (dict): The "screenshot" and "mindmap" images already fetched by fetch_pdf_images, the
+            missing ones are fetched. An image set to None was attempted and is not fetched again.
+        iocs (pandas.DataFrame): The IOCs, added as a table.
+        ttptable (str): The Markdown TTPs table, added as a table.
+
+    Returns:
+        dict: The images used in the PDF, None for the ones that could not be fetched.
+    """
+    # The images already fetched for the report are reused, the missing ones are fetched concurrently
+    images = fetch_pdf_images(url, mermaid_code, images, retry=False)
+    doc = SimpleDocTemplate(output, pagesize=A4, pageCompression=1)
+    doc.build(LazyFlowables(report_flowables(url, content, attackpath, images, doc.width, doc.height, iocs, ttptable)))
+    return images
+
+
+def create_pdf_bytes(url, content, mermaid_code, attackpath=None, images=None, iocs=None, ttptable=None):
+    """
+    Returns the PDF report as bytes, see write_pdf.
+    """
+    pdf_bytes_io = BytesIO()
+    images = write_pdf(pdf_bytes_io, url, content, mermaid_code, attackpath, images, iocs, ttptable)
+    if images.get("screenshot"):
+        st.write("Screenshot added to PDF successfully")
+    else:
+        st.write("Failed to get the screenshot, the PDF is built without it")
+    return pdf_bytes_io.getvalue()
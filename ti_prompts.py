@@ -0,0 +1,94 @@
+"""
+Prompt assembly of TI Mindmap, laid out for the prompt caching of the providers.
+
+OpenAI and Azure OpenAI skip the computation of the longest prompt prefix they have already seen
+(from 1024 tokens), which makes the cached part faster and cheaper. The messages of the generators
+are therefore built in the same order: the static instructions, then the few-shot examples, both
+byte-identical on every call, and only at the end the variable parts (the article, the selected
+language, the TTP table...).
+
+The usage returned by the providers is recorded per task, so the share of cached prompt tokens
+can be monitored.
+"""
+import threading
+
+_usage = {}
+_usage_lock = threading.Lock()
+
+
+def language_of(selected_language):
+    """
+    Combines the selected languages into a string, or defaults to "English" if none is selected.
+    """
+    return ", ".join(selected_language) if selected_language else "English"
+
+
+def build_messages(system, examples=(), text=None, instructions=None):
+    """
+    Builds the messages of a generator with the static prefix first and the variable parts last.
+
+    Args:
+        system (str): The instructions of the task. They must not depend on the call.
+        examples (list): (user, assistant) tuples of few-shot examples, or assistant strings alone.
+        text (str): The input of the call, e.g. the article.
+        instructions (str): The variable instructions of the call, e.g. the language of the answer.
+            They are added after the input, in the last user message.
+
+    Returns:
+        list: The messages, as {"role": ..., "content": ...} dicts.
+    """
+    messages = [{"role": "system", "content": system}]
+    for example in examples:
+        if isinstance(example, str):
+            messages.append({"role": "assistant", "content": example})
+        else:
+            messages.append({"role": "user", "content": example[0]})
+            messages.append({"role": "assistant", "content": example[1]})
+    request = "\n\n".join(part for part in (text, instructions) if part)
+    if request:
+        messages.append({"role": "user", "content": request})
+    return messages
+
+
+def record_usage(task, usage):
+    """
+    Adds the token usage of a chat completion to the counters of its task.
+
+    Args:
+        task (str): The name of the generator, e.g. "mindmap".
+        usage: The usage of the response of OpenAI, Azure OpenAI or MistralAI.
+    """
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0
+    with _usage_lock:
+        counters = _usage.setdefault(task or "other", {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+        counters["requests"] += 1
+        counters["prompt_tokens"] += prompt_tokens
+        counters["cached_tokens"] += cached_tokens
+        counters["completion_tokens"] += completion_tokens
+
+
+def usage_stats():
+    """
+    Returns the prompt, cached and completion tokens of every task since the start of the process.
+
+    Returns:
+        dict: Mapping of task name to its requests, prompt_tokens, cached_tokens, completion_tokens and cached_ratio.
+    """
+    with _usage_lock:
+        return {
+            task: dict(counters, cached_ratio=counters["cached_tokens"] / counters["prompt_tokens"] if counters["prompt_tokens"] else 0.0)
+            for task, counters in sorted(_usage.items())
+        }
+
+
+def format_usage_stats():
+    """
+    Returns the cached-token ratio of every task, one line per task.
+    """
+    return "\n".join(
+        f"{task}: {stats['cached_ratio']:.0%} of {stats['prompt_tokens']} prompt tokens cached ({stats['requests']} requests)"
+        for task, stats in usage_stats().items()
+    )
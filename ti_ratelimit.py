@@ -0,0 +1,163 @@
+"""
+Rate limiter of the LLM calls of TI Mindmap, shared by every thread and process of the machine.
+
+Each deployment (provider and model) has a requests-per-minute and a tokens-per-minute budget,
+kept as two token buckets in a local SQLite database, so parallel reports, batch workers and
+several Streamlit sessions share the same quota instead of each running into HTTP 429.
+Interactive requests have priority: batch requests leave a reserve of the budget untouched and
+wait while an interactive request is waiting for the same deployment.
+
+Budgets are set with TI_MINDMAP_LLM_RPM and TI_MINDMAP_LLM_TPM, and per deployment with
+TI_MINDMAP_LLM_LIMITS, e.g. '{"Azure OpenAI:gpt-4-32k": {"rpm": 60, "tpm": 40000}}'.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+from ti_cache import CACHE_DIR
+
+# Set TI_MINDMAP_LLM_RATE_LIMIT=0 to send the requests without waiting for the budget
+RATE_LIMIT_ENABLED = os.environ.get("TI_MINDMAP_LLM_RATE_LIMIT", "1") != "0"
+DEFAULT_RPM = int(os.environ.get("TI_MINDMAP_LLM_RPM", 500))
+DEFAULT_TPM = int(os.environ.get("TI_MINDMAP_LLM_TPM", 150000))
+DEPLOYMENT_LIMITS = json.loads(os.environ.get("TI_MINDMAP_LLM_LIMITS", "{}"))
+# Share of each budget that batch requests leave to the interactive ones
+BATCH_RESERVE = float(os.environ.get("TI_MINDMAP_LLM_BATCH_RESERVE", 0.2))
+# Longest sleep between two attempts, the budget is checked again after it
+MAX_WAIT = 2.0
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+# Priority of the requests of this process, ti_batch switches it to BATCH
+default_priority = os.environ.get("TI_MINDMAP_LLM_PRIORITY", INTERACTIVE)
+
+
+def deployment_limits(key):
+    """
+    Returns the (requests per minute, tokens per minute) budget of a deployment.
+    """
+    limits = DEPLOYMENT_LIMITS.get(key, {})
+    return limits.get("rpm", DEFAULT_RPM), limits.get("tpm", DEFAULT_TPM)
+
+
+class RateLimiter:
+    """
+    Token buckets of the LLM deployments, stored in a local SQLite database.
+
+    Both buckets of a deployment refill continuously up to one minute of budget. A request takes one
+    request and its estimated number of tokens; it waits when either bucket is short. A new connection
+    is opened for every operation, so the limiter can be shared between threads and between processes.
+    """
+
+    def __init__(self, name="llm_ratelimit"):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.path = os.path.join(CACHE_DIR, f"{name}.sqlite3")
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, requests REAL NOT NULL, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            # Interactive requests waiting for a deployment, batch requests give way to them
+            conn.execute("CREATE TABLE IF NOT EXISTS waiters (id TEXT PRIMARY KEY, key TEXT NOT NULL, expires REAL NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _try_acquire(self, conn, key, tokens, priority, waiter_id):
+        # Returns 0 when the budget is taken, otherwise the number of seconds before trying again
+        rpm, tpm = deployment_limits(key)
+        now = time.time()
+        row = conn.execute("SELECT requests, tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        available_requests, available_tokens, updated = row if row else (rpm, tpm, now)
+        elapsed = max(0.0, now - updated)
+        available_requests = min(rpm, available_requests + elapsed * rpm / 60)
+        available_tokens = min(tpm, available_tokens + elapsed * tpm / 60)
+
+        reserve = BATCH_RESERVE if priority == BATCH else 0.0
+        interactive_waiting = priority == BATCH and conn.execute(
+            "SELECT COUNT(*) FROM waiters WHERE key = ? AND expires > ?", (key, now)
+        ).fetchone()[0]
+        # A prompt larger than the whole budget is sent once the bucket is full
+        tokens = min(tokens, tpm * (1 - reserve))
+        missing_requests = 1 + reserve * rpm - available_requests
+        missing_tokens = tokens + reserve * tpm - available_tokens
+
+        if not interactive_waiting and missing_requests <= 0 and missing_tokens <= 0:
+            available_requests -= 1
+            available_tokens -= tokens
+            conn.execute("DELETE FROM waiters WHERE id = ? OR expires <= ?", (waiter_id, now))
+            wait_time = 0
+        else:
+            wait_time = max(missing_requests * 60 / rpm, missing_tokens * 60 / tpm, 0.05)
+            if priority != BATCH:
+                conn.execute("INSERT OR REPLACE INTO waiters (id, key, expires) VALUES (?, ?, ?)",
+                             (waiter_id, key, now + MAX_WAIT * 2))
+        conn.execute("INSERT OR REPLACE INTO buckets (key, requests, tokens, updated) VALUES (?, ?, ?, ?)",
+                     (key, available_requests, available_tokens, now))
+        return wait_time
+
+    def acquire(self, key, tokens, priority=None):
+        """
+        Waits until the budget of a deployment allows one more request, and takes it.
+
+        Args:
+            key (str): The deployment, "<provider>:<model>".
+            tokens (int): The estimated number of tokens of the request, prompt and answer.
+            priority (str): INTERACTIVE or BATCH, default_priority when not given.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        priority = priority or default_priority
+        waiter_id = uuid.uuid4().hex
+        start = time.monotonic()
+        while True:
+            with self._connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                wait_time = self._try_acquire(conn, key, tokens, priority, waiter_id)
+            if not wait_time:
+                return time.monotonic() - start
+            # Jitter spreads the waiting threads and processes, so they do not retry all at once
+            time.sleep(min(wait_time, MAX_WAIT) * random.uniform(0.8, 1.2))
+
+    def penalise(self, key):
+        """
+        Empties the buckets of a deployment after the provider answered HTTP 429, so every
+        process waits for the budget to refill instead of sending more requests.
+        """
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO buckets (key, requests, tokens, updated) VALUES (?, 0, 0, ?)", (key, time.time()))
+
+    def stats(self):
+        """
+        Returns the remaining budget of every deployment, as of its last request.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT key, requests, tokens FROM buckets ORDER BY key").fetchall()
+        return {key: {"requests": round(requests, 1), "tokens": round(tokens)} for key, requests, tokens in rows}
+
+
+rate_limiter = RateLimiter() if RATE_LIMIT_ENABLED else None
+
+
+def acquire(key, tokens, priority=None):
+    """
+    Waits for the budget of a deployment when the rate limiter is enabled.
+
+    Returns:
+        float: The number of seconds spent waiting.
+    """
+    if rate_limiter is None:
+        return 0.0
+    return rate_limiter.acquire(key, tokens, priority)
+
+
+def penalise(key):
+    """
+    Empties the budget of a deployment after HTTP 429, when the rate limiter is enabled.
+    """
+    if rate_limiter is not None:
+        rate_limiter.penalise(key)
@@ -0,0 +1,603 @@
+"""
+Diagram renderer of TI Mindmap, turning the Mermaid mindmaps and timelines and the Markmap trees
+into PNG or SVG images for the PDF report and the exports.
+
+The renderers are pluggable and tried in the order of TI_MINDMAP_RENDERER (default
+"local,service,mermaid.ink"):
+- local: a pure-Python layout drawn with Pillow, it needs no network access. The labels are drawn
+  with a Unicode TrueType font (TI_MINDMAP_FONT, DejaVu Sans by default); a label with characters
+  the font cannot draw is left to the next renderer.
+- service: a self-hosted mermaid.ink compatible service, at TI_MINDMAP_RENDER_URL.
+- mermaid.ink: the public mermaid.ink service, which needs access to the internet.
+e.g. TI_MINDMAP_RENDERER="service,local" uses the local service and draws the diagram locally when
+it is down. Rendered images are kept in a local cache keyed by the hash of the diagram source.
+"""
+import os
+import io
+import re
+import json
+import base64
+import hashlib
+import functools
+import unicodedata
+from dataclasses import dataclass, field
+from ti_cache import SQLiteCache
+
+RENDERERS_ORDER = [name.strip() for name in os.environ.get("TI_MINDMAP_RENDERER", "local,service,mermaid.ink").split(",") if name.strip()]
+RENDER_SERVICE_URL = os.environ.get("TI_MINDMAP_RENDER_URL", "http://localhost:3000")
+RENDER_TIMEOUT = float(os.environ.get("TI_MINDMAP_RENDER_TIMEOUT", 15))
+# Set TI_MINDMAP_DIAGRAM_CACHE=0 to render every diagram again
+DIAGRAM_CACHE_ENABLED = os.environ.get("TI_MINDMAP_DIAGRAM_CACHE", "1") != "0"
+DIAGRAM_CACHE_MAX_MB = int(os.environ.get("TI_MINDMAP_DIAGRAM_CACHE_MAX_MB", 128))
+# Bump when the output of the local renderer changes, so the cached images are drawn again
+LOCAL_RENDERER_VERSION = 3
+# TrueType font of the local renderer, the first one found is used
+FONT_PATHS = [path for path in [os.environ.get("TI_MINDMAP_FONT")] if path] + [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
+    "/usr/share/fonts/noto/NotoSans-Regular.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+
+# Layout of the local renderer, in pixels
+FONT_SIZE = 14
+WRAP_WIDTH = 28
+PADDING = 8
+LEVEL_GAP = 48
+SIBLING_GAP = 10
+MARGIN = 20
+# Colours of the Mermaid themes of add_mermaid_theme. The palette gives the fill colour of each
+# branch of the root, the root itself is drawn in the first one
+THEMES = {
+    "default": {"background": "#FFFFFF", "edge": "#9370DB", "text": "#333333",
+                "palette": ("#ECECFF", "#FFF4DD", "#E1F5E1", "#FDE2E4", "#E0F0FF", "#F3E5F5", "#FFFDE7", "#E8EAF6")},
+    "neutral": {"background": "#FFFFFF", "edge": "#666666", "text": "#333333",
+                "palette": ("#EEEEEE", "#F5F5F5", "#E0E0E0", "#FAFAFA", "#E8E8E8", "#F0F0F0")},
+    "dark": {"background": "#333333", "edge": "#CCCCCC", "text": "#F0F0F0",
+             "palette": ("#1F2020", "#3C3F52", "#2F4F3F", "#4E3A45", "#2E4257", "#4A4530")},
+    "forest": {"background": "#FFFFFF", "edge": "#13540C", "text": "#333333",
+               "palette": ("#CDE498", "#E5F0C8", "#D7EDC2", "#F0F4C3", "#C8E6C9", "#E6EE9C")},
+}
+THEMES["base"] = THEMES["default"]
+
+diagram_cache = SQLiteCache("diagrams", max_bytes=DIAGRAM_CACHE_MAX_MB * 1024 * 1024)
+
+# Mermaid node shapes: id((circle)), id(rounded), id[square], id{{hexagon}}, id))bang((, id)cloud(
+NODE_SHAPE_PATTERN = re.compile(r"^[\w-]*(\(\(|\)\)|\(|\)|\[|\{\{)(.*?)(\)\)|\(\(|\)|\(|\]|\}\})$")
+# Lines of the Mermaid code that are not part of the tree
+THEME_PATTERN = re.compile(r"%%\{\s*init:.*?['\"]theme['\"]\s*:\s*['\"](\w+)['\"]")
+IGNORED_LINE_PATTERN = re.compile(r"^(mermaid|```.*|%%.*|::icon\(.*\)|style\s.*|classDef\s.*)$", re.IGNORECASE)
+
+
+@dataclass
+class Node:
+    """
+    A node of a diagram tree.
+
+    Attributes:
+        label (str): The text of the node.
+        children (list): The child nodes.
+    """
+    label: str
+    children: list = field(default_factory=list)
+
+
+def _node_label(text):
+    text = text.strip()
+    match = NODE_SHAPE_PATTERN.match(text)
+    if match:
+        text = match.group(2)
+    return text.strip().strip('"`').strip()
+
+
+def _tree_from_indented(items):
+    # items are (depth, label) pairs, the first one is the root
+    root = None
+    stack = []
+    for depth, label in items:
+        node = Node(label)
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        if root is None:
+            root = node
+        else:
+            if not stack:
+                # A second top level node is attached to the root
+                stack.append((depth - 1, root))
+            stack[-1][1].children.append(node)
+        stack.append((depth, node))
+    return root
+
+
+def _diagram_lines(code):
+    return [line.rstrip() for line in code.replace("\t", "    ").splitlines() if line.strip() and not IGNORED_LINE_PATTERN.match(line.strip())]
+
+
+def diagram_kind(code):
+    """
+    Returns "mindmap" or "timeline" for Mermaid code, "markmap" for a Markdown list, None otherwise.
+    """
+    lines = _diagram_lines(code or "")
+    kind = lines[0].strip().lower() if lines else ""
+    if kind in ("mindmap", "timeline"):
+        return kind
+    return "markmap" if re.match(r"^(#+|[-*+])\s", kind) else None
+
+
+def parse_diagram(code):
+    """
+    Parses a Mermaid mindmap or timeline, or a Markmap Markdown list, into a tree.
+
+    The timeline becomes a tree of its title, its periods and their events. Lines the renderer does
+    not draw (theme, icons, styles, code block delimiters) are ignored.
+
+    Args:
+        code (str): The diagram source.
+
+    Returns:
+        Node: The root of the tree, or None if the source holds no node or is another kind of diagram.
+    """
+    lines = _diagram_lines(code or "")
+    kind = diagram_kind(code)
+    if not kind:
+        return None
+
+    if kind == "timeline":
+        root = Node("Timeline")
+        parent = root
+        period = None
+        for line in lines[1:]:
+            line = line.strip()
+            if line.lower().startswith("title "):
+                root.label = line[6:].strip()
+            elif line.lower().startswith("section "):
+                parent = Node(line[8:].strip())
+                root.children.append(parent)
+            else:
+                parts = [part.strip() for part in line.split(":")]
+                if parts[0]:
+                    period = Node(parts[0])
+                    parent.children.append(period)
+                if period is not None:
+                    period.children.extend(Node(event) for event in parts[1:] if event)
+        return root
+
+    if kind == "mindmap":
+        lines = lines[1:]
+        items = [(len(line) - len(line.lstrip()), _node_label(line)) for line in lines]
+    else:
+        # Markmap: the headings give the depth, then the indentation of the list items below them
+        items = []
+        heading_depth = 0
+        for line in lines:
+            stripped = line.strip()
+            heading = re.match(r"^(#+)\s+(.*)$", stripped)
+            if heading:
+                heading_depth = len(heading.group(1))
+                items.append((heading_depth * 100, heading.group(2)))
+            else:
+                indent = len(line) - len(line.lstrip())
+                items.append((heading_depth * 100 + 1 + indent, re.sub(r"^([-*+]|\d+\.)\s+", "", stripped)))
+    items = [(depth, label) for depth, label in items if label]
+    return _tree_from_indented(items) if items else None
+
+
+class MissingGlyphsError(ValueError):
+    """
+    Raised when a label has characters the font of the local renderer cannot draw.
+    """
+
+
+def _font_paths():
+    paths = list(FONT_PATHS)
+    try:
+        # matplotlib, a dependency of the app, ships DejaVu Sans
+        import matplotlib
+        paths.insert(1 if os.environ.get("TI_MINDMAP_FONT") else 0, os.path.join(matplotlib.get_data_path(), "fonts", "ttf", "DejaVuSans.ttf"))
+    except ImportError:
+        pass
+    return paths
+
+
+@functools.lru_cache(maxsize=None)
+def _font(size):
+    from PIL import ImageFont
+    for path in _font_paths():
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    print("No TrueType font found, the diagrams are drawn with the Pillow default font. Set TI_MINDMAP_FONT to a Unicode font.")
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed size bitmap font
+        return ImageFont.load_default()
+
+
+_glyphs = {}
+
+
+def _has_glyph(font, char):
+    # A character missing from the font is drawn as the .notdef glyph, the one of a noncharacter
+    glyphs = _glyphs.setdefault(id(font), {})
+    if char not in glyphs:
+        if "notdef" not in glyphs:
+            glyphs["notdef"] = _glyph_image(font, "\uffff")
+        glyphs[char] = char.isspace() or _glyph_image(font, char) != glyphs["notdef"]
+    return glyphs[char]
+
+
+def _glyph_image(font, char):
+    from PIL import Image, ImageDraw
+    image = Image.new("L", (2 * FONT_SIZE, 2 * FONT_SIZE))
+    ImageDraw.Draw(image).text((0, 0), char, fill=255, font=font)
+    return image.tobytes()
+
+
+def _right_to_left(text):
+    return any(unicodedata.bidirectional(char) in ("R", "AL") for char in text)
+
+
+def check_glyphs(boxes, font):
+    """
+    Raises MissingGlyphsError if the local renderer cannot draw a label of the laid out tree: a
+    character missing from the font, or a right-to-left script without the Raqm layout engine of
+    Pillow, which is needed to order and join its letters.
+    """
+    from PIL import features
+    raqm = features.check("raqm")
+    for box in boxes:
+        text = "".join(box[1])
+        missing = sorted({char for char in text if not _has_glyph(font, char)})
+        if missing:
+            raise MissingGlyphsError(f"the font has no glyph for {''.join(missing)!r}")
+        if not raqm and _right_to_left(text):
+            raise MissingGlyphsError("right-to-left text needs Pillow with Raqm")
+
+
+_char_widths = {}
+
+
+def _text_width(font, text):
+    # Sum of the advance of each character, measuring whole strings with FreeType is much slower
+    if _right_to_left(text):
+        # Letters of right-to-left scripts change shape once joined, the whole string is measured
+        return font.getlength(text)
+    widths = _char_widths.setdefault(id(font), {})
+    for char in set(text).difference(widths):
+        widths[char] = font.getlength(char)
+    return sum(map(widths.__getitem__, text))
+
+
+def _wrap(text):
+    # Greedy wrap on spaces, textwrap is the slowest step of the layout of large maps
+    lines = []
+    line = ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > WRAP_WIDTH:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    lines.append(line)
+    return lines
+
+
+def _measure(node, font, line_height):
+    lines = _wrap(node.label)
+    width = max(_text_width(font, line) for line in lines) + 2 * PADDING
+    height = len(lines) * line_height + 2 * PADDING
+    return lines, width, height
+
+
+def _stack(contours):
+    # Stacks subtrees top to bottom as close as their contours allow, returns the offset of each
+    # subtree and the merged contour, both relative to the middle of the first and last subtrees
+    offsets = [0.0]
+    merged = list(contours[0])
+    for contour in contours[1:]:
+        offset = max(merged[d][1] - contour[d][0] + SIBLING_GAP for d in range(min(len(merged), len(contour))))
+        offsets.append(offset)
+        for d, (top, bottom) in enumerate(contour):
+            if d < len(merged):
+                merged[d] = (min(merged[d][0], top + offset), max(merged[d][1], bottom + offset))
+            else:
+                merged.append((top + offset, bottom + offset))
+    centre = (offsets[0] + offsets[-1]) / 2
+    return [offset - centre for offset in offsets], [(top - centre, bottom - centre) for top, bottom in merged]
+
+
+def layout(root, font, two_sided=True):
+    """
+    Places the nodes of a tree with a tidy tree layout, one column per depth.
+
+    Sibling subtrees are packed as close as their contours allow and a parent is centred on its
+    children, so the boxes never overlap. A mindmap grows on both sides of its root, the first
+    branches on the right, a timeline only on the right. The layout is linear in the number of
+    nodes times the depth of the tree.
+
+    Args:
+        root (Node): The root of the tree, see parse_diagram.
+        font: The Pillow font used to measure the labels.
+        two_sided (bool): Whether the branches of the root are split between both sides.
+
+    Returns:
+        list: (node, lines, x, y, width, height, parent index, branch) tuples, the root first.
+    """
+    line_height = font.getbbox("Hg")[3] + 4
+    sizes = {}
+    offsets = {}
+
+    def contour(node):
+        # Contour of the subtree of node: (top, bottom) per depth, relative to the middle of node
+        lines, width, height = sizes[id(node)] = _measure(node, font, line_height)
+        own = [(-height / 2, height / 2)]
+        if not node.children:
+            return own
+        child_offsets, merged = _stack([contour(child) for child in node.children])
+        for child, offset in zip(node.children, child_offsets):
+            offsets[id(child)] = offset
+        return own + merged
+
+    # The branches of the root are laid out as two forests, balanced by their height
+    sizes[id(root)] = _measure(root, font, line_height)
+    branches = [(child, contour(child)) for child in root.children]
+    total = sum(c[-1][1] - c[0][0] for _, c in branches)
+    right, left, height = [], [], 0
+    for child, child_contour in branches:
+        if two_sided and right and height >= total / 2:
+            left.append((child, child_contour))
+        else:
+            right.append((child, child_contour))
+            height += max(bottom for _, bottom in child_contour) - min(top for top, _ in child_contour)
+    sides = {}
+    for side, forest in ((1, right), (-1, left)):
+        if forest:
+            forest_offsets, _ = _stack([child_contour for _, child_contour in forest])
+            for (child, _), offset in zip(forest, forest_offsets):
+                offsets[id(child)] = offset
+                sides[id(child)] = side
+
+    # Column widths per side and depth, then the absolute position of every node
+    column_widths = {}
+    placed = []
+
+    def collect(node, depth, side, parent, branch, y):
+        lines, width, height = sizes[id(node)]
+        column_widths[(side, depth)] = max(column_widths.get((side, depth), 0), width)
+        index = len(placed)
+        placed.append([node, lines, side, depth, y, width, height, parent, branch])
+        for i, child in enumerate(node.children):
+            child_side = sides[id(child)] if depth == 0 else side
+            collect(child, depth + 1, child_side, index, branch if depth else i + 1, y + offsets[id(child)])
+
+    collect(root, 0, 0, None, 0, 0.0)
+    root_width = sizes[id(root)][1]
+    column_x = {}
+    for side in (1, -1):
+        x = root_width / 2 + LEVEL_GAP
+        depth = 1
+        while (side, depth) in column_widths:
+            column_x[(side, depth)] = x
+            x += column_widths[(side, depth)] + LEVEL_GAP
+            depth += 1
+
+    boxes = []
+    for node, lines, side, depth, y, width, height, parent, branch in placed:
+        if side == 0:
+            x = -width / 2
+        elif side == 1:
+            x = column_x[(side, depth)]
+        else:
+            # Nodes on the left are aligned on the side of the root
+            x = -column_x[(side, depth)] - width
+        boxes.append((node, lines, x, y - height / 2, width, height, parent, branch))
+    min_x = min(box[2] for box in boxes)
+    min_y = min(box[3] for box in boxes)
+    return [(node, lines, x - min_x + MARGIN, y - min_y + MARGIN, width, height, parent, branch)
+            for node, lines, x, y, width, height, parent, branch in boxes]
+
+
+def _canvas_size(boxes):
+    width = max(x + w for _, _, x, _, w, _, _, _ in boxes) + MARGIN
+    height = max(y + h for _, _, _, y, _, h, _, _ in boxes) + MARGIN
+    return int(width), int(height)
+
+
+def _edges(boxes):
+    # Edges leave the parent on the side of the child
+    for _, _, x, y, w, h, parent, branch in boxes:
+        if parent is None:
+            continue
+        _, _, px, py, pw, ph, _, _ = boxes[parent]
+        if x >= px + pw:
+            yield (px + pw, py + ph / 2), (x, y + h / 2), branch
+        else:
+            yield (px, py + ph / 2), (x + w, y + h / 2), branch
+
+
+def _curve(start, end, steps=12):
+    # Points of the cubic Bezier curve drawn between two nodes
+    (x1, y1), (x2, y2) = start, end
+    middle = (x1 + x2) / 2
+    points = []
+    for i in range(steps + 1):
+        t = i / steps
+        a, b, c, d = (1 - t) ** 3, 3 * (1 - t) ** 2 * t, 3 * (1 - t) * t ** 2, t ** 3
+        points.append((a * x1 + (b + c) * middle + d * x2, (a + b) * y1 + (c + d) * y2))
+    return points
+
+
+def diagram_theme(code):
+    """
+    Returns the colours of the Mermaid theme set by add_mermaid_theme, the default theme otherwise.
+    """
+    match = THEME_PATTERN.search(code or "")
+    return THEMES.get(match.group(1).lower() if match else "default", THEMES["default"])
+
+
+def draw_png(boxes, font, scale=2, theme=None):
+    """
+    Draws the laid out tree as a PNG image.
+
+    Args:
+        boxes (list): The output of layout.
+        font: The Pillow font used by layout.
+        scale (int): The resolution multiplier, 2 keeps the text sharp once printed.
+        theme (dict): The colours, see THEMES.
+
+    Returns:
+        bytes: The PNG image.
+    """
+    from PIL import Image, ImageDraw
+    theme = theme or THEMES["default"]
+    palette = theme["palette"]
+    width, height = _canvas_size(boxes)
+    image = Image.new("RGB", (width * scale, height * scale), theme["background"])
+    draw = ImageDraw.Draw(image)
+    scaled_font = _font(FONT_SIZE * scale)
+    line_height = font.getbbox("Hg")[3] + 4
+
+    for start, end, _ in _edges(boxes):
+        draw.line([(px * scale, py * scale) for px, py in _curve(start, end)], fill=theme["edge"], width=scale, joint="curve")
+    for _, lines, x, y, w, h, _, branch in boxes:
+        draw.rounded_rectangle([x * scale, y * scale, (x + w) * scale, (y + h) * scale], radius=6 * scale,
+                               fill=palette[branch % len(palette)], outline=theme["edge"], width=scale)
+        for i, line in enumerate(lines):
+            draw.text(((x + PADDING) * scale, (y + PADDING + i * line_height) * scale), line, fill=theme["text"], font=scaled_font)
+
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def draw_svg(boxes, font, theme=None):
+    """
+    Draws the laid out tree as an SVG document.
+
+    Returns:
+        bytes: The SVG document, UTF-8 encoded.
+    """
+    from xml.sax.saxutils import escape
+    theme = theme or THEMES["default"]
+    palette = theme["palette"]
+    width, height = _canvas_size(boxes)
+    line_height = font.getbbox("Hg")[3] + 4
+    # The text is measured with the font of the local renderer, the browser uses it when installed
+    family = font.getname()[0].replace('"', "") if hasattr(font, "getname") else ""
+    families = f"{family}, sans-serif" if family else "sans-serif"
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}" '
+             f'font-family="{families}" font-size="{FONT_SIZE}">',
+             f'<rect width="100%" height="100%" fill="{theme["background"]}"/>']
+    for (x1, y1), (x2, y2), _ in _edges(boxes):
+        middle = (x1 + x2) / 2
+        parts.append(f'<path d="M{x1:.1f},{y1:.1f} C{middle:.1f},{y1:.1f} {middle:.1f},{y2:.1f} {x2:.1f},{y2:.1f}" fill="none" stroke="{theme["edge"]}"/>')
+    for _, lines, x, y, w, h, _, branch in boxes:
+        parts.append(f'<rect x="{x:.1f}" y="{y:.1f}" width="{w:.1f}" height="{h:.1f}" rx="6" fill="{palette[branch % len(palette)]}" stroke="{theme["edge"]}"/>')
+        for i, line in enumerate(lines):
+            baseline = y + PADDING + i * line_height + FONT_SIZE
+            parts.append(f'<text x="{x + PADDING:.1f}" y="{baseline:.1f}" fill="{theme["text"]}">{escape(line)}</text>')
+    parts.append("</svg>")
+    return "\n".join(parts).encode("utf-8")
+
+
+def render_local(code, fmt="png"):
+    """
+    Renders a diagram with the pure-Python layout, without any network access.
+
+    Returns:
+        bytes: The image, or None if the source holds no node.
+
+    Raises:
+        MissingGlyphsError: If the font cannot draw a label of the PNG image.
+    """
+    root = parse_diagram(code)
+    if root is None:
+        return None
+    font = _font(FONT_SIZE)
+    boxes = layout(root, font, two_sided=diagram_kind(code) != "timeline")
+    theme = diagram_theme(code)
+    if fmt == "svg":
+        # The browser draws the text of the SVG with its own fonts
+        return draw_svg(boxes, font, theme)
+    check_glyphs(boxes, font)
+    return draw_png(boxes, font, theme=theme)
+
+
+def _render_mermaid_ink(base_url, code, fmt):
+    from ti_http import fetch
+    # mermaid.ink reads the Mermaid code base64 encoded in the path, the Markmap trees are not supported
+    encoded = base64.b64encode(code.encode("utf-8")).decode("ascii")
+    endpoint = "svg" if fmt == "svg" else "img"
+    query = "" if fmt == "svg" else "?type=png"
+    return fetch(f"{base_url.rstrip('/')}/{endpoint}/{encoded}{query}", use_cache=False, timeout=RENDER_TIMEOUT).content
+
+
+def render_service(code, fmt="png"):
+    """
+    Renders a diagram with the self-hosted mermaid.ink compatible service at TI_MINDMAP_RENDER_URL.
+    """
+    return _render_mermaid_ink(RENDER_SERVICE_URL, code, fmt)
+
+
+def render_mermaid_ink(code, fmt="png"):
+    """
+    Renders a diagram with the public mermaid.ink service.
+    """
+    return _render_mermaid_ink("https://mermaid.ink", code, fmt)
+
+
+RENDERERS = {
+    "local": render_local,
+    "service": render_service,
+    "mermaid.ink": render_mermaid_ink,
+}
+
+
+def register_renderer(name, renderer):
+    """
+    Adds a renderer, selectable by name in TI_MINDMAP_RENDERER.
+
+    Args:
+        name (str): The name of the renderer.
+        renderer: A function taking the diagram source and the format ("png" or "svg") and returning the image bytes.
+    """
+    RENDERERS[name] = renderer
+
+
+def render_diagram(code, fmt="png", renderers=None):
+    """
+    Renders a diagram to an image, with the first renderer that succeeds.
+
+    Args:
+        code (str): The Mermaid mindmap or timeline, or the Markmap Markdown.
+        fmt (str): "png" or "svg".
+        renderers (list): The names of the renderers to try, RENDERERS_ORDER by default.
+
+    Returns:
+        bytes: The image, or None if every renderer failed.
+    """
+    for name in renderers or RENDERERS_ORDER:
+        renderer = RENDERERS.get(name)
+        if renderer is None:
+            print(f"Unknown diagram renderer: {name}")
+            continue
+        version = LOCAL_RENDERER_VERSION if name == "local" else 0
+        key = hashlib.sha256(json.dumps([name, version, fmt, code]).encode("utf-8")).hexdigest()
+        if DIAGRAM_CACHE_ENABLED:
+            cached = diagram_cache.get(key, stat=name)
+            if cached is not None:
+                return cached
+        try:
+            image = renderer(code, fmt)
+        except Exception as e:
+            print(f"Failed to render the diagram with {name}: {e}")
+            continue
+        if image:
+            if DIAGRAM_CACHE_ENABLED:
+                diagram_cache.set(key, image)
+            return image
+    return None
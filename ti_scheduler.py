@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Upper bound on concurrent LLM round trips started by a single report
+MAX_WORKERS = 8
+
+
+def run_tasks(tasks, max_workers=MAX_WORKERS):
+    """
+    Runs a set of tasks concurrently, respecting the dependencies between them.
+
+    Every task whose dependencies are satisfied is started immediately on a thread pool,
+    so independent LLM calls overlap and the wall-clock time of a full report is close to
+    the slowest chain of dependent calls instead of the sum of all of them.
+
+    Args:
+        tasks (dict): Mapping of task name to a (func, depends_on) tuple. func is called with
+            the results of the tasks listed in depends_on, in the same order, as positional arguments.
+        max_workers (int): The maximum number of tasks running at the same time.
+
+    Returns:
+        dict: Mapping of task name to the value returned by its function. If a task raises,
+            its result is an error message string, in the same way the ti_* generators report errors.
+
+    Raises:
+        ValueError: If a task depends on an unknown task or the dependencies contain a cycle.
+    """
+    for name, (func, depends_on) in tasks.items():
+        for dependency in depends_on:
+            if dependency not in tasks:
+                raise ValueError(f"Task '{name}' depends on unknown task '{dependency}'")
+
+    results = {}
+    pending = dict(tasks)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Start every task whose dependencies have completed
+            for name, (func, depends_on) in list(pending.items()):
+                if all(dependency in results for dependency in depends_on):
+                    args = [results[dependency] for dependency in depends_on]
+                    running[executor.submit(func, *args)] = name
+                    del pending[name]
+
+            if not running:
+                raise ValueError(f"Circular dependency between tasks: {', '.join(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    results[name] = f"An error occurred while running {name}: {e}"
+
+    return results
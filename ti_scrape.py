@@ -0,0 +1,67 @@
+import requests
+from bs4 import BeautifulSoup
+from ti_http import fetch
+from ti_extract import extract_markdown
+
+def scrape_text2(url):
+    """
+    Scrapes the text content from a given URL.
+
+    This function sends a GET request to the specified URL and parses the HTML content
+    to extract the text. It uses the BeautifulSoup library to parse the HTML and extract
+    the text. If the GET request is successful (HTTP status code 200), the function
+    returns the extracted text. Otherwise, it returns an error message indicating
+    that the scraping operation failed.
+
+    Parameters:
+    url (str): The URL of the webpage from which to scrape the text.
+
+    Returns:
+    str: The extracted text content from the webpage.
+    """
+
+    # Send a GET request to the URL through the shared, cached HTTP session
+    try:
+        response = fetch(url)
+    except requests.exceptions.RequestException:
+        return "Failed to scrape the website"
+    
+    # If the GET request is successful, the status code will be 200
+    if response.status_code == 200:
+        # Get the content of the response
+        page_content = response.content
+        # Create a BeautifulSoup object and specify the parser
+        soup = BeautifulSoup(page_content, "html.parser")
+        # Get the text of the soup object
+        text = soup.get_text()
+        # Return the text
+        return text
+    else:
+        return "Failed to scrape the website"
+
+def scrape_text(url):
+    """
+    Scrapes the text content from a given URL and converts it to Markdown.
+
+    This function sends a GET request to the specified URL and parses the HTML content
+    to extract the text. It uses `ti_extract` to strip the boilerplate of the page and
+    `markdownify` to convert the main content into Markdown format. If the GET request is successful
+    (HTTP status code 200), the function returns the extracted Markdown content.
+
+    Parameters:
+    url (str): The URL of the webpage from which to scrape the text.
+
+    Returns:
+    str: The extracted text content in Markdown format from the webpage.
+    """
+    try:
+        # Send a GET request to the URL through the shared, cached HTTP session (raises HTTPError for bad responses)
+        response = fetch(url)
+
+        # Extract the main content without navigation, scripts and comments, and convert it to Markdown
+        text = extract_markdown(response.content)
+
+        return text
+
+    except requests.exceptions.RequestException as e:
+        return f"Failed to scrape the website: {e}"
@@ -1,50 +1,60 @@
+import os
+import time
 import uuid
 import json
-from stix2 import parse, exceptions, Bundle
 from langsmith import traceable
+from ti_cache import cached_llm_call
 from datetime import datetime
 from github import Github
-import streamlit as st
+from ti_config import get_secret
+import ti_scheduler
+from ti_stix_validator import validate_objects, format_errors
+from ti_jsonstream import JsonArrayStream
+from ti_llm import chat
+from ti_stix_index import ID_CONTRIBUTING_PROPERTIES, merge_objects, normalise_sco, sco_id
 from uuid import uuid4
 
-# Model configuration
-OPENAI_MODEL = "gpt-4o-2024-08-06"
 # GitHub credentials
-GITHUB_TOKEN = st.secrets["api_keys"]["github_accesstoken"]
+GITHUB_TOKEN = get_secret("github_accesstoken")
 REPO_NAME = "format81/ti-mindmap-storage"
+# Corrections requested from the LLM for each STIX stage, with exponential backoff starting at STIX_BACKOFF seconds
+STIX_MAX_RETRIES = int(os.environ.get("TI_MINDMAP_STIX_MAX_RETRIES", 2))
+STIX_BACKOFF = 1.0
+# No correction is requested once this many seconds have passed since the start of the pipeline
+STIX_TIME_BUDGET = int(os.environ.get("TI_MINDMAP_STIX_TIME_BUDGET", 180))
+# Also validate every object with stix2.parse, much slower than the local validator
+STIX_STRICT_VALIDATION = os.environ.get("TI_MINDMAP_STIX_STRICT", "0") == "1"
 
 # Add UUIDs to 'id' fields in STIX objects, ensuring each object has a unique identifier.
 def add_uuid_to_ids(stix_data):
     """
     Add UUIDs to 'id' fields in STIX objects.
+
+    SCOs get the deterministic identifier of the STIX 2.1 specification, so the same observable
+    has the same identifier in every report. The other objects get a random one.
     """
     for item in stix_data:
         if 'id' in item:
             object_type = item['type']
-            item['id'] = f"{object_type}--{uuid.uuid4()}"
+            deterministic_id = sco_id(normalise_sco(item)) if object_type in ID_CONTRIBUTING_PROPERTIES else None
+            item['id'] = deterministic_id or f"{object_type}--{uuid.uuid4()}"
     return stix_data
 
 #Validate a list of STIX objects against the STIX 2.1 standard, identifying any invalid objects.
-def validate_stix_objects(stix_objects):
+def validate_stix_objects(stix_objects, known_ids=None, strict=None):
     """
     Validate STIX objects against the STIX 2.1 standard.
+
+    The objects are checked locally by ti_stix_validator, stix2.parse is only used in strict mode
+    (TI_MINDMAP_STIX_STRICT=1).
+
+    Returns:
+        tuple: Whether all the objects are valid, and the list of invalid objects.
     """
-    all_valid = True
-    invalid_objects = []
-    for obj in stix_objects:
-        try:
-            # Parse the object to validate against the STIX 2.1 standard
-            stix_obj = parse(json.dumps(obj), allow_custom=True)
-            print(f"Validation passed for object ID: {obj.get('id')}")
-        except exceptions.STIXError as se:
-            print(f"STIX parsing error for object ID {obj.get('id')}: {se}")
-            invalid_objects.append(obj)
-            all_valid = False
-        except json.JSONDecodeError as je:
-            print(f"JSON parsing error: {je}")
-            invalid_objects.append(obj)
-            all_valid = False
-    return all_valid, invalid_objects
+    _, invalid_objects, errors = validate_objects(stix_objects, known_ids, STIX_STRICT_VALIDATION if strict is None else strict)
+    if errors:
+        print(f"STIX validation: {len(invalid_objects)} of {len(stix_objects)} objects invalid\n{format_errors(errors)}")
+    return not invalid_objects, invalid_objects
 
 #STIX Domain Objects prompt
 system_prompt_sdo = (
@@ -64,7 +74,8 @@ system_prompt_sdo = (
 
 # Generate STIX SDOs
 @traceable
-def sdo_stix(input_text, client, ai_service_provider, deployment_name=None):
+@cached_llm_call
+def sdo_stix(input_text, client, ai_service_provider, deployment_name=None, on_token=None):
     """
     Generate STIX SDOs from input text using the AI model.
     """
@@ -72,44 +83,30 @@ def sdo_stix(input_text, client, ai_service_provider, deployment_name=None):
     if not input_text or not client or not ai_service_provider:
         return "Invalid input parameters."
     
+    messages = [
+        {"role": "system", "content": system_prompt_sdo},
+        {"role": "user", "content": user_prompt_stix}
+    ]
     try:
-        if ai_service_provider == "OpenAI" or ai_service_provider == "Azure OpenAI":
-            # Determine the model based on the service provider
-            model = OPENAI_MODEL if ai_service_provider == "OpenAI" else deployment_name
-        
-            # Make the API call
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt_sdo},
-                    {"role": "user", "content": user_prompt_stix}
-                ],
-            )
-        
-            return response.choices[0].message.content
+        return chat(client, ai_service_provider, messages, deployment_name, on_token, task="stix_sdo")
     except Exception as e:
         return f"An error occurred: {e}"
 
 @traceable
-def correct_invalid_stix(input_text, invalid_objects, original_stix):
+def correct_invalid_stix(input_text, invalid_objects, client, ai_service_provider, deployment_name=None, system_prompt=system_prompt_sdo, errors=""):
     """
     Ask the LLM to correct invalid STIX output based on the original text and invalid objects.
+
+    Only the invalid objects (or the raw output when it is not a JSON array) are sent back,
+    so the size of the correction does not grow with the number of valid objects.
     """
-    try:
-        if ai_service_provider == "OpenAI" or ai_service_provider == "Azure OpenAI":
-            # Determine the model based on the service provider
-            model = OPENAI_MODEL if ai_service_provider == "OpenAI" else deployment_name
-        
-            # Make the API call
-            invalid_output = json.dumps(invalid_objects, indent=4)
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt_sdo},
-                    {
-                "role": "user",
-                "content": f"""
-Correct the following invalid STIX objects based on the original text and ensure consistency with the overall STIX data:
+    invalid_output = invalid_objects if isinstance(invalid_objects, str) else json.dumps(invalid_objects, indent=4)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {
+            "role": "user",
+            "content": f"""
+Correct the following invalid STIX objects based on the original text. Return only the corrected objects as a JSON array:
 
 Input text:
 {input_text}
@@ -117,21 +114,16 @@ Input text:
 Invalid STIX objects:
 {invalid_output}
 
-Existing valid STIX data:
-{original_stix}
+Validation errors:
+{errors}
 """
-            }
-                ],
-            )
-        
-            return response.choices[0].message.content
+        }
+    ]
+    try:
+        return chat(client, ai_service_provider, messages, deployment_name, task="stix_correction")
     except Exception as e:
         return f"An error occurred: {e}"
 
-# Generate STIX data and ensure valid output
-is_valid = False
-stix_sdo = ""
-
 #STIX Cyber-observable Object prompt
 system_prompt_sco = (
     "You are tasked with creating STIX 2.1 Cyber-observable Objects (SCOs) based on the provided threat intelligence write-up."
@@ -147,7 +139,8 @@ system_prompt_sco = (
   )
 
 @traceable
-def sco_stix(input_text, client, ai_service_provider, deployment_name=None):
+@cached_llm_call
+def sco_stix(input_text, client, ai_service_provider, deployment_name=None, on_token=None):
     """
     Generate STIX SCOs from input text using the AI model.
     """
@@ -155,21 +148,12 @@ def sco_stix(input_text, client, ai_service_provider, deployment_name=None):
     if not input_text or not client or not ai_service_provider:
         return "Invalid input parameters."
     
+    messages = [
+        {"role": "system", "content": system_prompt_sco},
+        {"role": "user", "content": user_prompt_stix}
+    ]
     try:
-        if ai_service_provider == "OpenAI" or ai_service_provider == "Azure OpenAI":
-            # Determine the model based on the service provider
-            model = OPENAI_MODEL if ai_service_provider == "OpenAI" else deployment_name
-        
-            # Make the API call
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt_sco},
-                    {"role": "user", "content": user_prompt_stix}
-                ],
-            )
-        
-            return response.choices[0].message.content
+        return chat(client, ai_service_provider, messages, deployment_name, on_token, task="stix_sco")
     except Exception as e:
         return f"An error occurred: {e}"
     
@@ -191,25 +175,20 @@ system_prompt_sro = (
   )
 
 @traceable
-def sro_stix(input_text, stix_sdo, stix_sco,client, ai_service_provider, deployment_name=None):
+@cached_llm_call
+def sro_stix(input_text, stix_sdo, stix_sco,client, ai_service_provider, deployment_name=None, on_token=None):
     """
+    Generate STIX SROs linking the SDOs and SCOs of the input text using the AI model.
     """
     user_stix_sdo_sco_text = f"Text of writeup: {input_text},  {stix_sdo} , {stix_sco}"
     if not input_text or not client or not ai_service_provider:
         return "Invalid input parameters."
     
-    try:
-        if ai_service_provider == "OpenAI" or ai_service_provider == "Azure OpenAI":
-            # Determine the model based on the service provider
-            model = OPENAI_MODEL if ai_service_provider == "OpenAI" else deployment_name
-        
-            # Make the API call
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt_sro},
-                    {"role": "user",
-                "content": f"""
+    messages = [
+        {"role": "system", "content": system_prompt_sro},
+        {
+            "role": "user",
+            "content": f"""
 Generate STIX 2.1 relationship objects (SROs) based on the following:
 
 Input text:
@@ -221,34 +200,203 @@ SDO:
 SCO:
 {stix_sco}
 """
-            }
-        ],
-    )
-        
-            return response.choices[0].message.content
+        }
+    ]
+    try:
+        return chat(client, ai_service_provider, messages, deployment_name, on_token, task="stix_sro")
     except Exception as e:
         return f"An error occurred: {e}"
     
-def remove_brackets(text):
+def parse_stix_array(text):
+    """
+    Parses the JSON array returned by the LLM with the tolerant parser of ti_jsonstream: code block
+    delimiters, text around the array, objects not separated by commas and a truncated last object
+    are accepted. Objects that are not valid JSON are skipped.
+
+    Raises:
+        ValueError: If the text holds no JSON array or object.
+    """
+    if not isinstance(text, str):
+        raise ValueError("The LLM did not return any STIX output")
+    stream = JsonArrayStream()
+    objects = stream.feed(text) + stream.finish()
+    if stream.errors:
+        print(f"STIX output partly unparsable: {'; '.join(stream.errors)}")
+    if stream.target_depth is None or (stream.errors and not objects):
+        raise ValueError(stream.errors[0] if stream.errors else "The STIX output is not a JSON array")
+    return objects
+
+
+class StixStream:
+    """
+    Parses and validates the objects of a STIX stage while the LLM streams them.
+
+    on_token is passed to the generator, each object is validated as soon as its closing brace
+    arrives and the valid ones are passed to on_object(stage, obj), e.g. to display them.
+    """
+
+    def __init__(self, stage, known_ids=None, on_object=None):
+        self.stage = stage
+        self.known_ids = known_ids
+        self.on_object = on_object
+        self.parser = JsonArrayStream()
+        self.objects = []
+        self.valid = []
+        self.invalid = []
+        self.errors = []
+
+    def on_token(self, text):
+        self._add(self.parser.feed(text))
+
+    def finish(self):
+        """
+        Ends the stream. Returns True if a JSON array or object was found in the output.
+        """
+        self._add(self.parser.finish())
+        return self.parser.target_depth is not None
+
+    def _add(self, objects):
+        for obj in add_uuid_to_ids(objects):
+            index = len(self.objects)
+            self.objects.append(obj)
+            valid, invalid, errors = validate_objects([obj], self.known_ids, STIX_STRICT_VALIDATION)
+            self.invalid.extend(invalid)
+            self.errors.extend(error._replace(index=index) for error in errors)
+            self.emit(valid)
+
+    def emit(self, objects):
+        self.valid.extend(objects)
+        if self.on_object:
+            for obj in objects:
+                self.on_object(self.stage, obj)
+
+
+def _validated_objects(stix_output, system_prompt, input_text, client, ai_service_provider, deployment_name, max_retries, deadline, known_ids=None, stream=None):
     """
-    Remove leading '[' and trailing ']' and format inner objects into a valid JSON array.
+    Parses and validates the STIX output of the LLM, and asks for the correction of the invalid objects only.
+
+    The corrections stop after max_retries attempts or when the deadline (time.monotonic()) is
+    passed, with exponential backoff between attempts. Objects still invalid at that point are dropped.
+    known_ids are the identifiers the references of the objects may point to. When the output was
+    streamed, the objects already parsed and validated by the StixStream are used for the first attempt.
+    """
+    valid_objects = []
+    for attempt in range(max_retries + 1):
+        try:
+            if attempt == 0 and stream is not None and stream.finish():
+                objects, valid, invalid, stix_errors = stream.objects, stream.valid, stream.invalid, stream.errors
+            else:
+                objects = add_uuid_to_ids(parse_stix_array(stix_output))
+                valid, invalid, stix_errors = validate_objects(objects, known_ids, STIX_STRICT_VALIDATION)
+                if stream is not None:
+                    stream.emit(valid)
+        except ValueError as e:
+            print(f"Error parsing STIX output: {e}")
+            invalid = stix_output if isinstance(stix_output, str) and not stix_output.startswith("An error occurred") else None
+            errors = str(e)
+        else:
+            valid_objects.extend(valid)
+            errors = format_errors(stix_errors)
+            if not invalid:
+                break
+            print(f"STIX validation: {len(invalid)} of {len(objects)} objects invalid\n{errors}")
+
+        if not invalid or attempt == max_retries or time.monotonic() + STIX_BACKOFF * 2 ** attempt > deadline:
+            print(f"STIX retry budget exhausted, {len(invalid) if isinstance(invalid, list) else 'unparsable'} invalid objects dropped")
+            break
+        time.sleep(STIX_BACKOFF * 2 ** attempt)
+        print(f"Validation failed. Requesting correction from LLM (attempt {attempt + 1}/{max_retries})...")
+        stix_output = correct_invalid_stix(input_text, invalid, client, ai_service_provider, deployment_name, system_prompt, errors)
+    return valid_objects
+
+
+def generate_sdo_objects(input_text, client, ai_service_provider, deployment_name=None, max_retries=STIX_MAX_RETRIES, deadline=None, on_object=None):
     """
-    if not text.startswith('[') or not text.endswith(']'):
-        raise ValueError("Input text does not start with '[' or end with ']'")
+    Generates and validates the STIX SDOs of a text.
 
-    # Remove brackets and split into individual JSON objects
-    objects_str = text[1:-1].strip()  # Remove brackets and leading/trailing whitespace
-    objects_list = objects_str.split('}{')
+    When on_object is given, the output is streamed and on_object("sdo", obj) is called with every
+    valid object as soon as it is generated.
 
-    # Add back the missing curly braces and format into a valid JSON array
-    formatted_objects = "[" + ", ".join(["{" + obj + "}" if not obj.startswith("{") and not obj.endswith("}") else obj for obj in objects_list]) + "]"
+    Returns:
+        list: The valid SDO objects.
+    """
+    deadline = deadline or time.monotonic() + STIX_TIME_BUDGET
+    stream = StixStream("sdo", on_object=on_object) if on_object else None
+    stix_sdo = sdo_stix(input_text, client, ai_service_provider, deployment_name, on_token=stream and stream.on_token)
+    return _validated_objects(stix_sdo, system_prompt_sdo, input_text, client, ai_service_provider, deployment_name, max_retries, deadline, stream=stream)
 
-    return formatted_objects
+
+def generate_sco_objects(input_text, client, ai_service_provider, deployment_name=None, max_retries=STIX_MAX_RETRIES, deadline=None, on_object=None):
+    """
+    Generates and validates the STIX SCOs of a text.
+
+    When on_object is given, the output is streamed and on_object("sco", obj) is called with every
+    valid object as soon as it is generated.
+
+    Returns:
+        list: The valid SCO objects.
+    """
+    deadline = deadline or time.monotonic() + STIX_TIME_BUDGET
+    stream = StixStream("sco", on_object=on_object) if on_object else None
+    stix_sco = sco_stix(input_text, client, ai_service_provider, deployment_name, on_token=stream and stream.on_token)
+    return _validated_objects(stix_sco, system_prompt_sco, input_text, client, ai_service_provider, deployment_name, max_retries, deadline, stream=stream)
+
+
+def generate_sro_objects(input_text, sdo_objects, sco_objects, client, ai_service_provider, deployment_name=None, max_retries=STIX_MAX_RETRIES, deadline=None, on_object=None):
+    """
+    Generates and validates the STIX SROs linking the SDOs and SCOs of a text.
+
+    When on_object is given, the output is streamed and on_object("sro", obj) is called with every
+    valid object as soon as it is generated.
+
+    Returns:
+        list: The valid SRO objects.
+    """
+    deadline = deadline or time.monotonic() + STIX_TIME_BUDGET
+    # Relationships must point to the SDOs and SCOs of the report
+    known_ids = {obj["id"] for obj in sdo_objects + sco_objects if "id" in obj}
+    stream = StixStream("sro", known_ids, on_object) if on_object else None
+    stix_sro = sro_stix(input_text, json.dumps(sdo_objects, indent=4), json.dumps(sco_objects, indent=4), client, ai_service_provider, deployment_name,
+                        on_token=stream and stream.on_token)
+    return _validated_objects(stix_sro, system_prompt_sro, input_text, client, ai_service_provider, deployment_name, max_retries, deadline, known_ids, stream)
+
+
+def generate_stix_objects(input_text, client, ai_service_provider, deployment_name=None, max_retries=STIX_MAX_RETRIES, time_budget=STIX_TIME_BUDGET, on_object=None):
+    """
+    Runs the STIX pipeline: SDOs and SCOs are generated in parallel, then the SROs linking them.
+
+    Every stage shares the same time budget, so the time to get a bundle stays bounded even
+    when the LLM keeps returning invalid objects.
+
+    Args:
+        input_text (str): The threat report.
+        client: The OpenAI or Azure OpenAI client.
+        ai_service_provider (str): "OpenAI" or "Azure OpenAI".
+        deployment_name (str): The name of the Azure OpenAI deployment.
+        max_retries (int): The maximum number of corrections requested for each stage.
+        time_budget (float): The time in seconds after which no more corrections are requested.
+        on_object (callable): Called with the stage ("sdo", "sco" or "sro") and every valid object
+            as soon as it is streamed, from the worker threads of the pipeline.
+
+    Returns:
+        tuple: The lists of valid SDO, SCO and SRO objects.
+    """
+    deadline = time.monotonic() + time_budget
+    results = ti_scheduler.run_tasks({
+        "sdo": (lambda: generate_sdo_objects(input_text, client, ai_service_provider, deployment_name, max_retries, deadline, on_object), ()),
+        "sco": (lambda: generate_sco_objects(input_text, client, ai_service_provider, deployment_name, max_retries, deadline, on_object), ()),
+        "sro": (lambda sdo, sco: generate_sro_objects(input_text, sdo, sco, client, ai_service_provider, deployment_name, max_retries, deadline, on_object), ("sdo", "sco")),
+    })
+    # run_tasks reports the exceptions of a stage as a string, the stage then contributes no object
+    return tuple(results[stage] if isinstance(results[stage], list) else [] for stage in ("sdo", "sco", "sro"))
 
 def create_stix_bundle(sdo_data, sco_data, sro_data):
     """
     Create a STIX 2.1 bundle from input SDO, SCO, and SRO data.
 
+    Duplicate objects are merged and the relationships rewritten to the kept identifiers. The objects
+    are also merged into the local STIX index, so objects already seen in other reports keep their identifier.
+
     Args:
         sdo_data (list): List of valid SDO objects.
         sco_data (list): List of valid SCO objects.
@@ -257,8 +405,8 @@ def create_stix_bundle(sdo_data, sco_data, sro_data):
     Returns:
         str: A STIX 2.1 bundle in JSON format.
     """
-    # Combine SDO, SCO, and SRO data
-    all_objects = sdo_data + sco_data + sro_data
+    # Combine SDO, SCO, and SRO data, without duplicates
+    all_objects = merge_objects(sdo_data + sco_data + sro_data)
     #print("all_objects:", all_objects)
 
     bundle = {
@@ -280,6 +428,8 @@ def upload_to_github_stix(stix_bundle):
     Returns:
     str: The raw URL of the uploaded JSON file.
     """
+    import streamlit as st
+
     g = Github(GITHUB_TOKEN)
     repo = g.get_repo(REPO_NAME)
     commit_message = "Updated via Streamlit app"
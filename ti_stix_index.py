@@ -0,0 +1,319 @@
+"""
+Local index of the STIX 2.1 objects generated by TI Mindmap.
+
+SCOs get the deterministic identifiers of the STIX 2.1 specification (UUIDv5 of their ID contributing
+properties), SDOs are deduplicated by type and normalised name, and relationships by source, type and
+target. Every bundle is merged into a SQLite index, so the same domain or malware family keeps one
+identifier across reports and the index grows into one graph.
+
+Usage:
+    python ti_stix_index.py stats
+    python ti_stix_index.py export graph.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+from ti_cache import CACHE_DIR
+
+# Set TI_MINDMAP_STIX_INDEX=0 to only deduplicate the objects of each bundle, without the persistent index
+STIX_INDEX_ENABLED = os.environ.get("TI_MINDMAP_STIX_INDEX", "1") != "0"
+
+# Namespace of the deterministic SCO identifiers, defined by the STIX 2.1 specification
+STIX_NAMESPACE = uuid.UUID("00abedb4-aa42-466c-9c01-fed23315a9b7")
+
+# ID contributing properties of each SCO type (STIX 2.1, section 6). Process has none, its ids stay random.
+ID_CONTRIBUTING_PROPERTIES = {
+    "artifact": ("hashes", "payload_bin"),
+    "autonomous-system": ("number",),
+    "directory": ("path",),
+    "domain-name": ("value",),
+    "email-addr": ("value",),
+    "email-message": ("from_ref", "subject", "body"),
+    "file": ("hashes", "name", "extensions", "parent_directory_ref"),
+    "ipv4-addr": ("value",),
+    "ipv6-addr": ("value",),
+    "mac-addr": ("value",),
+    "mutex": ("name",),
+    "network-traffic": ("start", "end", "src_ref", "dst_ref", "src_port", "dst_port", "protocols", "extensions"),
+    "software": ("name", "cpe", "swid", "vendor", "version"),
+    "url": ("value",),
+    "user-account": ("account_type", "user_id", "account_login"),
+    "windows-registry-key": ("key", "values"),
+    "x509-certificate": ("hashes", "serial_number"),
+}
+# Only one hash contributes to the identifier, the first available in this order
+HASH_PREFERENCE = ("MD5", "SHA-1", "SHA-256", "SHA-512")
+# SCO values compared case-insensitively
+CASE_INSENSITIVE_VALUES = ("domain-name", "email-addr", "mac-addr")
+SRO_TYPES = ("relationship", "sighting")
+
+
+def _preferred_hash(hashes):
+    normalised = {re.sub(r"[^A-Z0-9]", "", name.upper()): (name, value) for name, value in hashes.items()}
+    for algorithm in HASH_PREFERENCE:
+        if algorithm.replace("-", "") in normalised:
+            return {algorithm: normalised[algorithm.replace("-", "")][1]}
+    return None
+
+
+def normalise_sco(obj):
+    """
+    Normalises the value of an SCO in place, e.g. domain names in lower case without the trailing dot.
+    """
+    value = obj.get("value")
+    if isinstance(value, str):
+        value = value.strip()
+        if obj.get("type") in CASE_INSENSITIVE_VALUES:
+            value = value.lower().rstrip(".")
+        obj["value"] = value
+    return obj
+
+
+def sco_id(obj):
+    """
+    Returns the deterministic STIX 2.1 identifier of an SCO, the UUIDv5 of its ID contributing properties.
+
+    Returns:
+        str: The identifier, or None if the type has no ID contributing property or the object has none of them.
+    """
+    object_type = obj.get("type")
+    contributing = {}
+    for name in ID_CONTRIBUTING_PROPERTIES.get(object_type, ()):
+        value = obj.get(name)
+        if name == "hashes" and isinstance(value, dict):
+            value = _preferred_hash(value)
+        if value not in (None, "", [], {}):
+            contributing[name] = value
+    if not contributing:
+        return None
+    # Canonical JSON (RFC 8785) of the properties, the same as json.dumps for strings, numbers and lists
+    data = json.dumps(contributing, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return f"{object_type}--{uuid.uuid5(STIX_NAMESPACE, data)}"
+
+
+def normalise_name(name):
+    """
+    Normalises an SDO name for deduplication: "APT 28", "apt-28" and "APT28" are the same.
+    """
+    return re.sub(r"[\W_]+", "", str(name).casefold())
+
+
+def object_key(obj):
+    """
+    Returns the deduplication key of a STIX object, or None if the object cannot be deduplicated.
+
+    SCOs are keyed by their deterministic identifier, relationships by their source, type and target,
+    indicators by their pattern and the other SDOs by their type and normalised name.
+    """
+    object_type = obj.get("type")
+    if object_type in ID_CONTRIBUTING_PROPERTIES:
+        return sco_id(obj)
+    if object_type == "relationship":
+        if obj.get("source_ref") and obj.get("target_ref"):
+            return f"relationship|{obj['source_ref']}|{obj.get('relationship_type', '')}|{obj['target_ref']}"
+        return None
+    if object_type == "indicator" and isinstance(obj.get("pattern"), str):
+        return f"indicator|{' '.join(obj['pattern'].split())}"
+    if obj.get("name") and normalise_name(obj["name"]):
+        return f"{object_type}|{normalise_name(obj['name'])}"
+    return None
+
+
+def _rewrite_references(obj, id_map):
+    for name, value in obj.items():
+        if name.endswith("_ref") and value in id_map:
+            obj[name] = id_map[value]
+        elif name.endswith("_refs") and isinstance(value, list):
+            obj[name] = list(dict.fromkeys(id_map.get(reference, reference) for reference in value))
+
+
+def merge_properties(target, source):
+    """
+    Merges the properties of a duplicate into the kept object, in place.
+
+    Lists are united, the earliest created and the latest modified timestamps are kept, and the
+    other properties of the kept object win over the duplicate's.
+    """
+    for name, value in source.items():
+        if name == "id":
+            continue
+        current = target.get(name)
+        if current in (None, "", []):
+            target[name] = value
+        elif isinstance(current, list) and isinstance(value, list):
+            seen = {json.dumps(item, sort_keys=True) for item in current}
+            target[name] = current + [item for item in value if json.dumps(item, sort_keys=True) not in seen]
+        elif name == "created" and isinstance(value, str) and value < current:
+            target[name] = value
+        elif name == "modified" and isinstance(value, str) and value > current:
+            target[name] = value
+    return target
+
+
+def deduplicate_objects(objects, lookup=None):
+    """
+    Deduplicates STIX objects and rewrites their references to the kept identifiers.
+
+    SCOs get their deterministic identifier, duplicates are merged into the first occurrence,
+    and the references of every object (relationship source and target, object_refs...) are rewritten.
+
+    Args:
+        objects (list): The STIX objects of a bundle, they are not modified.
+        lookup (callable): Called with a deduplication key, returns the object already known for it
+            (e.g. from the index) or None. Its identifier is then reused.
+
+    Returns:
+        list: (key, object) tuples, key is None for the objects that cannot be deduplicated.
+    """
+    id_map = {}
+    kept = {}
+    unkeyed = []
+    # Relationships are keyed once their references point to the canonical identifiers
+    ordered = [obj for obj in objects if obj.get("type") not in SRO_TYPES] + [obj for obj in objects if obj.get("type") in SRO_TYPES]
+    for position, obj in enumerate(ordered):
+        obj = json.loads(json.dumps(obj))
+        if obj.get("type") in ID_CONTRIBUTING_PROPERTIES:
+            normalise_sco(obj)
+        if obj.get("type") in SRO_TYPES:
+            _rewrite_references(obj, id_map)
+        key = object_key(obj)
+        original_id = obj.get("id")
+        if key is None:
+            unkeyed.append((position, obj))
+            continue
+        if key in kept:
+            merge_properties(kept[key], obj)
+        else:
+            known = lookup(key) if lookup else None
+            if known:
+                obj["id"] = known["id"]
+            elif obj.get("type") in ID_CONTRIBUTING_PROPERTIES:
+                obj["id"] = key
+            kept[key] = obj
+        if original_id:
+            id_map[original_id] = kept[key]["id"]
+
+    for obj in kept.values():
+        _rewrite_references(obj, id_map)
+    for _, obj in unkeyed:
+        _rewrite_references(obj, id_map)
+    return list(kept.items()) + [(None, obj) for _, obj in unkeyed]
+
+
+class StixIndex:
+    """
+    Persistent index of the STIX objects of every report, stored in a local SQLite database.
+
+    Each deduplication key maps to one object: merging a bundle reuses the identifiers of the objects
+    already known and merges their properties. A new connection is opened for every operation, so
+    the index can be shared between threads and between processes.
+    """
+
+    def __init__(self, name="stix_index"):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.path = os.path.join(CACHE_DIR, f"{name}.sqlite3")
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS objects ("
+                "key TEXT PRIMARY KEY, id TEXT NOT NULL, type TEXT NOT NULL, object TEXT NOT NULL, "
+                "reports INTEGER NOT NULL, first_seen REAL NOT NULL, last_seen REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def merge(self, objects):
+        """
+        Merges the objects of a bundle into the index.
+
+        Returns:
+            list: The deduplicated objects of the bundle, with the identifiers of the index.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # Concurrent merges of the same object must not both insert it
+            conn.execute("BEGIN IMMEDIATE")
+            stored = {}
+
+            def lookup(key):
+                row = conn.execute("SELECT object FROM objects WHERE key = ?", (key,)).fetchone()
+                if row:
+                    stored[key] = json.loads(row[0])
+                return stored.get(key)
+
+            entries = deduplicate_objects(objects, lookup)
+            for key, obj in entries:
+                key = key or obj.get("id")
+                if not key:
+                    continue
+                if key in stored:
+                    conn.execute(
+                        "UPDATE objects SET object = ?, reports = reports + 1, last_seen = ? WHERE key = ?",
+                        (json.dumps(merge_properties(stored[key], obj)), now, key),
+                    )
+                else:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO objects (key, id, type, object, reports, first_seen, last_seen) VALUES (?, ?, ?, ?, 1, ?, ?)",
+                        (key, obj["id"], obj.get("type", ""), json.dumps(obj), now, now),
+                    )
+        return [obj for _, obj in entries]
+
+    def objects(self):
+        """
+        Returns every object of the index, the merged graph of all the reports.
+        """
+        with self._connect() as conn:
+            return [json.loads(row[0]) for row in conn.execute("SELECT object FROM objects ORDER BY first_seen")]
+
+    def stats(self):
+        """
+        Returns the number of objects of each type and the number of objects seen in several reports.
+        """
+        with self._connect() as conn:
+            types = dict(conn.execute("SELECT type, COUNT(*) FROM objects GROUP BY type ORDER BY COUNT(*) DESC").fetchall())
+            shared = conn.execute("SELECT COUNT(*) FROM objects WHERE reports > 1").fetchone()[0]
+        return {"objects": sum(types.values()), "shared": shared, "types": types}
+
+
+stix_index = StixIndex() if STIX_INDEX_ENABLED else None
+
+
+def merge_objects(objects):
+    """
+    Deduplicates the objects of a bundle, and merges them into the persistent index when it is enabled.
+
+    Returns:
+        list: The objects to put in the bundle.
+    """
+    if stix_index is None:
+        return [obj for _, obj in deduplicate_objects(objects)]
+    return stix_index.merge(objects)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TI Mindmap STIX index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show the number of objects of the index")
+    export_parser = subparsers.add_parser("export", help="Write the whole index as one STIX 2.1 bundle")
+    export_parser.add_argument("output", help="The bundle file to write")
+    args = parser.parse_args(argv)
+
+    index = stix_index or StixIndex()
+    if args.command == "stats":
+        print(json.dumps(index.stats(), indent=4))
+    else:
+        bundle = {"type": "bundle", "id": f"bundle--{uuid.uuid4()}", "objects": index.objects()}
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(bundle, f, indent=4)
+        print(f"{len(bundle['objects'])} objects written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+import re
+from collections import namedtuple
+
+# A validation problem, index is the position of the object in the validated list
+StixError = namedtuple("StixError", ["index", "id", "type", "property", "message"])
+
+COMMON_SDO_PROPERTIES = ("type", "spec_version", "id", "created", "modified")
+COMMON_SCO_PROPERTIES = ("type", "id")
+
+# Required properties of each STIX 2.1 type, on top of the common ones.
+# A tuple inside the tuple means at least one of its properties is required.
+SDO_REQUIRED = {
+    "attack-pattern": ("name",),
+    "campaign": ("name",),
+    "course-of-action": ("name",),
+    "grouping": ("context", "object_refs"),
+    "identity": ("name",),
+    "incident": ("name",),
+    "indicator": ("pattern", "pattern_type", "valid_from"),
+    "infrastructure": ("name",),
+    "intrusion-set": ("name",),
+    "location": (("region", "country", "latitude"),),
+    "malware": ("is_family",),
+    "malware-analysis": ("product",),
+    "note": ("content", "object_refs"),
+    "observed-data": ("first_observed", "last_observed", "number_observed"),
+    "opinion": ("opinion", "object_refs"),
+    "report": ("name", "published", "object_refs"),
+    "threat-actor": ("name",),
+    "tool": ("name",),
+    "vulnerability": ("name",),
+    "relationship": ("relationship_type", "source_ref", "target_ref"),
+    "sighting": ("sighting_of_ref",),
+    "marking-definition": (),
+    "language-content": ("object_ref", "object_modified", "contents"),
+    "extension-definition": ("name", "schema", "version", "extension_types"),
+}
+SCO_REQUIRED = {
+    "artifact": (),
+    "autonomous-system": ("number",),
+    "directory": ("path",),
+    "domain-name": ("value",),
+    "email-addr": ("value",),
+    "email-message": ("is_multipart",),
+    "file": (("name", "hashes"),),
+    "ipv4-addr": ("value",),
+    "ipv6-addr": ("value",),
+    "mac-addr": ("value",),
+    "mutex": ("name",),
+    "network-traffic": ("protocols",),
+    "process": (),
+    "software": ("name",),
+    "url": ("value",),
+    "user-account": (),
+    "windows-registry-key": (),
+    "x509-certificate": (),
+}
+TIMESTAMP_PROPERTIES = ("created", "modified", "valid_from", "valid_until", "first_seen", "last_seen", "first_observed",
+                        "last_observed", "published", "start_time", "stop_time", "object_modified")
+BOOLEAN_PROPERTIES = ("is_family", "is_multipart", "revoked", "is_hidden", "is_active", "is_self_signed")
+
+TYPE_PATTERN = re.compile(r"^[a-z0-9][a-z0-9-]{1,248}[a-z0-9]$")
+ID_PATTERN = re.compile(r"^([a-z0-9][a-z0-9-]{1,248}[a-z0-9])--[0-9a-f]{8}-[0-9a-f]{4}-[1-8][0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}$")
+TIMESTAMP_PATTERN = re.compile(r"^\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])T([01]\d|2[0-3]):[0-5]\d:([0-5]\d|60)(\.\d+)?Z$")
+PROPERTY_NAME_PATTERN = re.compile(r"^[a-z0-9_]{3,250}$")
+
+
+def _compile_schema(object_type):
+    # The required properties of a type, common ones included, computed once at import
+    if object_type in SDO_REQUIRED:
+        return COMMON_SDO_PROPERTIES + SDO_REQUIRED[object_type]
+    if object_type in SCO_REQUIRED:
+        return COMMON_SCO_PROPERTIES + SCO_REQUIRED[object_type]
+    return None
+
+
+SCHEMAS = {object_type: _compile_schema(object_type) for object_type in list(SDO_REQUIRED) + list(SCO_REQUIRED)}
+
+
+def _check_reference(value, index, obj, name, known_ids, errors):
+    if not isinstance(value, str) or not ID_PATTERN.match(value):
+        errors.append(StixError(index, obj.get("id"), obj.get("type"), name, f"'{value}' is not a valid STIX identifier"))
+    elif known_ids is not None and value not in known_ids and not value.startswith("marking-definition--"):
+        errors.append(StixError(index, obj.get("id"), obj.get("type"), name, f"'{value}' does not reference any known object"))
+
+
+def validate_object(obj, index=0, known_ids=None):
+    """
+    Validates one STIX 2.1 object, already parsed as a dict.
+
+    Checks the required properties of its type, the format of its identifier, of its references
+    and of its timestamps, and the boolean properties. Custom properties and x- types are allowed.
+
+    Args:
+        obj (dict): The STIX object.
+        index (int): The position of the object, reported in the errors.
+        known_ids (set): When given, every reference must point to one of these identifiers.
+
+    Returns:
+        list: The StixError found, empty if the object is valid.
+    """
+    if not isinstance(obj, dict):
+        return [StixError(index, None, None, None, "The object is not a JSON object")]
+
+    errors = []
+    object_type = obj.get("type")
+    object_id = obj.get("id")
+    if not isinstance(object_type, str) or not TYPE_PATTERN.match(object_type):
+        return [StixError(index, object_id, object_type, "type", f"'{object_type}' is not a valid STIX type")]
+
+    schema = SCHEMAS.get(object_type)
+    if schema is None and not object_type.startswith("x-"):
+        errors.append(StixError(index, object_id, object_type, "type", f"'{object_type}' is not a STIX 2.1 type"))
+    for required in schema or COMMON_SCO_PROPERTIES:
+        if isinstance(required, tuple):
+            if not any(obj.get(name) not in (None, "", []) for name in required):
+                errors.append(StixError(index, object_id, object_type, "/".join(required), f"At least one of {', '.join(required)} is required"))
+        elif obj.get(required) in (None, "", []):
+            errors.append(StixError(index, object_id, object_type, required, f"'{required}' is required"))
+
+    if object_id is not None:
+        match = ID_PATTERN.match(object_id) if isinstance(object_id, str) else None
+        if not match:
+            errors.append(StixError(index, object_id, object_type, "id", f"'{object_id}' is not a valid STIX identifier"))
+        elif match.group(1) != object_type:
+            errors.append(StixError(index, object_id, object_type, "id", f"The identifier does not start with '{object_type}--'"))
+    if "spec_version" in obj and obj["spec_version"] != "2.1":
+        errors.append(StixError(index, object_id, object_type, "spec_version", "spec_version must be '2.1'"))
+    if object_type == "malware" and str(obj.get("is_family")).lower() == "true" and not obj.get("name"):
+        errors.append(StixError(index, object_id, object_type, "name", "'name' is required when is_family is true"))
+
+    for name, value in obj.items():
+        if name != "id" and not PROPERTY_NAME_PATTERN.match(name):
+            errors.append(StixError(index, object_id, object_type, name, f"'{name}' is not a valid property name"))
+        elif name in TIMESTAMP_PROPERTIES:
+            if not isinstance(value, str) or not TIMESTAMP_PATTERN.match(value):
+                errors.append(StixError(index, object_id, object_type, name, f"'{value}' is not a UTC timestamp such as 2024-01-31T12:00:00Z"))
+        elif name in BOOLEAN_PROPERTIES:
+            # stix2 accepts "true" and "false" strings as booleans
+            if not isinstance(value, bool) and str(value).lower() not in ("true", "false"):
+                errors.append(StixError(index, object_id, object_type, name, f"'{value}' is not a boolean"))
+        elif name.endswith("_ref"):
+            _check_reference(value, index, obj, name, known_ids, errors)
+        elif name.endswith("_refs"):
+            if not isinstance(value, list):
+                errors.append(StixError(index, object_id, object_type, name, f"'{name}' must be a list of identifiers"))
+            else:
+                for reference in value:
+                    _check_reference(reference, index, obj, name, known_ids, errors)
+
+    created, modified = obj.get("created"), obj.get("modified")
+    if isinstance(created, str) and isinstance(modified, str) and TIMESTAMP_PATTERN.match(created) \
+            and TIMESTAMP_PATTERN.match(modified) and modified < created:
+        errors.append(StixError(index, object_id, object_type, "modified", "'modified' is earlier than 'created'"))
+    return errors
+
+
+def validate_objects(objects, known_ids=None, strict=False):
+    """
+    Validates a list of STIX 2.1 objects.
+
+    Args:
+        objects (list): The STIX objects, as dicts.
+        known_ids (set): Identifiers the references may point to, on top of the validated objects.
+            When None, only the format of the references is checked.
+        strict (bool): Also parse every object with stix2, which is much slower but checks every property.
+
+    Returns:
+        tuple: The list of valid objects, the list of invalid objects and the list of StixError.
+    """
+    if known_ids is not None:
+        known_ids = set(known_ids) | {obj.get("id") for obj in objects if isinstance(obj, dict)}
+
+    valid, invalid, errors = [], [], []
+    for index, obj in enumerate(objects):
+        object_errors = validate_object(obj, index, known_ids)
+        if strict and not object_errors:
+            from stix2 import parse, exceptions
+            try:
+                parse(obj, allow_custom=True)
+            except exceptions.STIXError as e:
+                object_errors.append(StixError(index, obj.get("id"), obj.get("type"), None, str(e)))
+        if object_errors:
+            invalid.append(obj)
+            errors.extend(object_errors)
+        else:
+            valid.append(obj)
+    return valid, invalid, errors
+
+
+def format_errors(errors):
+    """
+    Formats validation errors as one line per error, e.g. to send them back to the LLM.
+    """
+    return "\n".join(f"{error.id or f'object #{error.index}'}: {error.message}" for error in errors)
@@ -0,0 +1,42 @@
+import threading
+
+# Average number of characters per token of English text, used when tiktoken is not available
+CHARS_PER_TOKEN = 4
+ENCODING_NAME = "o200k_base"
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_loaded = False
+
+
+def _get_encoding():
+    # tiktoken is optional and downloads its vocabulary on first use, so any failure falls back to the estimate
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(ENCODING_NAME)
+            except Exception as e:
+                print(f"tiktoken is not available ({type(e).__name__}), token counts are estimated")
+                _encoding = None
+    return _encoding
+
+
+def count_tokens(text):
+    """
+    Counts the tokens of a text with the tokenizer of the GPT-4o models.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The number of tokens, estimated from the length of the text when tiktoken is not available.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,185 @@
+"""
+Typed representation of the TTPs of a report.
+
+The TTP table is extracted once by ti_ai.ai_ttp. The attack path ordered by execution time and the
+Mermaid timeline are generated from it in Python, as is the ATT&CK Navigator layer (see
+ti_navigator.layer_from_table), without asking the LLM to analyse the article again.
+"""
+import re
+from dataclasses import dataclass
+from ti_cache import ERROR_PREFIXES
+from ti_mapreduce import parse_markdown_table
+
+# Enterprise tactics as defined by the MITRE ATT&CK framework, in kill chain order
+TACTICS = (
+    "Reconnaissance", "Resource Development", "Initial Access", "Execution", "Persistence", "Privilege Escalation",
+    "Defense Evasion", "Credential Access", "Discovery", "Lateral Movement", "Collection", "Command and Control",
+    "Exfiltration", "Impact",
+)
+# ATT&CK IDs of the Enterprise tactics
+TACTIC_IDS = {
+    "TA0043": "Reconnaissance", "TA0042": "Resource Development", "TA0001": "Initial Access", "TA0002": "Execution",
+    "TA0003": "Persistence", "TA0004": "Privilege Escalation", "TA0005": "Defense Evasion", "TA0006": "Credential Access",
+    "TA0007": "Discovery", "TA0008": "Lateral Movement", "TA0009": "Collection", "TA0011": "Command and Control",
+    "TA0010": "Exfiltration", "TA0040": "Impact",
+}
+TECHNIQUE_ID_PATTERN = re.compile(r"\bT\d{4}(?:\.\d{3})?\b")
+TACTIC_ID_PATTERN = re.compile(r"\bTA\d{4}\b", re.IGNORECASE)
+# Text the LLM adds around a tactic name, e.g. "Exfiltration (TA0010)", "[Discovery]" or "**Impact**"
+BRACKETED_PATTERN = re.compile(r"\([^)]*\)|[()\[\]*`]")
+# Characters with a meaning in the Mermaid timeline syntax
+MERMAID_SPECIAL_CHARACTERS = re.compile(r"[:;#()\[\]{}]")
+
+
+def _tactic_key(value):
+    return re.sub(r"[\W_]+", "", value.lower().replace("&", "and"))
+
+
+_TACTIC_KEYS = {_tactic_key(tactic): tactic for tactic in TACTICS}
+
+
+@dataclass
+class Technique:
+    """
+    An ATT&CK technique used in a report, under one of its tactics.
+
+    Attributes:
+        technique_id (str): The ATT&CK technique ID, e.g. T1566.001.
+        tactic (str): The tactic name, e.g. Initial Access.
+        order (int): The position of the technique in the attack, starting at 1.
+        name (str): The technique name.
+        comment (str): How the technique is used in the report.
+    """
+    technique_id: str
+    tactic: str
+    order: int = 0
+    name: str = ""
+    comment: str = ""
+
+    @property
+    def tactic_shortname(self):
+        """
+        The tactic as written in ATT&CK Navigator layers, e.g. initial-access.
+        """
+        return re.sub(r"[^a-z0-9]+", "-", self.tactic.lower()).strip("-")
+
+
+def normalise_tactic(value):
+    """
+    Returns the ATT&CK name of a tactic written by the LLM ("command & control", "Initial-Access",
+    "Exfiltration (TA0010)", "TA0010"...), or the value itself if it is not an Enterprise tactic.
+    """
+    ids = TACTIC_ID_PATTERN.findall(value)
+    name = TACTIC_ID_PATTERN.sub(" ", BRACKETED_PATTERN.sub(" ", value)).strip(" -:")
+    if _tactic_key(name) in _TACTIC_KEYS:
+        return _TACTIC_KEYS[_tactic_key(name)]
+    if not name and ids and ids[0].upper() in TACTIC_IDS:
+        return TACTIC_IDS[ids[0].upper()]
+    return name or value.strip()
+
+
+def _tactic_position(tactic):
+    return TACTICS.index(tactic) if tactic in TACTICS else len(TACTICS)
+
+
+def techniques_from_table(ttptable):
+    """
+    Parses the TTP table returned by ai_ttp into techniques, ordered by execution time.
+
+    Columns are matched by name. A technique listed under several tactics gives one technique per
+    tactic, rows without a technique ID are skipped and duplicates are merged. The execution order
+    follows the kill chain order of the tactics, then the order of the table.
+
+    Args:
+        ttptable (str): The Markdown table with the columns technique, technique ID, tactic and comment.
+
+    Returns:
+        list: The techniques, a list of Technique.
+    """
+    if not isinstance(ttptable, str):
+        return []
+    header, rows = parse_markdown_table(ttptable)
+    if not header:
+        return []
+    positions = {name.lower().strip(): i for i, name in enumerate(header)}
+
+    def cell(row, *names):
+        for name in names:
+            if name in positions:
+                return row[positions[name]]
+        return ""
+
+    techniques = {}
+    for row in rows:
+        match = TECHNIQUE_ID_PATTERN.search(cell(row, "technique id", "id", "technique_id")) or TECHNIQUE_ID_PATTERN.search(" ".join(row))
+        if not match:
+            continue
+        name = TECHNIQUE_ID_PATTERN.sub("", cell(row, "technique", "technique name", "name")).strip(" ()-")
+        # The IDs and comments in brackets are dropped first, they may hold separators
+        tactic_cell = cell(row, "tactic", "tactics")
+        names = BRACKETED_PATTERN.sub(" ", tactic_cell)
+        tactics = [tactic for tactic in re.split(r"[,;/]", names if names.strip() else tactic_cell) if tactic.strip()]
+        for tactic in tactics or [""]:
+            tactic = normalise_tactic(tactic)
+            key = (match.group(0), tactic)
+            if key in techniques:
+                continue
+            techniques[key] = Technique(match.group(0), tactic, name=name, comment=cell(row, "comment", "comments", "description"))
+
+    ordered = sorted(techniques.values(), key=lambda technique: _tactic_position(technique.tactic))
+    for order, technique in enumerate(ordered, start=1):
+        technique.order = order
+    return ordered
+
+
+def table_error(ttptable):
+    """
+    Returns the error to report for a TTP table without any technique: the error of ai_ttp itself, if it failed.
+    """
+    if isinstance(ttptable, str) and ttptable.startswith(ERROR_PREFIXES):
+        return ttptable
+    return "Failed to extract TTPs: no ATT&CK technique was found in the TTPs table"
+
+
+def attack_path(techniques):
+    """
+    Returns the TTPs ordered by execution time, one line per technique with its tactic and ID.
+    """
+    return "\n".join(
+        f"{technique.order}. {technique.tactic} - {technique.name or technique.technique_id} ({technique.technique_id})"
+        for technique in techniques
+    )
+
+
+def _mermaid_text(text):
+    return " ".join(MERMAID_SPECIAL_CHARACTERS.sub(" ", text).split())
+
+
+def timeline_mermaid(techniques, title="TTPs timeline"):
+    """
+    Returns the Mermaid.js timeline of the attack, one step per tactic in execution order.
+    """
+    lines = ["timeline", f"    title {_mermaid_text(title)}"]
+    steps = {}
+    for technique in techniques:
+        label = f"{technique.name} - {technique.technique_id}" if technique.name else technique.technique_id
+        steps.setdefault(technique.tactic or "Other", []).append(_mermaid_text(label))
+    for tactic, events in steps.items():
+        lines.append(f"    {_mermaid_text(tactic)} : " + " : ".join(events))
+    return "\n".join(lines)
+
+
+def attack_path_from_table(ttptable):
+    """
+    Returns the TTPs of the table ordered by execution time, the output formerly asked to ai_ttp_list.
+    """
+    techniques = techniques_from_table(ttptable)
+    return attack_path(techniques) if techniques else table_error(ttptable)
+
+
+def timeline_from_table(ttptable):
+    """
+    Returns the Mermaid.js timeline of the TTPs of the table, the output formerly asked to ai_ttp_graph_timeline.
+    """
+    techniques = techniques_from_table(ttptable)
+    return timeline_mermaid(techniques) if techniques else table_error(ttptable)
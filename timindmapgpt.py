@@ -1,26 +1,31 @@
-import requests
-from bs4 import BeautifulSoup
-from openai import OpenAI
-from openai import AzureOpenAI
 import streamlit as st
 from streamlit.components.v1 import html
 import pandas as pd
 import urllib.parse
 import os
+import time
 import json
+import queue
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4
-from ti_mermaid import mermaid_timeline_graph, mermaid_chart_png, markmap_to_html_with_png
+from ti_mermaid import mermaid_timeline_graph, mermaid_chart_png, markmap_to_html_with_png, add_mermaid_theme
 from ti_mermaid_live import genPakoLink
-from ti_ai import ai_check_content_relevance, ai_extract_iocs, ai_get_response, ai_process_text, ai_run_models_tweet, ai_summarise, ai_summarise_tweet, ai_run_models,ai_run_models_markmap, ai_ttp, ai_ttp_graph_timeline, ai_ttp_list
+from ti_scrape import scrape_text
+from ti_ai import ai_check_content_relevance, ai_extract_iocs, ai_get_response, ai_process_text, ai_run_models_tweet, ai_summarise, ai_summarise_tweet, ai_run_models,ai_run_models_markmap, ai_ttp
 import ti_pdf
 import ti_mermaid
 import ti_navigator
+import ti_ttp
+import ti_artifacts
 import ti_5whats
 import ti_stix
-import markdownify
-from mistralai.client import MistralClient
+import ti_scheduler
+import ti_cache
+import ti_llm
+import ti_prompts
+from ti_oneshot import oneshot_outputs
 from github import Github
-from markdownify import markdownify
 
 from streamlit_markmap import markmap
 import streamlit.components.v1 as components
@@ -34,80 +39,6 @@ REPO_NAME = "format81/ti-mindmap-storage"
 if not os.path.exists('./static'):  
     os.makedirs('./static')
 
-def scrape_text2(url):
-    """
-    Scrapes the text content from a given URL.
-
-    This function sends a GET request to the specified URL and parses the HTML content
-    to extract the text. It uses the BeautifulSoup library to parse the HTML and extract
-    the text. If the GET request is successful (HTTP status code 200), the function
-    returns the extracted text. Otherwise, it returns an error message indicating
-    that the scraping operation failed.
-
-    Parameters:
-    url (str): The URL of the webpage from which to scrape the text.
-
-    Returns:
-    str: The extracted text content from the webpage.
-    """
-
-    # Add user-agent to avoid issue when scrapping most website
-    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"}
-    # Send a GET request to the URL	
-    response = requests.get(url, headers=headers)
-    
-    # If the GET request is successful, the status code will be 200
-    if response.status_code == 200:
-        # Get the content of the response
-        page_content = response.content
-        # Create a BeautifulSoup object and specify the parser
-        soup = BeautifulSoup(page_content, "html.parser")
-        # Get the text of the soup object
-        text = soup.get_text()
-        # Return the text
-        return text
-    else:
-        return "Failed to scrape the website"
-
-def scrape_text(url):
-    """
-    Scrapes the text content from a given URL and converts it to Markdown.
-
-    This function sends a GET request to the specified URL and parses the HTML content
-    to extract the text. It uses BeautifulSoup to parse the HTML and `markdownify`
-    to convert the HTML content into Markdown format. If the GET request is successful
-    (HTTP status code 200), the function returns the extracted Markdown content.
-
-    Parameters:
-    url (str): The URL of the webpage from which to scrape the text.
-
-    Returns:
-    str: The extracted text content in Markdown format from the webpage.
-    """
-    # Add user-agent to avoid issues when scraping most websites
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
-
-    try:
-        # Send a GET request to the URL
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raise HTTPError for bad responses
-
-        # Parse the HTML content
-        soup = BeautifulSoup(response.content, "html.parser")
-
-        # Extract main content or fallback to the entire body
-        main_content = soup.find('main') or soup.body
-
-        # Convert HTML to Markdown
-        text = markdownify(str(main_content))
-
-        return text
-
-    except requests.exceptions.RequestException as e:
-        return f"Failed to scrape the website: {e}"
-
 def remove_first_non_empty_line_if_mermaid(mermaid_code):
     """
     Removes the first line of the given mermaid code if it is empty or contains the string "mermaid".
@@ -126,37 +57,6 @@ def remove_first_non_empty_line_if_mermaid(mermaid_code):
     return '\n'.join(lines)
 
 
-def add_mermaid_theme(mermaid_code, selected_theme):
-    """
-    Adds a Mermaid theme to the given Mermaid code.
-
-    Parameters:
-    mermaid_code (str): The Mermaid code to add the theme to.
-    selected_theme (str): The name of the Mermaid theme to use.
-
-    Returns:
-    str: The Mermaid code with the specified theme applied.
-
-    Raises:
-    ValueError: If the selected theme is not supported.
-    """
-
-    if selected_theme == 'Default':
-        theme = 'default'
-    elif selected_theme == 'Neutral':
-        theme = 'neutral'
-    elif selected_theme == 'Dark':
-        theme = 'dark'
-    elif selected_theme == 'Forest':
-        theme = 'forest'
-    elif selected_theme == 'Custom':
-        # Add custom theme handling here if needed
-        theme = 'base'
-    else:
-        theme = 'default'  # Default theme if selected theme is not recognized
-    
-    return f"%%{{ init: {{'theme': '{theme}'}}}}%%\n{mermaid_code}"
-
 def upload_to_github(json_content):
     """
     Uploads JSON content to a specified GitHub repository.
@@ -202,6 +102,59 @@ def upload_to_github(json_content):
     return raw_url
 
 
+# Seconds between two refreshes of the streamed outputs, a Streamlit update per token would be too slow
+STREAM_REFRESH_INTERVAL = 0.1
+# Title displayed above the partial output of each streamed task
+STREAMED_TITLES = {
+    'summary': "LLM Generated Summary",
+    'mindmap_code': "LLM Generated Mindmap Code",
+    'summary_tweet': "LLM Generated Tweet",
+    'ttptable': "TTPs table",
+    'attackpath': "TTPs ordered by execution time",
+    '5whats': "5 whats",
+}
+
+def run_tasks_streaming(tasks, titles, tokens):
+    """
+    Runs the generators with ti_scheduler and displays their output token by token while they run.
+
+    The tasks run on a background thread, since Streamlit elements can only be updated from the
+    script thread. The streamed tasks put (task name, token) tuples in the tokens queue and their
+    partial output is shown under their title until every task is done.
+
+    Parameters:
+    tasks (dict): The tasks, in the format of ti_scheduler.run_tasks.
+    titles (dict): The title of every streamed task, by task name.
+    tokens (queue.Queue): The queue receiving the tokens of the streamed tasks.
+
+    Returns:
+    dict: The results of the tasks.
+    """
+    placeholders = {name: st.empty() for name in titles if name in tasks}
+    texts = {name: "" for name in placeholders}
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(ti_scheduler.run_tasks, tasks)
+        while not (future.done() and tokens.empty()):
+            changed = set()
+            try:
+                name, token = tokens.get(timeout=STREAM_REFRESH_INTERVAL)
+                while True:
+                    if name in texts:
+                        texts[name] += token
+                        changed.add(name)
+                    name, token = tokens.get_nowait()
+            except queue.Empty:
+                pass
+            for name in changed:
+                placeholders[name].markdown(f"**{titles[name]}**\n\n{texts[name]}")
+            if changed:
+                time.sleep(STREAM_REFRESH_INTERVAL)
+        results = future.result()
+    # The complete outputs are displayed below, in their final format
+    for placeholder in placeholders.values():
+        placeholder.empty()
+    return results
+
 
 #----------------------------------------------------------------#
 
@@ -326,6 +279,20 @@ with st.sidebar:
             "Enter your MistralAI model:",
             help="Example: mistral-large-latest",
         )
+        # The model entered is passed to the generators in place of a deployment name
+        deployment_name = mistral_model or None
+
+# LLM response cache statistics
+with st.sidebar:
+    with st.expander("LLM response cache"):
+        cache_stats = ti_cache.llm_cache.stats()
+        st.markdown(f"Cached responses: {cache_stats['entries']} ({cache_stats['bytes'] / (1024 * 1024):.1f} MB)")
+        for name, counter in cache_stats['counters'].items():
+            st.markdown(f"`{name}`: {counter['hits']} hits / {counter['misses']} misses")
+    # Share of the prompt tokens served from the prompt cache of the provider, per generator
+    with st.expander("Provider prompt cache"):
+        for name, usage in ti_prompts.usage_stats().items():
+            st.markdown(f"`{name}`: {usage['cached_ratio']:.0%} of {usage['prompt_tokens']} prompt tokens cached")
 
 # "About" section to the sidebar
 st.sidebar.header("About")
@@ -358,18 +325,15 @@ with st.sidebar:
         "7) [Splunk Security Blog](https://www.splunk.com/en_us/blog/security.html)"
     )
 
-# Initialize OpenAI/Azure OpenAI client only if API key is provided
+# Initialize OpenAI/Azure OpenAI/MistralAI client only if API key is provided.
+# The clients are created once per process and reused across the reruns of the script.
 client = None
 if service_selection == "OpenAI" and openai_api_key:
-    client = OpenAI(api_key=openai_api_key)
+    client = ti_llm.get_client("OpenAI", openai_api_key)
 elif service_selection == "Azure OpenAI" and azure_api_key:
-    client = AzureOpenAI(
-        api_key = azure_api_key,
-        azure_endpoint = azure_endpoint,
-        api_version = "2023-05-15"
-    )
+    client = ti_llm.get_client("Azure OpenAI", azure_api_key, azure_endpoint)
 elif service_selection == "MistralAI" and mistral_api_key:
-    client = MistralClient(api_key=mistral_api_key)
+    client = ti_llm.get_client("MistralAI", mistral_api_key)
 
 
 
@@ -377,6 +341,71 @@ def toggle_tabs():
     st.session_state.show_tabs = not st.session_state.show_tabs
 
 
+# Outputs of a report kept in the session state, and in the artifact store across reruns and sessions
+REPORT_SECTIONS = ('summary', 'summary_tweet', 'mindmap_code', 'ttptable', 'attackpath', 'iocs_df', '5whats', 'stix', 'stix_sdo', 'stix_sco', 'stix_sro')
+# Outputs that do not depend on the generation parameters
+SHARED_ARTIFACTS = ('screenshot',)
+# The outputs depend on these parameters, they are generated again when one of them changes
+generation_variant = ti_artifacts.variant_key(provider=service_selection, model=deployment_name, language=selected_language,
+                                              mindmap=selected_mindmap_option, theme=selected_theme_option)
+
+def _variant(name):
+    return None if name in SHARED_ARTIFACTS else generation_variant
+
+def report_artifact(name, default=""):
+    # The session state can be empty after a rerun, the output is then read from the artifact store
+    value = st.session_state.get(name)
+    if isinstance(value, pd.DataFrame) or value:
+        return value
+    value = ti_artifacts.load_artifact(st.session_state.get('report_key'), name, default, _variant(name))
+    st.session_state[name] = value
+    return value
+
+def save_report_artifacts(values):
+    # Outputs are stored with the report and their generation parameters, empty outputs and error messages are skipped
+    for variant in {_variant(name) for name in values}:
+        ti_artifacts.save_artifacts(st.session_state.get('report_key'), {name: value for name, value in values.items() if _variant(name) == variant}, variant)
+
+def clear_report_artifacts(names, stored=False):
+    # Drops the outputs from the session state, and from the artifact store if stored
+    for name in names:
+        st.session_state[name] = ""
+    if stored:
+        ti_artifacts.delete_artifacts(st.session_state.get('report_key'), names, generation_variant)
+
+# The outputs of the previous parameters are not shown, those of the new ones are read from the artifact store
+if st.session_state.get('generation_variant') != generation_variant:
+    st.session_state['generation_variant'] = generation_variant
+    clear_report_artifacts(REPORT_SECTIONS + ('relevance', 'pdf'))
+
+
+
+
+def show_navigator_layer(layer):
+    # Writes the layer to ./static, publishes it to GitHub and embeds it in the MITRE ATT&CK Navigator
+    mitre_layer = json.dumps(layer, indent=4)
+
+    st.write("### MITRE ATT&CK Navigator layer json")
+    unique_id = str(uuid4())  # Create a unique ID  
+    file_name = f"./static/{unique_id}.json"  # Create a file name using the unique ID and specify directory
+
+    # Write the layer data to a file  
+    with open(file_name, 'w') as f:  
+        f.write(mitre_layer) 
+
+    # Display the JSON content
+    st.json(layer)
+
+    # Upload the layer data to GitHub and get the raw URL
+    raw_url = upload_to_github(layer)
+
+    # Embed the Navigator in an iframe
+    navigator_iframe_url = f"https://mitre-attack.github.io/attack-navigator/#layerURL={raw_url}"
+    iframe_navigator_html = f"""
+    <iframe src="{navigator_iframe_url}" width="1200" height="800" frameborder="0"></iframe>
+    """
+    st.write("## Mitre Navigator ##")
+    st.markdown(iframe_navigator_html, unsafe_allow_html=True)
 
 
 # Main UI
@@ -431,17 +460,11 @@ with col2:
         st.session_state['url4'] = url
         st.session_state['chat_history'] = []  # Clear chat history when new URL is scraped 
         st.session_state['input_key'] += 1  # Increment input key to clear user input
-        st.session_state['summary'] = ""  # Clear summary when new URL is scraped 
-        st.session_state['summary_tweet'] = ""  # Clear summary_tweet when new URL is scraped  
-        st.session_state['mindmap_code'] = ""  # Clear mindmap_code when new URL is scraped
-        st.session_state['ttptable'] = "" # Clear ttptable
-        st.session_state['attackpath'] = "" # Clear attackpath
-        st.session_state['iocs_df'] = "" # Clear iocs_df
-        st.session_state['5whats'] = "" # Clear 5whats
-        st.session_state['stix'] = "" # Clear stix
-        st.session_state['stix_sdo'] = "" # Clear stix sdo
-        st.session_state['stix_sco'] = "" # Clear stix sco
-        st.session_state['stix_sro'] = "" # Clear stix sro
+        # Restore the outputs already generated for this report, clear the others
+        st.session_state['report_key'] = ti_artifacts.open_report(url, st.session_state['text'])
+        artifacts = ti_artifacts.load_artifacts(st.session_state['report_key'], generation_variant)
+        for key in REPORT_SECTIONS:
+            st.session_state[key] = artifacts.get(key, "")
 
 
 #Insert containers separated into tabs.
@@ -466,20 +489,19 @@ if st.session_state.show_tabs:
             submit_cb_ttps_timeline = form.checkbox("📈TTPs graphic timeline",value=True) 
             submit_cb_navigator = form.checkbox("📈MITRE Navigator Layer *(The layer file is published on the [repository](https://github.com/format81/ti-mindmap-storage/) to be used by TI Mindmap.)*",value=True)
             submit_cb_5whats = form.checkbox("🗺️Threat Scope Report - 5 What",value=True) 
+            submit_cb_oneshot = form.checkbox("⚡Single-pass mode *(one LLM call generates every selected section, the article is sent once)*",value=False)
+            submit_cb_regenerate = form.checkbox("🔄Generate the outputs again, even if they were generated before for this report", value=False)
 
         with cols[0]:  
             submit_button = form.form_submit_button(":orange[**Generate**]")  
 
         if submit_button and client:
-            text = st.session_state['text']  # Use the text stored in session state 
+            text = st.session_state['text']  # Use the text stored in session state
+            if submit_cb_regenerate:
+                clear_report_artifacts(REPORT_SECTIONS + ('pdf',), stored=True)
             # Check if the content is related to cybersecurity
-            #relevance_check = ai_check_content_relevance(text, client, service_selection, deployment_name)
-            if service_selection == "OpenAI" and openai_api_key:
-                relevance_check = ai_check_content_relevance(text, client, service_selection)
-            elif service_selection == "Azure OpenAI" and azure_api_key:
-                relevance_check = ai_check_content_relevance(text, client, service_selection, deployment_name)
-            elif service_selection == "MistralAI" and mistral_api_key:
-                relevance_check = ai_check_content_relevance(text, client, service_selection, None)
+            relevance_check = report_artifact('relevance') or ai_check_content_relevance(text, client, service_selection, deployment_name)
+            save_report_artifacts({'relevance': relevance_check})
 
             if "not related to cybersecurity" in relevance_check:
                 st.write(f"**Content not related to cybersecurity**, It's about {relevance_check}")
@@ -492,207 +514,180 @@ if st.session_state.show_tabs:
                 with st.expander("See full article in MarkDown format"):
                     st.write(text)
 
-                # Generate Summary and Mindmap
+                # Queue the selected generators, tasks without dependencies between them run concurrently.
+                # The text outputs are streamed, their tokens are displayed as soon as they are generated.
+                tokens = queue.Queue()
+                on_token = lambda name: (lambda token: tokens.put((name, token)))
+                tasks = {}
+                if submit_cb_summary:
+                    # Check if summary and mindmap_code exist in session state
+                    if not report_artifact('summary'):
+                        tasks['summary'] = (lambda: ai_summarise(text, client, service_selection, selected_language, deployment_name, on_token('summary')), ())
+                    if not report_artifact('mindmap_code'):
+                        if selected_mindmap_option == "Mermaid" or service_selection == "MistralAI":
+                            tasks['mindmap_code'] = (lambda: add_mermaid_theme(ai_run_models(input_text, client, selected_language, service_selection, deployment_name, on_token('mindmap_code')), selected_theme_option), ())
+                        else:
+                            tasks['mindmap_code'] = (lambda: ai_run_models_markmap(input_text, client, selected_language, service_selection, deployment_name, on_token('mindmap_code')), ())
+                if submit_cb_tweet:
+                    # Check if tweet exists in session state
+                    if not report_artifact('summary_tweet'):
+                        tasks['summary_tweet'] = (lambda: ai_summarise_tweet(text, client, service_selection, selected_language, deployment_name, on_token('summary_tweet')), ())
+                    if submit_cb_summary == False:
+                        tasks['mindmap_tweet'] = (lambda: add_mermaid_theme(ai_run_models_tweet(input_text, client, selected_language, service_selection, deployment_name), selected_theme_option), ())
+                if submit_cb_ioc and not isinstance(report_artifact('iocs_df'), pd.DataFrame):
+                    tasks['iocs_df'] = (lambda: ai_extract_iocs(text, client, service_selection, deployment_name), ())
+                # The TTPs table is extracted once, the TTPs list, the timeline and the MITRE Navigator layer are built from it without the LLM
+                if submit_cb_ttps or submit_cb_ttps_by_time or submit_cb_ttps_timeline or submit_cb_navigator:
+                    # The tasks run on worker threads without the session state, the stored table is read here
+                    stored_ttptable = report_artifact('ttptable')
+                    if stored_ttptable:
+                        tasks['ttptable'] = (lambda: stored_ttptable, ())
+                    else:
+                        tasks['ttptable'] = (lambda: ai_ttp(text, client, service_selection, deployment_name, on_token('ttptable')), ())
+                if submit_cb_ttps_by_time and not report_artifact('attackpath'):
+                    tasks['attackpath'] = (ti_ttp.attack_path_from_table, ('ttptable',))
+                if submit_cb_ttps_timeline:
+                    tasks['mermaid_timeline'] = (ti_ttp.timeline_from_table, ('ttptable',))
+                if submit_cb_5whats and not report_artifact('5whats'):
+                    tasks['5whats'] = (lambda: ti_5whats.ai_fivewhats(text, client, service_selection, deployment_name, on_token('5whats')), ())
+                if submit_cb_navigator:
+                    tasks['mitre_layer'] = (ti_navigator.layer_from_table, ('ttptable',))
+
+                if submit_cb_oneshot:
+                    # One LLM call generates every selected section, the tasks read their section of its output
+                    oneshot_sections = {'summary': 'summary', 'summary_tweet': 'tweet', 'mindmap_code': 'mindmap', 'mindmap_tweet': 'mindmap',
+                                        'iocs_df': 'iocs', 'ttptable': 'ttps', '5whats': '5whats'}
+                    sections = [section for name, section in oneshot_sections.items() if name in tasks]
+                    markmap_code = 'mindmap_code' in tasks and selected_mindmap_option != "Mermaid" and service_selection != "MistralAI"
+                    mindmap_format = "MarkMap" if markmap_code else "Mermaid"
+                    tasks['oneshot'] = (lambda: oneshot_outputs(text, client, service_selection, selected_language, sections, deployment_name, mindmap_format), ())
+                    for name, section in oneshot_sections.items():
+                        if name in tasks and name in ('mindmap_code', 'mindmap_tweet') and not markmap_code:
+                            tasks[name] = (lambda outputs, section=section: add_mermaid_theme(outputs[section], selected_theme_option), ('oneshot',))
+                        elif name in tasks:
+                            tasks[name] = (lambda outputs, section=section: outputs[section], ('oneshot',))
+
+                with st.spinner("Generating the selected outputs"):
+                    results = run_tasks_streaming(tasks, STREAMED_TITLES, tokens)
+
+                # Keep the generated outputs in session state so they are reused by the next run
+                for key in ('summary', 'mindmap_code', 'summary_tweet', 'iocs_df', 'ttptable', 'attackpath', '5whats'):
+                    if key in results:
+                        st.session_state[key] = results[key]
+                # and in the artifact store, so the PDF and STIX tabs and the next sessions reuse them
+                save_report_artifacts({key: value for key, value in results.items() if key != 'oneshot'})
+
+                # Summary and Mindmap
                 if submit_cb_summary:    
-                    with st.spinner("Generating Summary "):  
-                        # Check if summary exists in session state  
-                        if st.session_state['summary']:  
-                            summary = st.session_state['summary']  
-                        else:  
-                            #summary = ai_summarise(text, client, service_selection, selected_language, deployment_name)
-                            if service_selection == "OpenAI" and openai_api_key:
-                                summary = ai_summarise(text, client, service_selection, selected_language)
-                            elif service_selection == "Azure OpenAI" and azure_api_key:
-                                summary = ai_summarise(text, client, service_selection, selected_language, deployment_name)
-                            elif service_selection == "MistralAI" and mistral_api_key:
-                                summary = ai_summarise(text, client, service_selection, selected_language, None)  
-                            st.session_state['summary'] = summary  
-                        st.write("### LLM Generated Summary")  
-                        st.write(summary)
-                        st.write(st.session_state['mindmap_code'])
-    
-                        with st.spinner("Generating Mindmap Code"):  
-                            # Check if mindmap_code exists in session state  
-                            if st.session_state['mindmap_code']:  
-                                mindmap_code = st.session_state['mindmap_code']  
-                            else:  
-                                #mindmap_code = add_mermaid_theme(ai_run_models(input_text, client, selected_language,deployment_name, service_selection),selected_theme_option)
-                                
-                                if service_selection == "OpenAI" and openai_api_key:
-                                    if selected_mindmap_option == "Mermaid":
-                                        mindmap_code = add_mermaid_theme(ai_run_models(input_text, client, selected_language, service_selection), selected_theme_option)
-                                    else:
-                                        mindmap_code = ai_run_models_markmap(input_text, client, selected_language, service_selection)
-                                
-                                elif service_selection == "Azure OpenAI" and azure_api_key:
-                                    if selected_mindmap_option == "Mermaid":
-                                        
-                                        mindmap_code = add_mermaid_theme(ai_run_models(input_text, client, selected_language, service_selection, deployment_name), selected_theme_option)
-                                    else:
-                                        
-                                        mindmap_code = ai_run_models_markmap(input_text, client, selected_language, service_selection, deployment_name)
-
-                                elif service_selection == "MistralAI" and mistral_api_key:
-                                    mindmap_code = add_mermaid_theme(ai_run_models(input_text, client, selected_language, service_selection), selected_theme_option)  
-                                    
-                                st.session_state['mindmap_code'] = mindmap_code  
-                            
-                            if selected_mindmap_option == "Mermaid":
-                                html(mermaid_chart_png(mindmap_code), width=1500, height=1500)  
-                            else:
-                                mm = markmap(mindmap_code, height=600)
+                    summary = st.session_state['summary']
+                    st.write("### LLM Generated Summary")  
+                    st.write(summary)
 
-                        with st.expander("See LLM Generated " + selected_mindmap_option + " Code"):  
-                            st.code(mindmap_code) 
+                    mindmap_code = st.session_state['mindmap_code']
+                    if selected_mindmap_option == "Mermaid":
+                        html(mermaid_chart_png(mindmap_code), width=1500, height=1500)  
+                    else:
+                        mm = markmap(mindmap_code, height=600)
+
+                    with st.expander("See LLM Generated " + selected_mindmap_option + " Code"):  
+                        st.code(mindmap_code) 
                 mermaid_link1 = genPakoLink(mindmap_code)
                 st.link_button("Open code in Mermaid.live", mermaid_link1)  
 
-                #Generate tweet
+                # Tweet
                 if submit_cb_tweet:
-                    with st.spinner("Generating Tweet"):
-                        # Check if tweet exists in session state
-                        if st.session_state['summary_tweet']:
-                            tweet = st.session_state['summary_tweet']
-                        else:
-                            #summary_tweet = ai_summarise_tweet(text, client, service_selection, selected_language,deployment_name)
-                            if service_selection == "OpenAI" and openai_api_key:
-                                summary_tweet = ai_summarise_tweet(text, client, service_selection, selected_language)
-                            elif service_selection == "Azure OpenAI" and azure_api_key:
-                                summary_tweet = ai_summarise_tweet(text, client, service_selection, selected_language, deployment_name)
-                            elif service_selection == "MistralAI" and mistral_api_key:
-                                summary_tweet = ai_summarise_tweet(text, client, service_selection, selected_language, None)  
-                            st.session_state['summary'] = summary 
-                        st.write("### LLM Generated Tweet")
-                        user_input = st.text_area("Edit your tweet:", summary_tweet, height=100)
-
-                        if submit_cb_summary == False:
-                            with st.spinner("Generating Mermaid Tweet Code"):
-                                #mindmap_code = add_mermaid_theme(ai_run_models_tweet(input_text, client, selected_language,deployment_name,service_selection),selected_theme_option)
-                                if service_selection == "OpenAI" and openai_api_key:
-                                    mindmap_code = add_mermaid_theme(ai_run_models_tweet(input_text, client, selected_language,service_selection),selected_theme_option)
-                                elif service_selection == "Azure OpenAI" and azure_api_key:
-                                    mindmap_code = add_mermaid_theme(ai_run_models_tweet(input_text, client, selected_language,service_selection, deployment_name),selected_theme_option)
-                                elif service_selection == "MistralAI" and mistral_api_key:
-                                    mindmap_code = add_mermaid_theme(ai_run_models_tweet(input_text, client, selected_language,service_selection),selected_theme_option)
-                                html(mermaid_chart_png(mindmap_code), width=600, height=600)
-                            with st.expander("See LLM Generated Mermaid Code - sorter version"):
-                                st.code(mindmap_code)                       
-
-                        # URL you want to open
-                        url = f"https://twitter.com/intent/tweet?text={urllib.parse.quote((user_input+' '+url))}"
-                        # Label for the button
-                        button_label = "Tweet it"
-                        # Text to display before the button
-                        instruction_text = "1.Save Mindmap above<br>   2.Click it "
-                        instruction_text2 = "<br> 3. Add saved mindmap to your tweet"
-                        # Create text and a button in Streamlit to open the link
-                        st.markdown(f'{instruction_text} <a href="{url}" target="_blank"><button>{button_label}</button></a>{instruction_text2}', unsafe_allow_html=True)
+                    summary_tweet = st.session_state['summary_tweet']
+                    st.write("### LLM Generated Tweet")
+                    user_input = st.text_area("Edit your tweet:", summary_tweet, height=100)
+
+                    if submit_cb_summary == False:
+                        mindmap_code = results['mindmap_tweet']
+                        html(mermaid_chart_png(mindmap_code), width=600, height=600)
+                        with st.expander("See LLM Generated Mermaid Code - sorter version"):
+                            st.code(mindmap_code)                       
+
+                    # URL you want to open
+                    url = f"https://twitter.com/intent/tweet?text={urllib.parse.quote((user_input+' '+url))}"
+                    # Label for the button
+                    button_label = "Tweet it"
+                    # Text to display before the button
+                    instruction_text = "1.Save Mindmap above<br>   2.Click it "
+                    instruction_text2 = "<br> 3. Add saved mindmap to your tweet"
+                    # Create text and a button in Streamlit to open the link
+                    st.markdown(f'{instruction_text} <a href="{url}" target="_blank"><button>{button_label}</button></a>{instruction_text2}', unsafe_allow_html=True)
             
+                # IOCs
                 if submit_cb_ioc:
-                    with st.spinner("Extracting IOCs"):
-                        # Check if IOCs exist in session state  
-                        if st.session_state['iocs_df']:  
-                            iocs_df = st.session_state['iocs_df']  
-                        else:
-                            iocs_df = ai_extract_iocs(text, client, service_selection, deployment_name)
-                            if isinstance(iocs_df, pd.DataFrame):
-                                st.write("### Extracted IOCs")
-                                st.dataframe(iocs_df)
-                            else:
-                                st.error(iocs_df)
+                    iocs_df = st.session_state['iocs_df']
+                    if isinstance(iocs_df, pd.DataFrame):
+                        st.write("### Extracted IOCs")
+                        st.dataframe(iocs_df)
+                    else:
+                        st.error(iocs_df)
 
-                # Extracting TTPs and displaying them as a table
+                # TTPs displayed as a table
                 if submit_cb_ttps:
-                    with st.spinner("Extracting TTPs (tactics, techniques, and procedures) table from the scraped text."):
-                        ttptable = ai_ttp(text, client,service_selection, deployment_name)  # Assign the output of ttp to ttptable
-                        st.session_state['ttptable'] = ttptable 
-                        st.write("### TTPs table")
-                        st.write(ttptable)
+                    ttptable = st.session_state['ttptable']
+                    st.write("### TTPs table")
+                    st.write(ttptable)
             
-                #TTPs ordered by execution time
+                # TTPs ordered by execution time
                 if submit_cb_ttps_by_time:
-                    with st.spinner("TTPs ordered by execution time"):
-                        # Check if attackpath exists in session state 
-                        if st.session_state['attackpath']:
-                            attackpath = st.session_state['attackpath']  
-                        else:
-                            attackpath = ai_ttp_list(text, ttptable, client, service_selection, deployment_name)
-                            st.session_state['attackpath'] = attackpath  
-                        st.write("### TTPs ordered by execution time")  
-                        st.write(attackpath)
+                    attackpath = st.session_state['attackpath']
+                    st.write("### TTPs ordered by execution time")  
+                    st.write(attackpath)
 
                 # Mermaid TTPs timeline
                 if submit_cb_ttps_timeline:
-                    with st.spinner("Mermaid TTPs Timeline"):
-                        mermaid_timeline = ai_ttp_graph_timeline(text, client, service_selection, deployment_name)
-                        with st.expander("See LLM Generated Mermaid TTPs Timeline"):
-                            st.code(mermaid_timeline)
-                        html(mermaid_timeline_graph(mermaid_timeline), width=1500, height=1500)
-                        mermaid_link2 = genPakoLink(mermaid_timeline)
-                        st.link_button("Open code in Mermaid.live", mermaid_link2)
-
-                #5whats
+                    mermaid_timeline = results['mermaid_timeline']
+                    with st.expander("See Mermaid TTPs Timeline code"):
+                        st.code(mermaid_timeline)
+                    html(mermaid_timeline_graph(mermaid_timeline), width=1500, height=1500)
+                    mermaid_link2 = genPakoLink(mermaid_timeline)
+                    st.link_button("Open code in Mermaid.live", mermaid_link2)
+
+                # 5whats
                 if submit_cb_5whats:
-                    with st.spinner("5 whats"):
-                        # Check if attackpath exists in session state 
-                        if st.session_state['5whats']:
-                            fivewhats = st.session_state['5whats']  
-                        else:
-                            fivewhats = ti_5whats.ai_fivewhats(text, client, service_selection, deployment_name)
-                            st.session_state['5whats'] = fivewhats  
-                        st.write("### 5 whats")  
-                        st.write(fivewhats)
+                    fivewhats = st.session_state['5whats']
+                    st.write("### 5 whats")  
+                    st.write(fivewhats)
 
-
-                #Mitre Navigator layer
+                # Mitre Navigator layer
                 if submit_cb_navigator:
-                    with st.spinner("MITRE Navigator Layer"):
-                        mitre_layer = ti_navigator.attack_layer(text, ttptable, client, service_selection, deployment_name)
-                        # Check if mitre_layer is valid JSON
-                        try:
-                            json.loads(mitre_layer)
-                        except json.JSONDecodeError:
-                            st.error("The generated layer is not a valid JSON file.")
-                            if st.button("Click here to regenerate the layer"):
-                                mitre_layer = ti_navigator.attack_layer(text, client, service_selection, deployment_name)
-                                try:
-                                    json.loads(mitre_layer)
-                                except json.JSONDecodeError:
-                                    st.error("Failed to regenerate the layer. Please try again.")
-                                    st.stop()  # Stop further execution
-                                else:
-                                    st.success("Layer regenerated successfully.")
-                            
-                    st.write("### MITRE ATT&CK Navigator layer json")
-                    unique_id = str(uuid4())  # Create a unique ID  
-                    file_name = f"./static/{unique_id}.json"  # Create a file name using the unique ID and specify directory
-
-                    # Write the layer data to a file  
-                    with open(file_name, 'w') as f:  
-                        f.write(mitre_layer) 
-                    
-                    # Display the JSON content
-                    st.json(json.loads(mitre_layer))
-
-                    # Upload the layer data to GitHub and get the raw URL
-                    raw_url = upload_to_github(json.loads(mitre_layer))
-
-                    # Embed the Navigator in an iframe
-                    navigator_iframe_url = f"https://mitre-attack.github.io/attack-navigator/#layerURL={raw_url}"
-                    iframe_navigator_html = f"""
-                    <iframe src="{navigator_iframe_url}" width="1200" height="800" frameborder="0"></iframe>
-                    """
-                    st.write("## Mitre Navigator ##")
-                    st.markdown(iframe_navigator_html, unsafe_allow_html=True)  
-                    
-                elif submit_button and not client:
-                    st.error("Please enter a valid OpenAI API key to generate the mindmap.")
+                    # The layer is built from the TTPs table, the LLM writes it only when the table has no technique
+                    layer = ti_navigator.parse_layer(results['mitre_layer'])
+                    if layer is None:
+                        st.error(results['mitre_layer'])
+                        # The button reruns the script without the form submit, the layer is generated on that rerun
+                        st.button("Click here to generate the layer with the LLM", key="llm_layer_button",
+                                  on_click=lambda: st.session_state.update(llm_layer_requested=True))
+                    else:
+                        show_navigator_layer(layer)
+
+        elif submit_button and not client:
+            st.error("Please enter a valid OpenAI API key to generate the mindmap.")
+
+        # LLM fallback of the Navigator layer, requested by the button above
+        if st.session_state.get('llm_layer_requested') and client:
+            st.session_state['llm_layer_requested'] = False
+            with st.spinner("Generating the MITRE Navigator layer"):
+                layer = ti_navigator.parse_layer(ti_navigator.attack_layer(st.session_state['text'], report_artifact('ttptable'), client, service_selection, deployment_name))
+            if layer is None:
+                st.error("Failed to generate the layer with the LLM. Please try again.")
+            else:
+                st.success("Layer generated successfully.")
+                show_navigator_layer(layer)
+
 
         #TAB2   
         with tab2:
             st.header("💾 AI Chat with your data")
-            # Process the text using the selected service
-            knowledge_base = ai_process_text(st.session_state['text'], service_selection, azure_api_key, azure_endpoint, embedding_deployment_name, openai_api_key, mistral_api_key)
+            # Process the text using the selected service, the knowledge base is built once per text and embedding model
+            knowledge_base_key = (hashlib.sha256(st.session_state['text'].encode()).hexdigest(), service_selection, embedding_deployment_name)
+            if st.session_state.get('knowledge_base_key') != knowledge_base_key:
+                st.session_state['knowledge_base'] = ai_process_text(st.session_state['text'], service_selection, azure_api_key, azure_endpoint, embedding_deployment_name, openai_api_key, mistral_api_key)
+                st.session_state['knowledge_base_key'] = knowledge_base_key
+            knowledge_base = st.session_state['knowledge_base']
             # Initialize chat history in session state if it does not exist
             if 'chat_history' not in st.session_state:
                 st.session_state['chat_history'] = []
@@ -728,7 +723,7 @@ if st.session_state.show_tabs:
             
         with cols4[1]:
             submit_cb_summary4 = form4.checkbox("🗺️Add Summary and MindMap",value=True)
-            #submit_cb_ioc4 = form4.checkbox("🧐I want to extract and add IOCs (if present)",value=True)
+            submit_cb_ioc4 = form4.checkbox("🧐Add the IOCs table (if present)",value=True)
             #submit_cb_ttps4 = form4.checkbox("📊Extract adversary tactics, techniques, and procedures (TTPs)",value=True)
             submit_cb_ttps_by_time4 = form4.checkbox("🕰️TTPs ordered by execution time",value=True)
             #submit_cb_ttps_timeline4 = form4.checkbox("📈TTPs (Tactics, Techniques, and Procedures) graphic timeline",value=True)
@@ -738,8 +733,9 @@ if st.session_state.show_tabs:
             submit_button4 = form4.form_submit_button(":orange[**Generate PDF**]")
 
         if submit_button4 and client:  
-            text = st.session_state['text']  # Use the text stored in session state  
-            relevance_check4 = ai_check_content_relevance(text, client, service_selection, deployment_name)  
+            text = st.session_state['text']  # Use the text stored in session state
+            relevance_check4 = report_artifact('relevance') or ai_check_content_relevance(text, client, service_selection, deployment_name)
+            save_report_artifacts({'relevance': relevance_check4})
             if "not related to cybersecurity" in relevance_check4:  
                 st.write(f"**Content not related to cybersecurity**, It's about {relevance_check}")  
             else:  
@@ -748,50 +744,82 @@ if st.session_state.show_tabs:
                     st.write(text)  
     
                 # Generate Summary and Mindmap  
+                summary = ""
                 if submit_cb_summary4:  
                     with st.spinner("Generating Summary "):  
-                        # Check if summary exists in session state  
-                        if st.session_state['summary']:  
-                            summary = st.session_state['summary']  
-                        else:  
-                            summary = ai_summarise(text, client, service_selection, selected_language, deployment_name)  
-                            st.session_state['summary'] = summary  
+                        # Check if summary exists in session state or in the artifact store
+                        if report_artifact('summary'):
+                            summary = st.session_state['summary']
+                        else:
+                            summary = ai_summarise(text, client, service_selection, selected_language, deployment_name)
+                            st.session_state['summary'] = summary
+                            save_report_artifacts({'summary': summary})
                         st.write("### OpenAI Generated Summary")  
                         st.write(summary)   
     
                         with st.spinner("Generating Mindmap Code"):  
-                            # Check if mindmap_code exists in session state  
-                            if st.session_state['mindmap_code']:  
-                                mindmap_code = st.session_state['mindmap_code']  
-                            else:  
-                                mindmap_code = add_mermaid_theme(ai_run_models(input_text, client, selected_language, deployment_name, service_selection),selected_theme_option)  
-                                st.session_state['mindmap_code'] = mindmap_code  
+                            # Check if mindmap_code exists in session state or in the artifact store
+                            if report_artifact('mindmap_code'):
+                                mindmap_code = st.session_state['mindmap_code']
+                            else:
+                                mindmap_code = add_mermaid_theme(ai_run_models(input_text, client, selected_language, service_selection, deployment_name),selected_theme_option)
+                                st.session_state['mindmap_code'] = mindmap_code
+                                save_report_artifacts({'mindmap_code': mindmap_code})
                             html(mermaid_chart_png(mindmap_code), width=1500, height=1500)  
                         with st.expander("See OpenAI Generated Mermaid Code"):  
                             st.code(mindmap_code)  
             
+                # Extracting IOCs
+                iocs_df = None
+                if submit_cb_ioc4:
+                    with st.spinner("Extracting IOCs"):
+                        # Check if the IOCs exist in session state or in the artifact store
+                        if isinstance(report_artifact('iocs_df'), pd.DataFrame):
+                            iocs_df = st.session_state['iocs_df']
+                        else:
+                            iocs_df = ai_extract_iocs(text, client, service_selection, deployment_name)
+                            st.session_state['iocs_df'] = iocs_df
+                            save_report_artifacts({'iocs_df': iocs_df})
+                        if not isinstance(iocs_df, pd.DataFrame):
+                            st.error(iocs_df)
+                            iocs_df = None
+
                 # Extracting TTPs 
+                ttptable = attackpath = None
                 if submit_cb_ttps_by_time4:  
                     with st.spinner("TTPs ordered by execution time"):  
-                        # Check if ttptable exists in session state  
-                        if st.session_state['ttptable']:
-                            ttptable = st.session_state['ttptable']  
-                        else:  
-                            ttptable = ai_ttp(text, client, service_selection,  deployment_name, input_text)  # Assign the output of ttp to ttptable  
-                            st.session_state['ttptable'] = ttptable   
+                        # Check if ttptable exists in session state or in the artifact store
+                        if report_artifact('ttptable'):
+                            ttptable = st.session_state['ttptable']
+                        else:
+                            ttptable = ai_ttp(text, client, service_selection, deployment_name)  # Assign the output of ttp to ttptable
+                            st.session_state['ttptable'] = ttptable
+                            save_report_artifacts({'ttptable': ttptable})
                         st.write("### TTPs table")  
                         st.write(ttptable)  
     
-                        # Check if attackpath exists in session state 
-                        if st.session_state['attackpath']:
-                            attackpath = st.session_state['attackpath']  
+                        # Check if attackpath exists in session state or in the artifact store
+                        if report_artifact('attackpath'):
+                            attackpath = st.session_state['attackpath']
                         else:
-                            attackpath = ai_ttp_list(text, ttptable, client, service_selection, deployment_name)
-                            st.session_state['attackpath'] = attackpath  
+                            attackpath = ti_ttp.attack_path_from_table(ttptable)
+                            st.session_state['attackpath'] = attackpath
+                            save_report_artifacts({'attackpath': attackpath})
                         st.write("### TTPs ordered by execution time")  
                         st.write(attackpath)
 
-                pdf_bytes = ti_pdf.create_pdf_bytes(st.session_state['url4'], summary, mindmap_code, attackpath=None)
+                # The PDF of the same sections is read from the artifact store with its images
+                stored_pdf = report_artifact('pdf', None)
+                pdf_sections = {'summary': summary, 'mindmap_code': mindmap_code, 'attackpath': attackpath, 'ttptable': ttptable,
+                                'iocs': len(iocs_df) if iocs_df is not None else None}
+                if stored_pdf and all(stored_pdf.get(name) == value for name, value in pdf_sections.items()):
+                    pdf_bytes = stored_pdf['bytes']
+                else:
+                    images = ti_pdf.fetch_pdf_images(st.session_state['url4'], mindmap_code, {'screenshot': report_artifact('screenshot', None)})
+                    pdf_bytes = ti_pdf.create_pdf_bytes(st.session_state['url4'], summary, mindmap_code, attackpath=attackpath,
+                                                        images=images, iocs=iocs_df, ttptable=ttptable)
+                    save_report_artifacts({'screenshot': images['screenshot'],
+                                           'pdf': dict(pdf_sections, images=images, bytes=pdf_bytes)})
 
                 st.download_button(label="Save report to disk",
                             data=pdf_bytes,
@@ -801,18 +829,16 @@ if st.session_state.show_tabs:
     #TAB4
     with tab4:
         st.write("📷 Screenshot")
-        # Access the secret API key
-        api_key_thumbnail = st.secrets["api_keys"]["thumbnail"]
-        # Make a request to the API
-        screenshot = requests.get(f"https://api.thumbnail.ws/api/{api_key_thumbnail}/thumbnail/get?url={url}&width=840&delay=1500")
-
-        # If the request is successful, display the image
-        if screenshot.status_code == 200:
-            screenshot_data = screenshot.content  # Store the screenshot image data
+        # The screenshot is kept in the image cache and in the artifact store, the PDF report reuses it
+        screenshot_data = report_artifact('screenshot', None) or (ti_pdf.get_screenshot(url) if url else None)
+        save_report_artifacts({'screenshot': screenshot_data})
+
+        # If the screenshot was taken, display the image
+        if screenshot_data:
             st.image(screenshot_data)
             st.session_state['screenshot_data'] = screenshot_data  # Save to session state
         else:
-            st.write(f"Failed to get the image. Status code: {screenshot.status_code}")
+            st.write("Failed to get the screenshot.")
             st.session_state['screenshot_data'] = None  # Ensure there's a default value
         
     #TAB5
@@ -823,6 +849,7 @@ if st.session_state.show_tabs:
             
         with cols5[1]:
             submit_stix = form5.checkbox("🗺️Generate STIX 2.1 bundle", value=True)
+            regenerate_stix = form5.checkbox("🔄Generate the objects again, even if they were generated before for this report", value=False)
             
         with cols5[0]:
             submit_button5 = form5.form_submit_button(":orange[**Generate STIX2.1**]")
@@ -830,133 +857,68 @@ if st.session_state.show_tabs:
         if submit_button5 and client:  
             text = st.session_state['text']  # Use the text stored in session state
 
-            is_valid = False
-
-            while not is_valid:
-                try:
-                    # Generate STIX SDO from the LLM
-                    stix_sdo = ti_stix.sdo_stix(text, client, service_selection, deployment_name)
-
-                    # Parse STIX SDO string to a Python list
-                    stix_data = json.loads(stix_sdo)
-                    if not isinstance(stix_data, list):
-                        raise ValueError("Parsed STIX SDO must be a list of dictionaries.")
-
-                    # Add UUIDs to IDs
-                    stix_data = ti_stix.add_uuid_to_ids(stix_data)
-
-                    # Validate STIX objects
-                    is_valid, invalid_objects = ti_stix.validate_stix_objects(stix_data)
-
-                    if not is_valid:
-                        print("Validation failed. Requesting correction from LLM...")
-                        stix_sdo = ti_stix.correct_invalid_stix(text, invalid_objects, stix_sdo)
-                    else:
-                        print("Validation successful. All objects are valid.")
-
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing STIX SDO: {e}")
-                    stix_sdo = ti_stix.correct_invalid_stix(text, [], stix_sdo)
-                except ValueError as e:
-                    print(e)
-                    stix_sdo = ti_stix.correct_invalid_stix(text, [], stix_sdo)
+            # The objects generated before for this report are read from the artifact store
+            stored_stix = [report_artifact(key) for key in ('stix_sdo', 'stix_sco', 'stix_sro')]
+            if all(stored_stix) and not regenerate_stix:
+                stix_sdo_objects, stix_sco_objects, stix_sro_objects = (json.loads(objects) for objects in stored_stix)
+            else:
+                # Generate the SDOs and SCOs in parallel, then the SROs, with a bounded number of corrections.
+                # The objects are streamed by the pipeline thread and displayed as soon as they are validated.
+                streamed_objects = queue.Queue()
+                counts = {"sdo": 0, "sco": 0, "sro": 0}
+                progress = st.empty()
+                latest_object = st.empty()
+                with st.spinner("Generating the STIX 2.1 objects"):
+                    with ThreadPoolExecutor(max_workers=1) as executor:
+                        pipeline = executor.submit(ti_stix.generate_stix_objects, text, client, service_selection, deployment_name,
+                                                   on_object=lambda stage, obj: streamed_objects.put((stage, obj)))
+                        while not (pipeline.done() and streamed_objects.empty()):
+                            try:
+                                stage, obj = streamed_objects.get(timeout=0.2)
+                            except queue.Empty:
+                                continue
+                            counts[stage] += 1
+                            progress.write(f"Received {counts['sdo']} SDOs, {counts['sco']} SCOs and {counts['sro']} SROs")
+                            latest_object.code(json.dumps(obj, indent=4))
+                        stix_sdo_objects, stix_sco_objects, stix_sro_objects = pipeline.result()
+                latest_object.empty()
 
             # Final validated STIX SDO as JSON string
-            stix_sdo = json.dumps(stix_data, indent=4)
+            stix_sdo = json.dumps(stix_sdo_objects, indent=4)
             st.session_state['stix_sdo'] = stix_sdo
             with st.expander("See SDO Json"):  
                 st.code(stix_sdo)
-                
-            # Now handle STIX SCO generation
-            is_valid_sco = False
-            while not is_valid_sco:
-                try:
-                    # Generate STIX SCO from the LLM
-                    stix_sco = ti_stix.sco_stix(text, client, service_selection, deployment_name)
-
-                    # Parse STIX SCO string to a Python list
-                    stix_sco_data = json.loads(stix_sco)
-                    if not isinstance(stix_sco_data, list):
-                        raise ValueError("Parsed STIX SCO must be a list of dictionaries.")
-
-                    # Add UUIDs to IDs
-                    stix_sco_data = ti_stix.add_uuid_to_ids(stix_sco_data)
-
-                    # Validate STIX objects
-                    is_valid_sco, invalid_sco_objects = ti_stix.validate_stix_objects(stix_sco_data)
-
-                    if not is_valid_sco:
-                        print("Validation failed for SCO. Requesting correction from LLM...")
-                        stix_sco = ti_stix.correct_invalid_stix(text, invalid_sco_objects, stix_sco)
-                    else:
-                        print("Validation successful for SCO. All objects are valid.")
-
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing STIX SCO: {e}")
-                    stix_sco = ti_stix.correct_invalid_stix(text, [], stix_sco)
-                except ValueError as e:
-                    print(e)
-                    stix_sco = ti_stix.correct_invalid_stix(text, [], stix_sco)
 
             # Final validated STIX SCO as JSON string
-            stix_sco = json.dumps(stix_sco_data, indent=4)
+            stix_sco = json.dumps(stix_sco_objects, indent=4)
             st.session_state['stix_sco'] = stix_sco
             with st.expander("See SCO JSON"):  
                 st.code(stix_sco)
-        
-            # Final validated STIX SRO as JSON string
-            is_valid = False
-            stix_sro = st.session_state['stix_sro'] 
 
-            while not is_valid:
-                try:
-                    # Generate STIX SROs
-                    stix_sro = ti_stix.sro_stix(text, stix_sdo, stix_sco, client, service_selection, deployment_name)
-
-                    # Parse and validate STIX SROs
-                    stix_sro_data = json.loads(stix_sro)
-                    if not isinstance(stix_sro_data, list):
-                        raise ValueError("Parsed STIX SRO must be a list of dictionaries.")
-
-                    # Add UUIDs to IDs
-                    stix_sro_data = ti_stix.add_uuid_to_ids(stix_sro_data)
+            # Final validated STIX SRO as JSON string
+            stix_sro = json.dumps(stix_sro_objects, indent=4)
+            st.session_state['stix_sro'] = stix_sro
+            with st.expander("See SRO JSON"):  
+                st.code(stix_sro)
 
-                    # Validate STIX objects
-                    is_valid, invalid_objects = ti_stix.validate_stix_objects(stix_sro_data)
+            save_report_artifacts({'stix_sdo': stix_sdo, 'stix_sco': stix_sco, 'stix_sro': stix_sro})
 
-                    if not is_valid:
-                        print("Validation failed. Requesting correction from LLM...")
-                        stix_sro = ti_stix.correct_invalid_stix(input_text, invalid_objects, stix_sdo, stix_sco, client, ai_service_provider, deployment_name)
-                    else:
-                        print("Validation successful. All objects are valid.")
-
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing STIX SRO: {e}")
-                    stix_sro = ti_stix.correct_invalid_stix(input_text, [], stix_sro)
-                except ValueError as e:
-                    print(e)
-                    stix_sro = ti_stix.correct_invalid_stix(input_text, [], stix_sro, stix_sco)
-
-                # Final validated STIX SRO as JSON string
-                stix_sro = json.dumps(stix_sro_data, indent=4)
-                st.session_state['stix_sro'] = stix_sro
-                with st.expander("See SRO JSON"):  
-                    st.code(stix_sro)
-            
-            #create STIX bundle
-            # Remove brackets and parse as JSON
-            stix_sdo_objects = json.loads(ti_stix.remove_brackets(stix_sdo))
-            stix_sco_objects = json.loads(ti_stix.remove_brackets(stix_sco))
-            stix_sro_objects = json.loads(ti_stix.remove_brackets(stix_sro))
-
-            # Create STIX bundle
-            stix_bundle = ti_stix.create_stix_bundle(stix_sdo_objects, stix_sco_objects, stix_sro_objects)
+            # Create STIX bundle, the bundle of the same objects is read from the artifact store with its GitHub URL
+            stored_bundle = report_artifact('stix', None)
+            if stored_bundle and stored_bundle['objects'] == [stix_sdo, stix_sco, stix_sro]:
+                stix_bundle = stored_bundle['bundle']
+            else:
+                stix_bundle = ti_stix.create_stix_bundle(stix_sdo_objects, stix_sco_objects, stix_sro_objects)
             with st.expander("See STIX 2.1 JSON Bundle"):  
                     st.code(stix_bundle)
             
             # Upload the layer data to GitHub and get the raw URL
-            stix_bundle_json = json.loads(stix_bundle)
-            raw_url_stix = ti_stix.upload_to_github_stix(stix_bundle_json)
+            if stored_bundle and stored_bundle['bundle'] == stix_bundle:
+                raw_url_stix = stored_bundle['raw_url']
+            else:
+                stix_bundle_json = json.loads(stix_bundle)
+                raw_url_stix = ti_stix.upload_to_github_stix(stix_bundle_json)
+                save_report_artifacts({'stix': {'objects': [stix_sdo, stix_sco, stix_sro], 'bundle': stix_bundle, 'raw_url': raw_url_stix}})
             
             # Embed the STIX Visualizer in an iframe
             stix_iframe_url = f"https://oasis-open.github.io/cti-stix-visualization/?url={raw_url_stix}"